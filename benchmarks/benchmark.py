@@ -0,0 +1,232 @@
+## Author: Alexander Art
+
+# Headless performance benchmarks for rendering, painting, and UI dispatch.
+# Run from the repository root:
+#     python -m benchmarks.benchmark --output results.json
+#     python -m benchmarks.benchmark --baseline results.json
+# No window is opened (SDL_VIDEODRIVER=dummy), so this also works on machines without a display.
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+import numpy
+import pygame
+
+import modules.layers
+import modules.settings
+import modules.utils
+from tile_art_helper import create_ui
+
+DISPLAY_SIZE = (1280, 720)
+
+# The dummy video driver has no mouse, so the benchmarks move a simulated one.
+# Everything in the program reads the mouse through pygame.mouse.get_pos().
+simulated_mouse_pos = [0, 0]
+
+def get_simulated_mouse_pos():
+    return tuple(simulated_mouse_pos)
+
+def set_mouse_pos(pos):
+    simulated_mouse_pos[0] = pos[0]
+    simulated_mouse_pos[1] = pos[1]
+
+def time_runs(function, runs):
+    # Call function runs times (after one warm-up call) and return the duration of each call in milliseconds.
+    function()
+    durations = []
+    for run in range(runs):
+        start = time.perf_counter()
+        function()
+        durations.append((time.perf_counter() - start) * 1000)
+    return durations
+
+def summarize(durations):
+    return {'median_ms': statistics.median(durations), 'min_ms': min(durations), 'runs': len(durations)}
+
+def create_test_image(size):
+    # Random noise, so that nothing about the image is cheaper than a real texture
+    random_state = numpy.random.RandomState(0)
+    image = pygame.Surface((size, size), pygame.SRCALPHA).convert_alpha()
+    pygame.surfarray.pixels3d(image)[:] = random_state.randint(0, 256, (size, size, 3))
+    pygame.surfarray.pixels_alpha(image)[:] = 255
+    return image
+
+def create_loaded_ui(display, image_size, layer_count=1):
+    # Load the image the same way the canvas does when a file is opened, so rendering and painting go through the layers
+    ui = create_ui(display)
+    ui.canvas.layers = modules.layers.LayerStack(create_test_image(image_size))
+    ui.canvas.loaded_image = ui.canvas.layers.get_active_surface()
+    ui.canvas.image_loaded = True
+    # Empty layers are added above the image, which makes the canvas flatten them every time they are painted
+    for layer in range(layer_count - 1):
+        ui.canvas.add_layer()
+    return ui
+
+def benchmark_render(display, image_sizes, zoom_levels, runs):
+    results = {}
+    for tiling_enabled in (True, False):
+        modules.settings.tiling_enabled = tiling_enabled
+        for image_size in image_sizes:
+            ui = create_loaded_ui(display, image_size)
+            canvas = ui.canvas
+            canvas.tiling_enabled = tiling_enabled
+            for zoom in zoom_levels:
+                canvas.zoom = zoom
+                canvas.render(display)
+
+                # A frame where the view moved (panning), which redraws the whole canvas
+                def pan_frame():
+                    canvas.scroll[0] -= 1
+                    canvas.render(display)
+                # A frame where nothing changed
+                def idle_frame():
+                    canvas.render(display)
+
+                name = f"render/{'tiled' if tiling_enabled else 'single'}/{image_size}px/zoom_{zoom}"
+                results[name + '/pan'] = summarize(time_runs(pan_frame, runs))
+                results[name + '/idle'] = summarize(time_runs(idle_frame, runs))
+    modules.settings.tiling_enabled = True
+    return results
+
+def benchmark_strokes(display, image_size, brush_sizes, runs):
+    results = {}
+    # A single layer is shown as it is. With two layers, every painted rect is flattened again.
+    for layer_count in (1, 2):
+        ui = create_loaded_ui(display, image_size, layer_count)
+        canvas = ui.canvas
+        brush = ui.brush
+        set_mouse_pos((DISPLAY_SIZE[0] // 2, DISPLAY_SIZE[1] // 2))
+        canvas.mouse_over(True)
+        for shape in ('pixel', 'brush', 'circle'):
+            brush.shape = shape
+            for brush_size in brush_sizes:
+                if shape == 'pixel' and brush_size != brush_sizes[0]:
+                    continue # The pixel brush is not affected by the size
+                brush.size = brush_size
+                canvas.render(display)
+
+                # One frame of a stroke: a burst of mouse motion events followed by the render that paints them
+                def stroke_frame():
+                    canvas.left_mouse_down()
+                    for motion in range(20):
+                        canvas.mouse_moved((3, 1))
+                    canvas.render(display)
+                    canvas.left_mouse_up()
+
+                name = f"stroke/{shape}" if shape == 'pixel' else f"stroke/{shape}/size_{brush_size}"
+                if layer_count > 1:
+                    name += f"/layers_{layer_count}"
+                results[name] = summarize(time_runs(stroke_frame, runs))
+    return results
+
+def benchmark_overlay_pixel(runs):
+    image = create_test_image(256)
+    def overlay_pixels():
+        for index in range(1000):
+            modules.utils.overlay_pixel(image, (index % 256, index // 256), (255, 0, 255, 127))
+    return {'overlay_pixel/1000_calls': summarize(time_runs(overlay_pixels, runs))}
+
+def benchmark_ui(display, runs):
+    results = {}
+    ui = create_loaded_ui(display, 256)
+    random_state = numpy.random.RandomState(1)
+    mouse_positions = random_state.randint(0, DISPLAY_SIZE[0], (runs + 1, 2)) * (1, DISPLAY_SIZE[1] / DISPLAY_SIZE[0])
+
+    positions = iter(list(mouse_positions) * 2)
+    def mouse_over_frame():
+        set_mouse_pos(next(positions).astype(int))
+        ui.main_panel.mouse_over(ui.main_panel.get_global_bounding_rect().collidepoint(pygame.mouse.get_pos()))
+    results['ui/mouse_over'] = summarize(time_runs(mouse_over_frame, runs))
+
+    # Rendering the whole UI tree when nothing changed
+    def render_frame():
+        ui.main_panel.render(display)
+    results['ui/render'] = summarize(time_runs(render_frame, runs))
+
+    # Rendering the whole UI tree while a slider is being dragged
+    def render_changed_frame():
+        ui.red_slider.percentage = (ui.red_slider.percentage + 0.01) % 1
+        ui.main_panel.render(display)
+    results['ui/render_slider_changed'] = summarize(time_runs(render_changed_frame, runs))
+    return results
+
+def compare(results, baseline, threshold):
+    # Print how each result changed from the baseline and return the names of the ones that got slower by more than threshold (a fraction).
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            print(f"{name}: {result['median_ms']:.3f} ms (new)")
+            continue
+        baseline_ms = baseline[name]['median_ms']
+        change = (result['median_ms'] - baseline_ms) / baseline_ms if baseline_ms > 0 else 0
+        flag = ''
+        if change > threshold:
+            flag = '  <-- REGRESSION'
+            regressions.append(name)
+        print(f"{name}: {baseline_ms:.3f} ms -> {result['median_ms']:.3f} ms ({change:+.0%}){flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless benchmarks for Tile Art Helper.")
+    parser.add_argument('--output', help="write the results to this JSON file")
+    parser.add_argument('--baseline', help="compare the results with this JSON file from a previous run")
+    parser.add_argument('--threshold', type=float, default=0.2, help="slowdown (as a fraction) that counts as a regression (default 0.2)")
+    parser.add_argument('--runs', type=int, default=10, help="timed runs of each benchmark (default 10)")
+    parser.add_argument('--quick', action='store_true', help="only use small images and a few zoom levels")
+    arguments = parser.parse_args()
+
+    pygame.init()
+    display = pygame.display.set_mode(DISPLAY_SIZE)
+    pygame.mouse.get_pos = get_simulated_mouse_pos
+
+    if arguments.quick:
+        image_sizes = [256]
+        zoom_levels = [0.5, 4]
+        brush_sizes = [5]
+    else:
+        image_sizes = [256, 1024, 2048]
+        zoom_levels = [0.1, 0.5, 1, 4, 20]
+        brush_sizes = [1, 5, 20, 50]
+
+    results = {}
+    results.update(benchmark_render(display, image_sizes, zoom_levels, arguments.runs))
+    results.update(benchmark_strokes(display, 1024, brush_sizes, arguments.runs))
+    results.update(benchmark_overlay_pixel(arguments.runs))
+    results.update(benchmark_ui(display, arguments.runs))
+    pygame.quit()
+
+    output = {
+        'meta': {
+            'python': platform.python_version(),
+            'pygame': pygame.version.ver,
+            'numpy': numpy.__version__,
+            'machine': platform.machine(),
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        },
+        'results': results,
+    }
+
+    if arguments.output:
+        with open(arguments.output, 'w') as output_file:
+            json.dump(output, output_file, indent=2)
+
+    if arguments.baseline:
+        with open(arguments.baseline) as baseline_file:
+            baseline = json.load(baseline_file)['results']
+        regressions = compare(results, baseline, arguments.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s) over {arguments.threshold:.0%}")
+            sys.exit(1)
+    else:
+        for name, result in results.items():
+            print(f"{name}: {result['median_ms']:.3f} ms")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+## Author: Alexander Art
+
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pygame
+
+import modules.batch
+import modules.image_io
+import modules.profiler
+from modules.scaled_image_cache import replace_region
+
+# Tilesets: many tiles of the same size, opened together from a folder of images or from a single spritesheet with a grid of tiles.
+# Every tile is kept in one shared atlas surface, laid out in a grid. The canvas paints straight into the tile's part of the atlas, so switching tiles does not decode any files.
+# A spritesheet is decoded once when it is opened (it already is an atlas). The tiles of a folder are decoded lazily on a pool of worker threads, when they are first shown or selected.
+
+# Number of worker threads that decode the tiles of a folder
+decode_workers = 4
+
+def parse_tile_size(text):
+    # Parse a tile size such as "32x32" (or "32" for square tiles). Raises ValueError if the text is not valid.
+    width, _, height = text.strip().lower().partition('x')
+    tile_size = (int(width), int(height or width))
+    if tile_size[0] <= 0 or tile_size[1] <= 0:
+        raise ValueError("The tile size must be positive")
+    return tile_size
+
+# Opening a tileset runs one of these on a worker thread. They return (file path of each tile or None, image, tile size).
+
+def read_folder(folder):
+    # The first image of the folder decides the size of every tile
+    filepaths = [os.path.join(folder, filename) for filename in modules.batch.find_images(folder)]
+    if not filepaths:
+        raise pygame.error("There are no images in the folder")
+    first_tile = pygame.image.load(filepaths[0])
+    return filepaths, first_tile, first_tile.get_size()
+
+def read_sheet(filepath, tile_size):
+    return None, pygame.image.load(filepath), tile_size
+
+def write_images(images):
+    # Runs on a worker thread. images is a list of (file path, RGBA bytes, size).
+    for filepath, pixels, size in images:
+        modules.image_io.write_image(pixels, size, filepath)
+
+# Class for the tiles of a tileset, kept in one shared atlas surface
+class TileAtlas:
+    def __init__(self, tile_size, tile_count, columns=None, surface=None):
+        self.tile_size = tile_size
+        self.tile_count = tile_count
+        # Tiles per row of the atlas. Folders are laid out about as wide as they are high.
+        if columns is None:
+            columns = math.ceil(math.sqrt(tile_count))
+        self.columns = columns
+
+        if surface is None:
+            surface = pygame.Surface((columns * tile_size[0], math.ceil(tile_count / columns) * tile_size[1]), pygame.SRCALPHA)
+            modules.profiler.count('surfaces')
+        self.surface = surface
+
+        # Name of each tile, shown when it is selected
+        self.names = [f"Tile {index + 1}" for index in range(tile_count)]
+        # The spritesheet the atlas was opened from, or None
+        self.sheet_filepath = None
+        # The file of each tile if the atlas was opened from a folder, or None
+        self.filepaths = None
+
+        # Whether the pixels of each tile are in the atlas yet, and whether the tile could not be decoded
+        self.loaded = [True] * tile_count
+        self.failed = [False] * tile_count
+        # Goes up whenever the pixels of a tile change, so that thumbnails of the tile know to update
+        self.versions = [0] * tile_count
+        # Tiles that were changed since they were last saved, and the tiles of the save that is in progress
+        self.modified = set()
+        self.saving_tiles = set()
+
+        # Tiles being decoded on the worker threads, as {tile index: future}
+        self.executor = None
+        self.pending = {}
+
+    def get_tile_rect(self, index):
+        return pygame.Rect(index % self.columns * self.tile_size[0], index // self.columns * self.tile_size[1], self.tile_size[0], self.tile_size[1])
+
+    def get_tile_surface(self, index):
+        # The tile's part of the atlas. Painting on it paints on the atlas.
+        return self.surface.subsurface(self.get_tile_rect(index))
+
+    def request_tile(self, index):
+        # Start decoding a tile of a folder on a worker thread, unless it is already loaded or being decoded
+        if self.loaded[index] or self.failed[index] or index in self.pending:
+            return
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=decode_workers)
+        self.pending[index] = self.executor.submit(pygame.image.load, self.filepaths[index])
+
+    def is_busy(self):
+        return len(self.pending) > 0
+
+    def update(self):
+        # Runs every frame on the main thread. Puts the tiles that finished decoding into the atlas.
+        # Returns the indices of the tiles that were loaded.
+        loaded_tiles = []
+        for index, future in list(self.pending.items()):
+            if not future.done():
+                continue
+            del self.pending[index]
+            try:
+                tile = future.result()
+            except (OSError, pygame.error) as error:
+                print(f"Could not open {self.filepaths[index]}: {error}")
+                self.failed[index] = True
+                continue
+            if tile.get_size() != self.tile_size:
+                print(f"{self.filepaths[index]} is not the size of the other tiles ({self.tile_size[0]}x{self.tile_size[1]})")
+                self.failed[index] = True
+                continue
+            tile_rect = self.get_tile_rect(index)
+            replace_region(self.surface, tile.convert_alpha(), tile_rect.topleft, tile_rect)
+            self.loaded[index] = True
+            self.versions[index] += 1
+            loaded_tiles.append(index)
+        return loaded_tiles
+
+    def mark_modified(self, index):
+        self.modified.add(index)
+        self.versions[index] += 1
+
+    def close(self):
+        # Stop decoding tiles
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+        self.pending = {}
+
+    def get_save_images(self):
+        # Returns what saving writes, as (file path, RGBA bytes, size): the whole spritesheet, or each modified tile of a folder
+        if self.sheet_filepath is not None:
+            return [(self.sheet_filepath, pygame.image.tobytes(self.surface, 'RGBA'), self.surface.get_size())]
+        return [(self.filepaths[index], pygame.image.tobytes(self.get_tile_surface(index), 'RGBA'), self.tile_size) for index in sorted(self.modified)]
+
+def start_open_folder(folder):
+    task = modules.image_io.ImageTask('open_tileset', folder)
+    task.start(read_folder, folder)
+    return task
+
+def start_open_sheet(filepath, tile_size):
+    task = modules.image_io.ImageTask('open_tileset', filepath)
+    task.start(read_sheet, filepath, tile_size)
+    return task
+
+def finish_open_tileset(task):
+    # Called on the main thread once an 'open_tileset' task is done. Returns the TileAtlas, or raises ValueError if the spritesheet is smaller than a tile.
+    filepaths, image, tile_size = task.result
+    if filepaths is not None:
+        atlas = TileAtlas(tile_size, len(filepaths))
+        atlas.filepaths = filepaths
+        atlas.names = [os.path.basename(filepath) for filepath in filepaths]
+        atlas.loaded = [False] * len(filepaths)
+        # The first tile was already decoded to find the tile size
+        replace_region(atlas.surface, image.convert_alpha(), (0, 0), atlas.get_tile_rect(0))
+        atlas.loaded[0] = True
+        return atlas
+
+    # The spritesheet is used as the atlas as it is, so pixels outside of the tile grid are kept when it is saved
+    sheet = image.convert_alpha()
+    columns = sheet.get_width() // tile_size[0]
+    rows = sheet.get_height() // tile_size[1]
+    if columns == 0 or rows == 0:
+        raise ValueError("The spritesheet is smaller than a tile")
+    atlas = TileAtlas(tile_size, columns * rows, columns, sheet)
+    atlas.sheet_filepath = task.filepath
+    atlas.names = [f"Row {index // columns + 1}, column {index % columns + 1}" for index in range(columns * rows)]
+    return atlas
+
+def start_save_atlas(atlas):
+    # The pixels are copied before the task starts, so the tiles can keep being painted while they are saved
+    images = atlas.get_save_images()
+    atlas.saving_tiles = set(atlas.modified)
+    atlas.modified = set()
+    task = modules.image_io.ImageTask('save_tileset', atlas.sheet_filepath or os.path.dirname(atlas.filepaths[0]))
+    task.start(write_images, images)
+    return task
@@ -0,0 +1,94 @@
+## Author: Alexander Art
+
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import pygame
+
+import modules.image_ops
+
+# Command line mode that applies image operations to every image in a folder, without opening a window:
+#     python tile_art_helper.py batch offset:half,recolor:30,resize:64x64 input_folder output_folder
+# The images are spread over a pool of worker processes (one per CPU core by default).
+
+image_extensions = ('.png', '.bmp', '.tga', '.jpg', '.jpeg', '.gif', '.webp')
+
+def process_file(input_filepath, output_filepath, operations):
+    # Runs in a worker process. Returns (file name, load seconds, operation seconds, save seconds, error message or None).
+    start = time.perf_counter()
+    try:
+        image = modules.image_ops.to_rgba_surface(pygame.image.load(input_filepath))
+        loaded = time.perf_counter()
+        image = modules.image_ops.apply_operations(image, operations)
+        processed = time.perf_counter()
+        pygame.image.save(image, output_filepath)
+        saved = time.perf_counter()
+    except (OSError, pygame.error, ValueError) as error:
+        return (os.path.basename(input_filepath), 0, 0, time.perf_counter() - start, str(error))
+    return (os.path.basename(input_filepath), loaded - start, processed - loaded, saved - processed, None)
+
+def find_images(input_folder):
+    return sorted(filename for filename in os.listdir(input_folder) if filename.lower().endswith(image_extensions))
+
+def run_batch(operations, input_folder, output_folder, workers=None):
+    # Process every image of input_folder into output_folder. Returns the results of process_file() in the order the files finished.
+    os.makedirs(output_folder, exist_ok=True)
+    filenames = find_images(input_folder)
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    # Only a few files per worker are handed out at a time, so memory stays bounded no matter how many files there are
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        running = set()
+        for filename in filenames:
+            if len(running) >= workers * 2:
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                results.extend(future.result() for future in done)
+            running.add(executor.submit(process_file, os.path.join(input_folder, filename), os.path.join(output_folder, filename), operations))
+        results.extend(future.result() for future in wait(running)[0])
+    return results
+
+def print_report(results, elapsed_time):
+    # Print the timing of every file, slowest first, and the totals
+    print(f"{'file':<40}{'load':>10}{'ops':>10}{'save':>10}{'total':>10}")
+    for filename, load_time, operation_time, save_time, error in sorted(results, key=lambda result: -(result[1] + result[2] + result[3])):
+        total_time = load_time + operation_time + save_time
+        line = f"{filename:<40}{load_time * 1000:>8.1f}ms{operation_time * 1000:>8.1f}ms{save_time * 1000:>8.1f}ms{total_time * 1000:>8.1f}ms"
+        if error is not None:
+            line += f"  FAILED: {error}"
+        print(line)
+
+    failed_count = sum(1 for result in results if result[4] is not None)
+    total_time = sum(result[1] + result[2] + result[3] for result in results)
+    print(f"{len(results)} files ({failed_count} failed) in {elapsed_time:.2f}s, {total_time:.2f}s of work")
+
+def main(arguments):
+    # Returns the exit code
+    parser = argparse.ArgumentParser(prog="tile_art_helper.py batch", description="Apply operations to every image in a folder.")
+    parser.add_argument('operations', help="comma separated operations, for example offset:half,recolor:30,resize:64x64 "
+                                           "(offset:half, offset:<x>x<y>, seam_blend:<width>, recolor:<hue degrees>, resize:<width>x<height>, resize_sharp:<width>x<height>)")
+    parser.add_argument('input_folder')
+    parser.add_argument('output_folder')
+    parser.add_argument('--workers', type=int, default=None, help="number of worker processes (default: one per CPU core)")
+    arguments = parser.parse_args(arguments)
+    if arguments.workers is not None and arguments.workers < 1:
+        parser.error("--workers must be at least 1")
+
+    try:
+        operations = modules.image_ops.parse_operations(arguments.operations)
+    except ValueError as error:
+        print(f"Invalid operations: {error}")
+        return 2
+    if not os.path.isdir(arguments.input_folder):
+        print(f"Input folder not found: {arguments.input_folder}")
+        return 2
+
+    start = time.perf_counter()
+    results = run_batch(operations, arguments.input_folder, arguments.output_folder, arguments.workers)
+    print_report(results, time.perf_counter() - start)
+    if any(result[4] is not None for result in results):
+        return 1
+    return 0
@@ -1,5 +1,10 @@
 ## Author: Alexander Art
 
+from collections import OrderedDict
+
+import modules.shapes
+import modules.stamp
+
 # Class for brush objects
 class Brush:
     def __init__(self):
@@ -7,7 +12,15 @@ class Brush:
         self.shape = 'pixel'
         self.color = (255, 0, 255, 255)
         self.size = 5
+        self.hardness = 0 # Only used by the brush shape. 0 fades out from the center, 1 is fully opaque.
+        self.tolerance = 32 # Only used by the bucket shape. How much each channel of a pixel may differ from the clicked pixel to be filled (0-255).
 
+        # Precomputed stamp masks keyed by (shape, size, hardness), ordered from least to most recently used.
+        # Painting looks the masks up here instead of recalculating them for every stamp.
+        self.mask_cache = OrderedDict()
+        self.mask_cache_memory = 0
+        self.mask_cache_budget = 16 * 1024 * 1024 # Bytes
+        
     def set_brush_pixel(self):
         # Set brush shape to pixel (not affected by brush size)
         self.shape = 'pixel'
@@ -20,7 +33,22 @@ class Brush:
         # Set brush shape to circle
         self.shape = 'circle'
 
+    def set_brush_bucket(self):
+        # Set brush shape to bucket (fills the region of similar colors that was clicked)
+        self.shape = 'bucket'
+
+    def set_brush_line(self):
+        # Set brush shape to line (dragged from one point to another, see modules/shapes.py)
+        self.shape = 'line'
+
+    def set_brush_rectangle(self):
+        self.shape = 'rectangle'
+
+    def set_brush_ellipse(self):
+        self.shape = 'ellipse'
+
     def increase_brush_size(self):
+        # The masks for the new size are built the next time they are needed
         self.size += 1
 
     def decrease_brush_size(self):
@@ -29,3 +57,41 @@ class Brush:
     
     def get_brush_size_text(self):
         return str(self.size)
+
+    def increase_tolerance(self):
+        self.tolerance = min(255, self.tolerance + 8)
+
+    def decrease_tolerance(self):
+        self.tolerance = max(0, self.tolerance - 8)
+
+    def get_tolerance_text(self):
+        return str(self.tolerance)
+
+    def get_masks(self):
+        # Returns (coverage, opacity) arrays for a stamp of the current shape, size, and hardness.
+        # coverage says which pixels of the stamp get painted, opacity scales the alpha of the color for each pixel.
+        key = (self.shape, self.size, self.hardness)
+        if key in self.mask_cache:
+            # Mark the masks as the most recently used
+            self.mask_cache.move_to_end(key)
+            return self.mask_cache[key]
+
+        if self.shape == 'brush':
+            masks = modules.stamp.get_brush_masks(self.size, self.hardness)
+        elif self.shape in modules.shapes.shape_names:
+            # The outlines of shapes are about as many pixels wide as the brush size
+            coverage = modules.stamp.get_circle_mask((self.size - 1) // 2)
+            masks = (coverage, coverage.astype(float))
+        else:
+            coverage = modules.stamp.get_circle_mask(self.size)
+            masks = (coverage, coverage.astype(float))
+        masks_memory = masks[0].nbytes + masks[1].nbytes
+
+        # Evict the least recently used masks when the cache grows too large
+        while self.mask_cache and self.mask_cache_memory + masks_memory > self.mask_cache_budget:
+            evicted_masks = self.mask_cache.popitem(last=False)[1]
+            self.mask_cache_memory -= evicted_masks[0].nbytes + evicted_masks[1].nbytes
+
+        self.mask_cache[key] = masks
+        self.mask_cache_memory += masks_memory
+        return masks
@@ -0,0 +1,288 @@
+## Author: Alexander Art
+
+import tempfile
+from collections import OrderedDict
+
+import numpy
+import pygame
+
+import modules.profiler
+import modules.settings
+from modules.scaled_image_cache import replace_region, scale_region
+
+# Returns the surfaces that hold the pixels inside rect of an image (a pygame surface or a ChunkedImage).
+# The rect must be inside the image. Returns a list of (surface, rect on that surface, offset of that part relative to the top left corner of rect).
+def get_pieces(image, rect):
+    if isinstance(image, ChunkedImage):
+        return image.get_pieces(rect)
+    return [(image, pygame.Rect(rect), (0, 0))]
+
+# Returns a copy of the colors inside rect (which must be inside the image) of an image, indexed [x, y, channel] like pygame.surfarray.
+def read_colors(image, rect):
+    rect = pygame.Rect(rect)
+    if not isinstance(image, ChunkedImage):
+        return pygame.surfarray.array3d(image.subsurface(rect))
+    # Copy from one chunk at a time, without marking the chunks as modified
+    colors = numpy.empty((rect.width, rect.height, 3), dtype=numpy.uint8)
+    for key in image.get_chunks_in_rect(rect):
+        chunk_rect = image.get_chunk_rect(*key)
+        piece = rect.clip(chunk_rect)
+        if piece.width > 0 and piece.height > 0:
+            chunk_part = image.get_chunk(*key).subsurface(piece.move(-chunk_rect.left, -chunk_rect.top))
+            colors[piece.left - rect.left:piece.right - rect.left, piece.top - rect.top:piece.bottom - rect.top] = pygame.surfarray.array3d(chunk_part)
+    return colors
+
+# Returns a copy of the pixel values inside rect (which must be inside the image) of an image, indexed [x, y] like pygame.surfarray.pixels2d().
+# Each value is a whole 32 bit pixel in the format of the image's surfaces (see Surface.map_rgb()). The copy keeps the rows of the image contiguous (like the surfaces do), so array.T is fast to work on row by row.
+def read_pixels(image, rect):
+    rect = pygame.Rect(rect)
+    pixels = numpy.empty((rect.height, rect.width), dtype=numpy.uint32)
+    # Copy from one surface at a time, without marking the chunks as modified
+    if isinstance(image, ChunkedImage):
+        pieces = []
+        for key in image.get_chunks_in_rect(rect):
+            chunk_rect = image.get_chunk_rect(*key)
+            piece = rect.clip(chunk_rect)
+            if piece.width > 0 and piece.height > 0:
+                pieces.append((image.get_chunk(*key), piece.move(-chunk_rect.left, -chunk_rect.top), (piece.left - rect.left, piece.top - rect.top)))
+    else:
+        pieces = [(image, rect, (0, 0))]
+    for surface, surface_rect, offset in pieces:
+        surface_pixels = pygame.surfarray.pixels2d(surface)
+        pixels[offset[1]:offset[1] + surface_rect.height, offset[0]:offset[0] + surface_rect.width] = surface_pixels[surface_rect.left:surface_rect.right, surface_rect.top:surface_rect.bottom].T
+        del surface_pixels # Unlock the surface
+    return pixels.T
+
+# Returns the image as a single pygame surface (for saving). A ChunkedImage is put back together, which needs memory for the whole image.
+def to_surface(image):
+    if isinstance(image, ChunkedImage):
+        return image.to_surface()
+    return image
+
+# Bytes used by a 32 bit surface of the given size
+def size_memory(size):
+    return size[0] * size[1] * 4
+
+# Returns True if an image of the given size should be kept in chunks instead of a single surface.
+def should_chunk(size):
+    return modules.settings.chunked_images_enabled and size[0] * size[1] >= modules.settings.chunked_image_min_pixels
+
+# Class for very large images. The image is split into square chunks that are each their own surface.
+# When the chunks would use more memory than the budget, the least recently used ones are paged out to a temporary file and loaded again when needed.
+# Each chunk also keeps its own scaled rendition, so editing a chunk only rescales that chunk.
+class ChunkedImage:
+    def __init__(self, size, chunk_size=512, memory_budget=None, source=None):
+        # If source (a surface of the same size) is given, its pixels are copied into the chunks. Otherwise the image starts transparent.
+        self.width, self.height = size
+
+        # Side length (in pixels) of the chunks. The chunks on the right and bottom edges may be smaller.
+        self.chunk_size = chunk_size
+        self.columns = -(-self.width // chunk_size)
+        self.rows = -(-self.height // chunk_size)
+
+        # Maximum number of bytes of chunks to keep in memory. If None, modules.settings.chunked_image_memory_budget is used.
+        self.memory_budget = memory_budget
+
+        # Chunks that are in memory keyed by (column, row), ordered from least to most recently used
+        self.chunks = OrderedDict()
+        # Chunks whose pixels changed since they were last written to the page file
+        self.modified_chunks = set()
+        # Chunks that have a copy in the page file
+        self.paged_chunks = set()
+        # Temporary file that chunks are paged out to. Created the first time a chunk is paged out. Each chunk has a fixed slot in the file.
+        self.page_file = None
+
+        # Scaled renditions of chunks keyed by (column, row), ordered from least to most recently used. Each entry is (size, rendition).
+        # Renditions are only kept for zoom levels below 1, where they are smaller than the chunks. They are dropped when their chunk is edited.
+        self.renditions = OrderedDict()
+        self.rendition_memory = 0
+
+        for row in range(self.rows):
+            for column in range(self.columns):
+                chunk_rect = self.get_chunk_rect(column, row)
+                chunk = pygame.Surface(chunk_rect.size, pygame.SRCALPHA)
+                if source is not None:
+                    replace_region(chunk, source.subsurface(chunk_rect), (0, 0), chunk.get_rect())
+                self.store_chunk((column, row), chunk)
+
+    def get_size(self):
+        return (self.width, self.height)
+
+    def get_width(self):
+        return self.width
+
+    def get_height(self):
+        return self.height
+
+    def get_rect(self):
+        return pygame.Rect(0, 0, self.width, self.height)
+
+    def get_memory_budget(self):
+        if self.memory_budget is None:
+            return modules.settings.chunked_image_memory_budget
+        return self.memory_budget
+
+    def get_rendition_memory_budget(self):
+        # Scaled renditions may use up to a quarter of the memory budget on top of it
+        return self.get_memory_budget() // 4
+
+    def get_chunk_rect(self, column, row):
+        # Rect of the image that a chunk holds
+        left = column * self.chunk_size
+        top = row * self.chunk_size
+        return pygame.Rect(left, top, min(self.chunk_size, self.width - left), min(self.chunk_size, self.height - top))
+
+    def get_chunk(self, column, row):
+        # Returns the surface of a chunk, loading it from the page file if it was paged out.
+        key = (column, row)
+        if key in self.chunks:
+            self.chunks.move_to_end(key)
+            return self.chunks[key]
+
+        chunk_rect = self.get_chunk_rect(column, row)
+        self.page_file.seek(self.get_page_offset(key))
+        data = self.page_file.read(chunk_rect.width * chunk_rect.height * 4)
+        chunk = pygame.image.frombytes(data, chunk_rect.size, 'RGBA')
+        modules.profiler.count('surfaces')
+        self.store_chunk(key, chunk)
+        return chunk
+
+    def store_chunk(self, key, chunk):
+        # Keep a chunk in memory, paging out the least recently used chunks if that goes over the memory budget.
+        # A few chunks always stay in memory, since a single brush stamp can cover several of them.
+        chunk_memory = self.chunk_size * self.chunk_size * 4
+        while len(self.chunks) >= 16 and (len(self.chunks) + 1) * chunk_memory > self.get_memory_budget():
+            self.page_out(next(iter(self.chunks)))
+        self.chunks[key] = chunk
+
+    def get_page_offset(self, key):
+        return (key[1] * self.columns + key[0]) * self.chunk_size * self.chunk_size * 4
+
+    def page_out(self, key):
+        # Write a chunk to the page file (if its copy there is out of date) and remove it from memory
+        chunk = self.chunks.pop(key)
+        if key in self.modified_chunks or key not in self.paged_chunks:
+            if self.page_file is None:
+                self.page_file = tempfile.TemporaryFile()
+            self.page_file.seek(self.get_page_offset(key))
+            self.page_file.write(pygame.image.tobytes(chunk, 'RGBA'))
+            self.modified_chunks.discard(key)
+            self.paged_chunks.add(key)
+
+    def get_chunks_in_rect(self, rect):
+        # Returns the (column, row) of every chunk that rect (inside the image) overlaps
+        keys = []
+        for row in range(rect.top // self.chunk_size, -(-rect.bottom // self.chunk_size)):
+            for column in range(rect.left // self.chunk_size, -(-rect.right // self.chunk_size)):
+                keys.append((column, row))
+        return keys
+
+    def get_pieces(self, rect):
+        # Returns the parts of the chunks inside rect (which must be inside the image) as (chunk surface, rect on the chunk, offset relative to rect).
+        # The chunks are assumed to be edited, so they are marked as modified.
+        rect = pygame.Rect(rect)
+        pieces = []
+        for key in self.get_chunks_in_rect(rect):
+            chunk_rect = self.get_chunk_rect(*key)
+            piece = rect.clip(chunk_rect)
+            if piece.width == 0 or piece.height == 0:
+                continue
+            self.modified_chunks.add(key)
+            pieces.append((self.get_chunk(*key), piece.move(-chunk_rect.left, -chunk_rect.top), (piece.left - rect.left, piece.top - rect.top)))
+        return pieces
+
+    def get_at(self, pos):
+        column, row = pos[0] // self.chunk_size, pos[1] // self.chunk_size
+        return self.get_chunk(column, row).get_at((pos[0] - column * self.chunk_size, pos[1] - row * self.chunk_size))
+
+    def set_at(self, pos, color):
+        column, row = pos[0] // self.chunk_size, pos[1] // self.chunk_size
+        self.modified_chunks.add((column, row))
+        self.get_chunk(column, row).set_at((pos[0] - column * self.chunk_size, pos[1] - row * self.chunk_size), color)
+
+    def mark_dirty(self, rect):
+        # Drop the scaled renditions of the chunks that rect (inside the image) overlaps. Called after the pixels inside rect were edited.
+        for key in self.get_chunks_in_rect(pygame.Rect(rect)):
+            if key in self.renditions:
+                self.rendition_memory -= size_memory(self.renditions.pop(key)[0])
+
+    def copy_from(self, surface):
+        # Replace the pixels of every chunk with the pixels of a surface of the same size.
+        # One chunk is loaded at a time, so this also works when the chunks do not all fit in memory.
+        for row in range(self.rows):
+            for column in range(self.columns):
+                chunk_rect = self.get_chunk_rect(column, row)
+                replace_region(self.get_chunk(column, row), surface.subsurface(chunk_rect), (0, 0), pygame.Rect((0, 0), chunk_rect.size))
+                self.modified_chunks.add((column, row))
+        self.mark_dirty(self.get_rect())
+
+    def to_surface(self):
+        surface = pygame.Surface((self.width, self.height), pygame.SRCALPHA)
+        for row in range(self.rows):
+            for column in range(self.columns):
+                chunk_rect = self.get_chunk_rect(column, row)
+                replace_region(surface, self.get_chunk(column, row), chunk_rect.topleft, chunk_rect)
+        return surface
+
+    def get_scaled_chunk_rect(self, column, row, scaled_size):
+        # Rect that a chunk covers once the whole image is scaled to scaled_size
+        chunk_rect = self.get_chunk_rect(column, row)
+        left = chunk_rect.left * scaled_size[0] // self.width
+        top = chunk_rect.top * scaled_size[1] // self.height
+        right = chunk_rect.right * scaled_size[0] // self.width
+        bottom = chunk_rect.bottom * scaled_size[1] // self.height
+        return pygame.Rect(left, top, right - left, bottom - top)
+
+    def draw_scaled(self, surface, region, image_pos, scaled_size):
+        # Draw the part of the image scaled to scaled_size and positioned at image_pos that falls inside region (a rect of surface).
+        visible_rect = pygame.Rect(image_pos, scaled_size).clip(region)
+        if visible_rect.width == 0 or visible_rect.height == 0:
+            return
+
+        # Chunks whose scaled rect overlaps the visible part
+        scaled_region = visible_rect.move(-image_pos[0], -image_pos[1])
+        first_column = scaled_region.left * self.width // scaled_size[0] // self.chunk_size
+        last_column = min(self.columns - 1, (scaled_region.right - 1) * self.width // scaled_size[0] // self.chunk_size)
+        first_row = scaled_region.top * self.height // scaled_size[1] // self.chunk_size
+        last_row = min(self.rows - 1, (scaled_region.bottom - 1) * self.height // scaled_size[1] // self.chunk_size)
+
+        surface.set_clip(visible_rect)
+        for row in range(first_row, last_row + 1):
+            for column in range(first_column, last_column + 1):
+                scaled_chunk_rect = self.get_scaled_chunk_rect(column, row, scaled_size)
+                if scaled_chunk_rect.width == 0 or scaled_chunk_rect.height == 0:
+                    continue
+                chunk_pos = (image_pos[0] + scaled_chunk_rect.left, image_pos[1] + scaled_chunk_rect.top)
+
+                chunk_size = self.get_chunk_rect(column, row).size
+                if scaled_chunk_rect.size == chunk_size:
+                    # Not scaled at all
+                    surface.blit(self.get_chunk(column, row), chunk_pos)
+                elif scaled_chunk_rect.width < chunk_size[0] and scaled_chunk_rect.height < chunk_size[1]:
+                    # Zoomed out, so the scaled chunk is smaller than the chunk and is worth keeping
+                    surface.blit(self.get_rendition(column, row, scaled_chunk_rect.size), chunk_pos)
+                else:
+                    # Zoomed in, so only scale the part of the chunk that can be seen
+                    visible_part = scaled_region.clip(scaled_chunk_rect).move(-scaled_chunk_rect.left, -scaled_chunk_rect.top)
+                    scaled_part, scaled_pos = scale_region(self.get_chunk(column, row), scaled_chunk_rect.size, visible_part)
+                    surface.blit(scaled_part, (chunk_pos[0] + scaled_pos[0], chunk_pos[1] + scaled_pos[1]))
+        surface.set_clip(None)
+
+    def get_rendition(self, column, row, size):
+        # Returns the chunk scaled to size, scaling it only if it was edited or scaled to a different size since last time.
+        key = (column, row)
+        if key in self.renditions:
+            if self.renditions[key][0] == size:
+                self.renditions.move_to_end(key)
+                return self.renditions[key][1]
+            self.rendition_memory -= size_memory(self.renditions.pop(key)[0])
+
+        # Forget the least recently used renditions until the new one fits
+        while self.renditions and self.rendition_memory + size_memory(size) > self.get_rendition_memory_budget():
+            self.rendition_memory -= size_memory(self.renditions.popitem(last=False)[1][0])
+
+        rendition = pygame.transform.smoothscale(self.get_chunk(column, row), size)
+        modules.profiler.count('surfaces')
+        self.renditions[key] = (size, rendition)
+        self.rendition_memory += size_memory(size)
+        return rendition
@@ -0,0 +1,103 @@
+## Author: Alexander Art
+
+import numpy
+import pygame
+
+import modules.chunked_image
+import modules.stamp
+
+# Bucket fill: fills the region of similar colors around a pixel.
+# Instead of visiting pixels one at a time, every row of the image is split into spans (runs of pixels that match the color that was clicked),
+# which is done for the whole image at once with numpy. The fill then only walks from span to span, going to the spans that touch it in the rows above and below.
+# Like the image tiles, the region continues across the edges: the rows above the top row are the bottom rows, and a span that reaches the right edge touches the one that starts at the left edge.
+
+# The image is read in bands of this many rows at a time, so a big image does not need a huge temporary array
+read_band_height = 256
+
+def get_match_mask(image, seed_pixel, tolerance):
+    # Returns an array (indexed [y, x], with one extra column that is always False) of which pixels are within tolerance of seed_pixel in every channel (including alpha)
+    width, height = image.get_size()
+    seed_channels = numpy.array([seed_pixel], dtype=numpy.uint32).view(numpy.uint8)
+    mask = numpy.zeros((height, width + 1), dtype=bool)
+    for top in range(0, height, read_band_height):
+        band_height = min(read_band_height, height - top)
+        band = modules.chunked_image.read_pixels(image, (0, top, width, band_height)).T
+        if tolerance == 0:
+            mask[top:top + band_height, :width] = band == seed_pixel
+            continue
+        # Compare the channels one at a time, as bytes, so no wider temporary arrays are needed
+        channels = band.view(numpy.uint8).reshape(band_height, width, 4)
+        band_mask = mask[top:top + band_height, :width]
+        band_mask[:] = True
+        for channel in range(4):
+            low = max(0, int(seed_channels[channel]) - tolerance)
+            high = min(255, int(seed_channels[channel]) + tolerance)
+            # Values below low wrap around to big numbers when low is subtracted, so a single comparison checks both bounds
+            band_mask &= channels[:, :, channel] - numpy.uint8(low) <= high - low
+    return mask
+
+def find_spans(mask):
+    # Returns (rows, starts, ends) arrays of every span of True in the mask, in row order and left to right within a row
+    stride = mask.shape[1]
+    pixels = mask.ravel()
+    changes = numpy.flatnonzero(pixels[1:] != pixels[:-1]) + 1
+    if pixels[0]:
+        changes = numpy.concatenate(([0], changes))
+    # The extra False column ends every span on its own row, so span starts and ends alternate
+    span_starts = changes[0::2]
+    span_ends = changes[1::2]
+    rows = span_starts // stride
+    return rows, span_starts - rows * stride, span_ends - rows * stride
+
+def find_region(image, pos, tolerance):
+    # Returns the region that a bucket fill at pos (in image pixels) fills (see modules.stamp.get_spans_region())
+    width, height = image.get_size()
+    seed_pixel = int(modules.chunked_image.read_pixels(image, (pos[0], pos[1], 1, 1))[0, 0])
+    rows, starts, ends = find_spans(get_match_mask(image, seed_pixel, tolerance))
+
+    # For every span, the range of spans that touch it in the row below and in the row above (rows wrap around).
+    # Span positions are compared as positions in the flattened mask, where each row takes width + 1 pixels.
+    stride = width + 1
+    flat_starts = rows * stride + starts
+    flat_ends = rows * stride + ends
+    below_rows = (rows + 1) % height * stride
+    above_rows = (rows - 1) % height * stride
+    below_first = numpy.searchsorted(flat_ends, below_rows + starts, 'right').tolist()
+    below_last = numpy.searchsorted(flat_starts, below_rows + ends, 'left').tolist()
+    above_first = numpy.searchsorted(flat_ends, above_rows + starts, 'right').tolist()
+    above_last = numpy.searchsorted(flat_starts, above_rows + ends, 'left').tolist()
+
+    # Spans that reach the right edge touch the span at the left edge of the same row, if there is one
+    row_first_spans = numpy.searchsorted(rows, numpy.arange(height))
+    row_last_spans = numpy.searchsorted(rows, numpy.arange(height), 'right') - 1
+    wrap_neighbors = numpy.full(len(rows), -1)
+    wraps = (ends == width) & (starts[row_first_spans[rows]] == 0)
+    wrap_neighbors[wraps] = row_first_spans[rows[wraps]]
+    wraps = (starts == 0) & (ends[row_last_spans[rows]] == width)
+    wrap_neighbors[wraps] = row_last_spans[rows[wraps]]
+    wrap_neighbors = wrap_neighbors.tolist()
+
+    # The span that holds the clicked pixel
+    first_span = int(numpy.searchsorted(flat_starts, pos[1] * stride + pos[0], 'right')) - 1
+
+    # Walk from span to span. A span is filled if it touches a filled span.
+    filled = bytearray(len(rows))
+    filled[first_span] = 1
+    stack = [first_span]
+    while stack:
+        span = stack.pop()
+        for neighbor in range(below_first[span], below_last[span]):
+            if not filled[neighbor]:
+                filled[neighbor] = 1
+                stack.append(neighbor)
+        for neighbor in range(above_first[span], above_last[span]):
+            if not filled[neighbor]:
+                filled[neighbor] = 1
+                stack.append(neighbor)
+        neighbor = wrap_neighbors[span]
+        if neighbor >= 0 and not filled[neighbor]:
+            filled[neighbor] = 1
+            stack.append(neighbor)
+
+    filled_spans = numpy.flatnonzero(numpy.frombuffer(bytes(filled), dtype=numpy.uint8))
+    return modules.stamp.get_spans_region(rows[filled_spans], starts[filled_spans], ends[filled_spans])
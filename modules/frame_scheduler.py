@@ -0,0 +1,61 @@
+## Author: Alexander Art
+
+import pygame
+
+# Class for pacing the frame loop.
+# Input is handled every frame, but rendering only happens as often as it can keep up with.
+# When nothing is happening, the frame loop sleeps until an event arrives instead of redrawing at full speed.
+class FrameScheduler:
+    def __init__(self, max_fps=60, min_fps=15, idle_timeout=500):
+        # The clock is kept between frames so that tick() actually limits the frame rate
+        self.clock = pygame.time.Clock()
+
+        # Frames per second of input handling, and the range that the redraw rate is allowed to adapt within
+        self.max_fps = max_fps
+        self.min_fps = min_fps
+
+        # Longest time (in milliseconds) to sleep while idle, so that things that change over time still get shown
+        self.idle_timeout = idle_timeout
+
+        # Milliseconds between redraws. Grows when rendering is slow (for example while painting with a big brush) and shrinks again when it is fast.
+        self.render_interval = 1000 / max_fps
+        # Smoothed duration of recent renders in milliseconds
+        self.render_duration = 0
+        self.last_render_start = None
+        self.last_render_end = 0
+
+        # True if a frame was not rendered because it was too soon after the previous render
+        self.render_pending = True
+
+    def get_events(self, busy):
+        # Returns the events for this frame.
+        # If nothing is busy and no render is pending, wait for the next event (or the idle timeout) instead of spinning.
+        if not busy and not self.render_pending:
+            event = pygame.event.wait(self.idle_timeout)
+            if event.type == pygame.NOEVENT:
+                return []
+            return [event] + pygame.event.get()
+        return pygame.event.get()
+
+    def should_render(self, events):
+        # Returns True if this frame should be rendered.
+        # Frames with no events are rendered right away so that the last changes show up before going idle.
+        if not events or pygame.time.get_ticks() - self.last_render_end >= self.render_interval:
+            self.render_pending = False
+            return True
+        self.render_pending = True
+        return False
+
+    def begin_render(self):
+        self.last_render_start = pygame.time.get_ticks()
+
+    def end_render(self):
+        # Adapt the redraw rate to how long rendering took.
+        # Rendering is allowed up to half of the time between redraws, leaving the rest for handling input.
+        self.last_render_end = pygame.time.get_ticks()
+        self.render_duration = self.render_duration * 0.75 + (self.last_render_end - self.last_render_start) * 0.25
+        self.render_interval = min(max(self.render_duration * 2, 1000 / self.max_fps), 1000 / self.min_fps)
+
+    def tick(self):
+        # Limit the frame rate of input handling
+        self.clock.tick(self.max_fps)
@@ -0,0 +1,145 @@
+## Author: Alexander Art
+
+import zlib
+
+import pygame
+
+import modules.chunked_image
+import modules.settings
+import modules.utils
+from modules.scaled_image_cache import replace_region
+
+# Returns the compressed pixels (RGBA) inside tile_rect of an image.
+# The image may be split into several surfaces (see modules/chunked_image.py), so the tile is copied together from each of them.
+def save_tile(image, tile_rect):
+    tile = pygame.Surface(tile_rect.size, pygame.SRCALPHA)
+    for surface, surface_rect, offset in modules.chunked_image.get_pieces(image, tile_rect):
+        replace_region(tile, surface.subsurface(surface_rect), offset, pygame.Rect(offset, surface_rect.size))
+    return zlib.compress(pygame.image.tobytes(tile, 'RGBA'), 1)
+
+# Put pixels saved by save_tile() back into tile_rect of an image, including the alpha values
+def load_tile(image, tile_rect, data):
+    tile = pygame.image.frombytes(zlib.decompress(data), tile_rect.size, 'RGBA')
+    for surface, surface_rect, offset in modules.chunked_image.get_pieces(image, tile_rect):
+        replace_region(surface, tile, (surface_rect.left - offset[0], surface_rect.top - offset[1]), surface_rect)
+
+# Class for the undo/redo history of an image.
+# Instead of copying the whole image for every stroke, only the tiles that a stroke touched are kept, compressed, from before and after the stroke.
+class History:
+    def __init__(self, tile_size=64, memory_budget=None):
+        # Side length (in image pixels) of the square tiles that patches are saved in
+        self.tile_size = tile_size
+
+        # Maximum number of bytes of compressed patches to keep. If None, modules.settings.history_memory_budget is used.
+        self.memory_budget = memory_budget
+
+        # Strokes that can be undone (oldest first) and strokes that can be redone (most recently undone last).
+        # Each entry is (image, stroke), where image is the image (or layer) the stroke was painted on,
+        # and stroke is a list of patches: (tile rect, compressed pixels before the stroke, compressed pixels after the stroke).
+        self.undo_stack = []
+        self.redo_stack = []
+        self.memory_used = 0
+
+        # Compressed pixels from before the stroke that is being painted, keyed by the tile's top left corner
+        self.stroke_tiles = None
+
+    def get_memory_budget(self):
+        if self.memory_budget is None:
+            return modules.settings.history_memory_budget
+        return self.memory_budget
+
+    def get_memory_used(self):
+        return self.memory_used
+
+    def can_undo(self):
+        return len(self.undo_stack) > 0
+
+    def can_redo(self):
+        return len(self.redo_stack) > 0
+
+    def clear(self):
+        # Forget the whole history. Called when a different image is opened.
+        self.undo_stack = []
+        self.redo_stack = []
+        self.memory_used = 0
+        self.stroke_tiles = None
+
+    def forget_image(self, image):
+        # Forget the strokes that were painted on an image (or layer) that is gone, like a deleted layer.
+        # Undoing them would only change pixels that are no longer shown, so the strokes on other images are kept.
+        for stroke_image, stroke in self.undo_stack + self.redo_stack:
+            if stroke_image is image:
+                self.memory_used -= self.get_stroke_memory(stroke)
+        self.undo_stack = [(stroke_image, stroke) for stroke_image, stroke in self.undo_stack if stroke_image is not image]
+        self.redo_stack = [(stroke_image, stroke) for stroke_image, stroke in self.redo_stack if stroke_image is not image]
+
+    def get_tile_rects(self, image, rect):
+        # Returns the tiles that rect (in image pixels, wrapping around the edges of the image) touches, clipped to the image.
+        image_rect = image.get_rect()
+        tile_rects = []
+        for piece, offset in modules.utils.split_wrapped_rect(pygame.Rect(rect), image.get_size()):
+            for tile_y in range(piece.top // self.tile_size * self.tile_size, piece.bottom, self.tile_size):
+                for tile_x in range(piece.left // self.tile_size * self.tile_size, piece.right, self.tile_size):
+                    tile_rects.append(pygame.Rect(tile_x, tile_y, self.tile_size, self.tile_size).clip(image_rect))
+        return tile_rects
+
+    def begin_stroke(self):
+        self.stroke_tiles = {}
+
+    def capture(self, image, rect):
+        # Called before rect of the image is painted, to save the tiles that are about to change.
+        # Tiles that were already saved during this stroke are not saved again.
+        if self.stroke_tiles is None:
+            return
+        for tile_rect in self.get_tile_rects(image, rect):
+            if tile_rect.topleft not in self.stroke_tiles:
+                self.stroke_tiles[tile_rect.topleft] = (tile_rect, save_tile(image, tile_rect))
+
+    def end_stroke(self, image):
+        # Finish the stroke and add it to the history, along with what the saved tiles look like now.
+        # Returns the tiles as they are after the stroke, as (tile rect, compressed pixels) pairs.
+        if self.stroke_tiles is None:
+            return []
+        stroke = [(tile_rect, before, save_tile(image, tile_rect)) for tile_rect, before in self.stroke_tiles.values()]
+        self.stroke_tiles = None
+        if not stroke:
+            return []
+
+        # A new stroke replaces whatever was undone
+        for redo_image, redo_stroke in self.redo_stack:
+            self.memory_used -= self.get_stroke_memory(redo_stroke)
+        self.redo_stack = []
+
+        self.undo_stack.append((image, stroke))
+        self.memory_used += self.get_stroke_memory(stroke)
+
+        # Forget the oldest strokes until the history fits in the memory budget (the newest stroke is always kept)
+        while self.memory_used > self.get_memory_budget() and len(self.undo_stack) > 1:
+            self.memory_used -= self.get_stroke_memory(self.undo_stack.pop(0)[1])
+
+        return [(tile_rect, after) for tile_rect, before, after in stroke]
+
+    def get_stroke_memory(self, stroke):
+        return sum(len(before) + len(after) for tile_rect, before, after in stroke)
+
+    def undo(self):
+        # Restore the tiles of the most recent stroke to how they were before it, on the image the stroke was painted on.
+        # Returns (that image, the tiles that changed as (tile rect, compressed pixels) pairs). The image is None if there was nothing to undo.
+        if self.stroke_tiles is not None or not self.undo_stack:
+            return None, []
+        image, stroke = self.undo_stack.pop()
+        for tile_rect, before, after in stroke:
+            load_tile(image, tile_rect, before)
+        self.redo_stack.append((image, stroke))
+        return image, [(tile_rect, before) for tile_rect, before, after in stroke]
+
+    def redo(self):
+        # Paint the most recently undone stroke again.
+        # Returns (the image it was painted on, the tiles that changed as (tile rect, compressed pixels) pairs).
+        if self.stroke_tiles is not None or not self.redo_stack:
+            return None, []
+        image, stroke = self.redo_stack.pop()
+        for tile_rect, before, after in stroke:
+            load_tile(image, tile_rect, after)
+        self.undo_stack.append((image, stroke))
+        return image, [(tile_rect, after) for tile_rect, before, after in stroke]
@@ -0,0 +1,124 @@
+## Author: Alexander Art
+
+import os
+import struct
+import threading
+import time
+import zlib
+
+import numpy
+import pygame
+
+import modules.chunked_image
+
+# Opening and saving images on a worker thread, so the frame loop keeps running while big files are read and written.
+
+# pygame.image.save() holds the GIL while it encodes, which would freeze the frame loop anyway, so PNG files are encoded here with numpy and zlib (which let other threads run).
+def encode_png(pixels, size):
+    # pixels is the RGBA bytes of an image of the given size, row by row. Returns the bytes of a PNG file.
+    width, height = size
+    rows = numpy.frombuffer(pixels, dtype=numpy.uint8).reshape(height, width * 4)
+
+    # Filter each row with whichever of the 'sub' (difference from the pixel to the left) and 'up' (difference from the pixel above) filters compresses better.
+    # The smaller the filtered bytes are (as signed values), the better they usually compress.
+    sub_rows = rows.copy()
+    sub_rows[:, 4:] -= rows[:, :-4]
+    up_rows = rows.copy()
+    up_rows[1:] -= rows[:-1]
+    sub_cost = numpy.abs(sub_rows.view(numpy.int8).astype(numpy.int32)).sum(axis=1)
+    up_cost = numpy.abs(up_rows.view(numpy.int8).astype(numpy.int32)).sum(axis=1)
+    use_up = up_cost < sub_cost
+
+    filtered = numpy.empty((height, width * 4 + 1), dtype=numpy.uint8)
+    filtered[:, 0] = numpy.where(use_up, 2, 1)
+    filtered[:, 1:] = numpy.where(use_up[:, numpy.newaxis], up_rows, sub_rows)
+
+    def png_chunk(chunk_type, data):
+        return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', zlib.crc32(chunk_type + data))
+
+    header = struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0) # 8 bits per channel, RGBA
+    return b'\x89PNG\r\n\x1a\n' + png_chunk(b'IHDR', header) + png_chunk(b'IDAT', zlib.compress(filtered.tobytes(), 6)) + png_chunk(b'IEND', b'')
+
+# Class for an image being opened or saved on a worker thread.
+# The main thread starts it, then checks is_done() every frame and reads the result (or error) once it is done.
+class ImageTask:
+    def __init__(self, action, filepath):
+        # 'open', 'open_tileset', 'save', or 'save_tileset' (see modules/atlas.py for the tileset actions)
+        self.action = action
+        self.filepath = filepath
+
+        # The loaded image (for 'open'), or None
+        self.result = None
+        # The exception that stopped the task, or None
+        self.error = None
+
+        self.start_time = time.perf_counter()
+        self.thread = None
+
+    def start(self, target, *args):
+        self.thread = threading.Thread(target=self.run, args=(target,) + args, daemon=True)
+        self.thread.start()
+
+    def run(self, target, *args):
+        # Any exception is kept for the main thread. If one got past the worker, the main thread would see a task without a result or an error.
+        try:
+            self.result = target(*args)
+        except Exception as error:
+            self.error = error
+
+    def is_done(self):
+        return not self.thread.is_alive()
+
+    def wait(self):
+        # Block until the task is done
+        self.thread.join()
+
+    def get_elapsed_time(self):
+        return time.perf_counter() - self.start_time
+
+    def get_status_text(self):
+        if self.action == 'save' or self.action == 'save_tileset':
+            return f"Saving... {self.get_elapsed_time():.1f}s"
+        return f"Opening... {self.get_elapsed_time():.1f}s"
+
+def read_image(filepath):
+    # Runs on the worker thread. Decode the file, and split it into chunks if it is very large.
+    # Surfaces that need the display (convert_alpha()) are made on the main thread in finish_open().
+    image = pygame.image.load(filepath)
+    if modules.chunked_image.should_chunk(image.get_size()):
+        return modules.chunked_image.ChunkedImage(image.get_size(), source=image)
+    return image
+
+def write_image(pixels, size, filepath):
+    # Runs on the worker thread. The image is written to a temporary file first, so a save that fails (or is cut off by quitting) does not destroy the previous image.
+    temporary_filepath = filepath + '.tmp'
+    try:
+        with open(temporary_filepath, 'wb') as file:
+            if filepath.lower().endswith('.png'):
+                file.write(encode_png(pixels, size))
+            else:
+                # The file name tells pygame which format to save in
+                pygame.image.save(pygame.image.frombytes(pixels, size, 'RGBA'), file, filepath)
+    except Exception:
+        if os.path.exists(temporary_filepath):
+            os.remove(temporary_filepath)
+        raise
+    os.replace(temporary_filepath, filepath)
+
+def start_open(filepath):
+    task = ImageTask('open', filepath)
+    task.start(read_image, filepath)
+    return task
+
+def finish_open(task):
+    # Called on the main thread once an 'open' task is done. Returns the image ready to be painted on.
+    if isinstance(task.result, modules.chunked_image.ChunkedImage):
+        return task.result
+    return task.result.convert_alpha()
+
+def start_save(image, filepath):
+    # The pixels are copied before the task starts, so the image can keep being painted while it is saved.
+    surface = modules.chunked_image.to_surface(image)
+    task = ImageTask('save', filepath)
+    task.start(write_image, pygame.image.tobytes(surface, 'RGBA'), surface.get_size(), filepath)
+    return task
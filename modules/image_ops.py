@@ -0,0 +1,133 @@
+## Author: Alexander Art
+
+import numpy
+import pygame
+
+from modules.scaled_image_cache import replace_region
+
+# Operations on whole images. They work on the pixel arrays of the image at once with numpy, so they are fast even on big images.
+# Each operation takes a 32 bit surface and returns the resulting surface (which may be the same surface, changed in place).
+
+def to_rgba_surface(image):
+    # Returns a 32 bit copy of any surface, with alpha. Unlike convert_alpha(), this does not need a display.
+    surface = pygame.Surface(image.get_size(), pygame.SRCALPHA)
+    replace_region(surface, image, (0, 0), surface.get_rect())
+    return surface
+
+def offset(image, offset_x, offset_y):
+    # Move the image by (offset_x, offset_y) pixels, wrapping around the edges.
+    # Offsetting by half the size brings the edges of a tile to the middle, where seams are easy to see and paint over.
+    # Each 32 bit pixel is moved as a single number, which is much faster than moving the color and alpha channels separately
+    pixels = pygame.surfarray.pixels2d(image)
+    pixels[:] = numpy.roll(pixels, (offset_x, offset_y), axis=(0, 1))
+    del pixels # Unlock the image
+    return image
+
+def offset_half(image):
+    return offset(image, image.get_width() // 2, image.get_height() // 2)
+
+def cross_fade_edges(pixels, width):
+    # Cross-fade the first and last width columns (axis 0) of an array of pixels into each other.
+    # The pixels on either side of the wrap boundary become a mix of both sides, half and half right at the boundary and fading out to the original pixels width pixels away.
+    near_side = pixels[:width].astype(numpy.float32)
+    far_side = pixels[-width:][::-1].astype(numpy.float32) # Reversed, so that index d is d pixels away from the boundary on both sides
+    weights = 0.5 * (1 - (numpy.arange(width, dtype=numpy.float32) + 0.5) / width)
+    weights = weights.reshape((width,) + (1,) * (pixels.ndim - 1))
+    pixels[:width] = numpy.rint(near_side + (far_side - near_side) * weights)
+    pixels[-width:] = numpy.rint(far_side + (near_side - far_side) * weights)[::-1]
+
+def seam_blend(image, width):
+    # Blend the left edge into the right edge and the top edge into the bottom edge over width pixels, so the image tiles without visible seams.
+    width_x = min(width, image.get_width() // 2)
+    width_y = min(width, image.get_height() // 2)
+    pixels = pygame.surfarray.pixels3d(image)
+    alpha = pygame.surfarray.pixels_alpha(image)
+    if width_x > 0:
+        cross_fade_edges(pixels, width_x)
+        cross_fade_edges(alpha, width_x)
+    if width_y > 0:
+        # Swap the axes so that rows are blended the same way as columns
+        cross_fade_edges(pixels.swapaxes(0, 1), width_y)
+        cross_fade_edges(alpha.swapaxes(0, 1), width_y)
+    del pixels, alpha # Unlock the image
+    return image
+
+def get_seam_rects(image, width):
+    # Rects of the image that seam_blend() changes
+    image_width, image_height = image.get_size()
+    width_x = min(width, image_width // 2)
+    width_y = min(width, image_height // 2)
+    return [pygame.Rect(0, 0, width_x, image_height), pygame.Rect(image_width - width_x, 0, width_x, image_height),
+            pygame.Rect(0, 0, image_width, width_y), pygame.Rect(0, image_height - width_y, image_width, width_y)]
+
+def recolor(image, hue_degrees):
+    # Rotate the hue of every pixel by hue_degrees, keeping the brightness.
+    # The colors are rotated around the gray axis of the RGB cube, which is what a hue shift does without converting to HSV and back.
+    angle = numpy.radians(hue_degrees)
+    cos_angle = numpy.cos(angle)
+    sin_angle = numpy.sin(angle)
+    third = (1 - cos_angle) / 3
+    root_third = numpy.sqrt(1 / 3) * sin_angle
+    rotation = numpy.array([
+        [cos_angle + third, third - root_third, third + root_third],
+        [third + root_third, cos_angle + third, third - root_third],
+        [third - root_third, third + root_third, cos_angle + third],
+    ], dtype=numpy.float32)
+
+    pixels = pygame.surfarray.pixels3d(image)
+    # A few columns at a time, so that big images do not need a huge temporary array
+    for left in range(0, pixels.shape[0], 256):
+        block = pixels[left:left + 256]
+        block[:] = numpy.clip(numpy.rint(block.astype(numpy.float32) @ rotation.T), 0, 255)
+    del pixels # Unlock the image
+    return image
+
+def resize(image, size, smooth=True):
+    # Returns the image scaled to size. smooth blends neighboring pixels, otherwise the pixels are kept sharp (better for pixel art).
+    if smooth:
+        return pygame.transform.smoothscale(image, size)
+    return pygame.transform.scale(image, size)
+
+# Operations by name, for parse_operations()
+operation_names = ['offset', 'seam_blend', 'recolor', 'resize', 'resize_sharp']
+
+def parse_operations(text):
+    # Parse a list of operations such as "offset:half,recolor:30,resize:64x64".
+    # Returns a list of (name, arguments) pairs. Raises ValueError if the text is not valid.
+    operations = []
+    for operation_text in text.split(','):
+        name, _, argument = operation_text.strip().partition(':')
+        if name not in operation_names:
+            raise ValueError(f"Unknown operation '{name}'. Known operations: {', '.join(operation_names)}")
+        if name == 'offset':
+            if argument in ('', 'half'):
+                operations.append((name, None))
+            else:
+                offset_x, offset_y = argument.split('x')
+                operations.append((name, (int(offset_x), int(offset_y))))
+        elif name == 'seam_blend':
+            operations.append((name, int(argument) if argument else 16))
+        elif name == 'recolor':
+            operations.append((name, float(argument)))
+        else:
+            width, height = argument.split('x')
+            operations.append((name, (int(width), int(height))))
+    return operations
+
+def apply_operations(image, operations):
+    # Apply operations from parse_operations() in order. Returns the resulting surface.
+    for name, argument in operations:
+        if name == 'offset':
+            if argument is None:
+                image = offset_half(image)
+            else:
+                image = offset(image, argument[0], argument[1])
+        elif name == 'seam_blend':
+            image = seam_blend(image, argument)
+        elif name == 'recolor':
+            image = recolor(image, argument)
+        elif name == 'resize':
+            image = resize(image, argument)
+        elif name == 'resize_sharp':
+            image = resize(image, argument, False)
+    return image
@@ -0,0 +1,257 @@
+## Author: Alexander Art
+
+import json
+import os
+import struct
+import threading
+import time
+
+import pygame
+
+import modules.history
+import modules.settings
+
+# Journals keep the changes made to an image since it was last saved, so they can be recovered after a crash without saving the whole image all the time.
+# A journal is a file next to the image (image.png.journal). It starts with a header that identifies the saved image file it builds on,
+# followed by records that are only ever appended. Each record holds the tiles that one change (a stroke, an undo, or a redo) left behind,
+# as (rect, compressed pixels) patches in the same format as the undo history, plus the parameters of the change.
+# Replaying the records in order on top of the saved image gives back the image as it was when the last record was written.
+# Changes are numbered in the order they were made. The header holds the number of the first change that is not in the saved image,
+# and a checkpoint holds every change before the number it was written at.
+
+journal_magic = b'TILEARTJOURNAL1\n'
+
+def get_journal_filepath(image_filepath):
+    return image_filepath + '.journal'
+
+def get_file_stamp(filepath):
+    # Identifies a version of a file, so a journal can tell if the image was saved by something else since the journal was started
+    stat = os.stat(filepath)
+    return [stat.st_size, stat.st_mtime_ns]
+
+def encode_header(image_filepath, image_size, first_change):
+    header = {'image_size': list(image_size), 'image_stamp': get_file_stamp(image_filepath), 'first_change': first_change}
+    return journal_magic + json.dumps(header).encode() + b'\n'
+
+def encode_record(kind, params, patches):
+    # kind is 'stroke', 'undo', 'redo', or 'checkpoint'. params is a dictionary that can be written as json.
+    record_header = {'kind': kind, 'params': params, 'patches': [[rect.x, rect.y, rect.width, rect.height, len(data)] for rect, data in patches]}
+    record_header_bytes = json.dumps(record_header).encode()
+    payload = b''.join(data for rect, data in patches)
+    return struct.pack('>II', len(record_header_bytes), len(payload)) + record_header_bytes + payload
+
+def read_journal(journal_filepath):
+    # Returns (header, records, end) where records is a list of (record header, patches, byte offset) and end is where the last whole record ends.
+    # A record that was cut off (for example by a crash while it was written) and everything after it is left out.
+    with open(journal_filepath, 'rb') as file:
+        data = file.read()
+    if not data.startswith(journal_magic):
+        return None, [], 0
+    header_end = data.index(b'\n', len(journal_magic)) + 1
+    header = json.loads(data[len(journal_magic):header_end])
+
+    records = []
+    offset = header_end
+    while offset + 8 <= len(data):
+        record_header_length, payload_length = struct.unpack_from('>II', data, offset)
+        record_end = offset + 8 + record_header_length + payload_length
+        if record_end > len(data):
+            break
+        try:
+            record_header = json.loads(data[offset + 8:offset + 8 + record_header_length])
+        except ValueError:
+            break
+        patches = []
+        patch_offset = offset + 8 + record_header_length
+        for x, y, width, height, length in record_header['patches']:
+            patches.append((pygame.Rect(x, y, width, height), data[patch_offset:patch_offset + length]))
+            patch_offset += length
+        records.append((record_header, patches, offset))
+        offset = record_end
+    return header, records, offset
+
+def compact_records(records):
+    # Merge records into the patches of a single checkpoint. Only the newest pixels of each tile are kept.
+    latest_patches = {}
+    for record_header, patches, offset in records:
+        for rect, data in patches:
+            latest_patches[tuple(rect)] = (rect, data)
+    return list(latest_patches.values())
+
+# Class for the journal of the image that is open in the canvas
+class Journal:
+    def __init__(self, image_filepath):
+        self.image_filepath = image_filepath
+        self.filepath = get_journal_filepath(image_filepath)
+        self.file = None
+
+        # Records that were added but not written to the file yet. They are written in batches by update().
+        self.pending_records = []
+        self.last_flush_time = time.perf_counter()
+
+        # Number of changes recorded so far (counting the ones that were compacted into checkpoints)
+        self.change_count = 0
+        # For each record in the file: (byte offset, number of the first change that the record holds)
+        self.record_offsets = []
+
+        # Thread that compacts the journal into a checkpoint, and the file it writes to
+        self.checkpoint_thread = None
+        self.checkpoint_filepath = self.filepath + '.tmp'
+        self.checkpoint_result = None
+        self.checkpoint_first_change = 0
+
+    def open(self, image):
+        # Start journaling changes to image, which was just loaded from the image file.
+        # If there is a journal left over from a session that did not save (for example because of a crash), its changes are replayed onto the image first.
+        # Returns the number of changes that were recovered.
+        recovered_count = 0
+        if os.path.exists(self.filepath):
+            header, records, end = read_journal(self.filepath)
+            if header is not None and header['image_size'] == list(image.get_size()) and header['image_stamp'] == get_file_stamp(self.image_filepath):
+                # Keep numbering the changes where the journal left off
+                first_change = header.get('first_change', 0)
+                self.change_count = first_change
+                for record_header, patches, offset in records:
+                    for rect, data in patches:
+                        modules.history.load_tile(image, rect, data)
+                    self.record_offsets.append((offset, self.change_count))
+                    if record_header['kind'] == 'checkpoint':
+                        self.change_count = max(self.change_count, record_header['params']['change_count'])
+                    else:
+                        self.change_count += 1
+                recovered_count = self.change_count - first_change
+                # Keep appending to the journal, after the last whole record
+                self.file = open(self.filepath, 'r+b')
+                self.file.truncate(end)
+                self.file.seek(end)
+                return recovered_count
+
+        self.file = open(self.filepath, 'wb')
+        self.file.write(encode_header(self.image_filepath, image.get_size(), self.change_count))
+        self.file.flush()
+        return recovered_count
+
+    def add(self, kind, params, patches):
+        # Record a change. It is written to the file on the next flush.
+        if self.file is None or not patches:
+            return
+        self.pending_records.append((encode_record(kind, params, patches), self.change_count))
+        self.change_count += 1
+
+    def flush(self):
+        # Write the pending records to the file (unless a checkpoint is being written, in which case they wait for it)
+        if self.file is None or self.checkpoint_thread is not None:
+            return
+        for record, change_number in self.pending_records:
+            self.record_offsets.append((self.file.tell(), change_number))
+            self.file.write(record)
+        self.pending_records = []
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.last_flush_time = time.perf_counter()
+
+    def update(self):
+        # Runs every frame. Writes the pending records in batches, and compacts the journal when it gets big.
+        if self.file is None:
+            return
+        if self.checkpoint_thread is not None:
+            if self.checkpoint_thread.is_alive():
+                return
+            self.finish_checkpoint()
+
+        if self.pending_records and time.perf_counter() - self.last_flush_time >= modules.settings.journal_flush_interval:
+            self.flush()
+            if self.file.tell() >= modules.settings.journal_checkpoint_size:
+                self.start_checkpoint()
+
+    def start_checkpoint(self):
+        # Compact the journal on a worker thread. New records wait in pending_records until it is done.
+        # The records in the file hold the changes from the first record's change up to (but not including) change_count
+        self.checkpoint_result = None
+        self.checkpoint_first_change = self.record_offsets[0][1] if self.record_offsets else self.change_count
+        self.checkpoint_thread = threading.Thread(target=self.write_checkpoint, args=(self.change_count,), daemon=True)
+        self.checkpoint_thread.start()
+
+    def write_checkpoint(self, change_count):
+        # Runs on the worker thread. Reads the journal and writes a new one with all of its records merged into one checkpoint.
+        try:
+            header, records, end = read_journal(self.filepath)
+            with open(self.checkpoint_filepath, 'wb') as file:
+                file.write(journal_magic + json.dumps(header).encode() + b'\n')
+                record_offset = file.tell()
+                file.write(encode_record('checkpoint', {'change_count': change_count}, compact_records(records)))
+                file.flush()
+                os.fsync(file.fileno())
+            self.checkpoint_result = record_offset
+        except OSError as error:
+            print(f"Could not compact the journal: {error}")
+
+    def finish_checkpoint(self):
+        # Replace the journal with the compacted one (if it was written) and continue appending to it
+        self.checkpoint_thread = None
+        if self.checkpoint_result is None:
+            return
+        self.file.close()
+        os.replace(self.checkpoint_filepath, self.filepath)
+        self.file = open(self.filepath, 'r+b')
+        self.file.seek(0, os.SEEK_END)
+        self.record_offsets = [(self.checkpoint_result, self.checkpoint_first_change)]
+
+    def wait_for_checkpoint(self):
+        if self.checkpoint_thread is not None:
+            self.checkpoint_thread.join()
+            self.finish_checkpoint()
+
+    def rebase(self, image_filepath, image_size, first_change):
+        # Called after the image was saved to image_filepath with every change before first_change in it.
+        # The journal is started over for the saved file, keeping only the changes that were made while it was being saved.
+        if self.file is None:
+            return
+        self.wait_for_checkpoint()
+        self.flush()
+
+        # Records that hold changes from first_change onwards. A record that holds changes from before as well is kept whole,
+        # which is harmless because replaying a change that is already in the saved image does not change it.
+        kept_offset = None
+        for offset, change_number in self.record_offsets:
+            if change_number <= first_change:
+                kept_offset = offset
+            elif kept_offset is None:
+                kept_offset = offset
+        self.file.seek(0, os.SEEK_END)
+        end = self.file.tell()
+        kept_records = b''
+        if kept_offset is not None and kept_offset < end and self.change_count > first_change:
+            self.file.seek(kept_offset)
+            kept_records = self.file.read(end - kept_offset)
+        self.file.close()
+
+        new_filepath = get_journal_filepath(image_filepath)
+        header = encode_header(image_filepath, image_size, first_change)
+        with open(new_filepath + '.tmp', 'wb') as file:
+            file.write(header)
+            file.write(kept_records)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(new_filepath + '.tmp', new_filepath)
+        if new_filepath != self.filepath:
+            # The changes are saved in the new file, so the old journal is no longer needed
+            os.remove(self.filepath)
+
+        self.image_filepath = image_filepath
+        self.filepath = new_filepath
+        self.checkpoint_filepath = self.filepath + '.tmp'
+        self.record_offsets = [(len(header) + offset - kept_offset, change_number) for offset, change_number in self.record_offsets if kept_records and offset >= kept_offset]
+        self.file = open(self.filepath, 'r+b')
+        self.file.seek(0, os.SEEK_END)
+
+    def close(self, keep):
+        # Stop journaling. If keep is False (everything is saved), the journal file is deleted.
+        if self.file is None:
+            return
+        self.wait_for_checkpoint()
+        self.flush()
+        self.file.close()
+        self.file = None
+        if not keep:
+            os.remove(self.filepath)
@@ -0,0 +1,240 @@
+## Author: Alexander Art
+
+import io
+import json
+import os
+import zipfile
+
+import numpy
+import pygame
+
+import modules.chunked_image
+import modules.image_io
+import modules.profiler
+
+# Layers of the image that is open in the canvas. Painting goes into the active layer, and the canvas shows (and saves) the layers flattened together.
+# The flattened image (the composite) is kept between frames and only blended again where a layer was painted or where a layer setting changed.
+# While a single layer is shown as it is (visible, normal blend mode, fully opaque), that layer is used directly and no composite is kept.
+#
+# Layered images are saved as project files (image.tileart next to image.png). A project file is a zip of a project.json
+# describing the layers, and a PNG for each layer. Saving also writes the flattened PNG, so the tile can be used as it is.
+
+project_extension = '.tileart'
+
+blend_modes = ['normal', 'multiply', 'screen', 'add']
+
+# The composite is blended this many rows at a time, so big images do not need huge temporary arrays
+composite_block_height = 256
+
+def blend_colors(blend_mode, below, above):
+    # Color of a layer (above) over the colors below it, before opacity is applied. Colors are float arrays from 0 to 255.
+    if blend_mode == 'multiply':
+        return below * above / 255
+    if blend_mode == 'screen':
+        return below + above - below * above / 255
+    if blend_mode == 'add':
+        return numpy.minimum(below + above, 255)
+    return above
+
+def get_project_filepath(image_filepath):
+    return os.path.splitext(image_filepath)[0] + project_extension
+
+def get_image_filepath(project_filepath):
+    # The flattened PNG that is saved next to a project file
+    return os.path.splitext(project_filepath)[0] + '.png'
+
+# Class for a single layer
+class Layer:
+    def __init__(self, surface, name):
+        self.surface = surface
+        self.name = name
+        self.visible = True
+        self.opacity = 1 # 0 (invisible) to 1 (fully opaque)
+        self.blend_mode = 'normal'
+
+    def get_info(self):
+        # Settings of the layer, as saved in project files
+        return {'name': self.name, 'visible': self.visible, 'opacity': self.opacity, 'blend_mode': self.blend_mode}
+
+    def set_info(self, info):
+        self.name = info['name']
+        self.visible = info['visible']
+        self.opacity = info['opacity']
+        self.blend_mode = info['blend_mode'] if info['blend_mode'] in blend_modes else 'normal'
+
+# Class for the layers of an image, from the bottom layer to the top one
+class LayerStack:
+    def __init__(self, image):
+        # The image becomes the bottom layer
+        self.layers = [Layer(image, "Layer 1")]
+        self.active_index = 0
+        # Number used to name the next new layer
+        self.layer_count = 1
+
+        # Surface holding the flattened layers, or None while a single layer is shown as it is
+        self.composite = None
+
+    def get_size(self):
+        return self.layers[0].surface.get_size()
+
+    def get_active_layer(self):
+        return self.layers[self.active_index]
+
+    def get_active_surface(self):
+        return self.layers[self.active_index].surface
+
+    def get_visible_layers(self):
+        return [layer for layer in self.layers if layer.visible and layer.opacity > 0]
+
+    def get_passthrough_layer(self):
+        # Returns the layer that can be shown as it is when it is the only visible one, otherwise None
+        visible_layers = self.get_visible_layers()
+        if len(visible_layers) == 1 and visible_layers[0].opacity >= 1 and visible_layers[0].blend_mode == 'normal':
+            return visible_layers[0]
+        return None
+
+    def supports_layers(self):
+        # Layers of chunked images (see modules/chunked_image.py) would need a composite as big as the image, which they are meant to avoid
+        return not isinstance(self.layers[0].surface, modules.chunked_image.ChunkedImage)
+
+    def add_layer(self):
+        # Add an empty layer above the active layer and make it the active layer
+        self.layer_count += 1
+        surface = pygame.Surface(self.get_size(), pygame.SRCALPHA)
+        modules.profiler.count('surfaces')
+        self.layers.insert(self.active_index + 1, Layer(surface, f"Layer {self.layer_count}"))
+        self.active_index += 1
+
+    def remove_active_layer(self):
+        # The last layer can not be removed
+        if len(self.layers) > 1:
+            del self.layers[self.active_index]
+            self.active_index = min(self.active_index, len(self.layers) - 1)
+
+    def select_layer(self, index):
+        self.active_index = max(0, min(len(self.layers) - 1, index))
+
+    def move_active_layer(self, steps):
+        # Move the active layer up (steps > 0) or down (steps < 0) the stack
+        new_index = max(0, min(len(self.layers) - 1, self.active_index + steps))
+        self.layers.insert(new_index, self.layers.pop(self.active_index))
+        self.active_index = new_index
+
+    def get_composite(self):
+        # Returns the surface that shows the layers flattened together
+        passthrough_layer = self.get_passthrough_layer()
+        if passthrough_layer is not None:
+            self.composite = None
+            return passthrough_layer.surface
+        if self.composite is None:
+            self.composite = pygame.Surface(self.get_size(), pygame.SRCALPHA)
+            modules.profiler.count('surfaces')
+            self.blend_rect(self.composite, self.composite.get_rect())
+        return self.composite
+
+    def update_composite(self, rects):
+        # Blend the layers again inside rects (in image pixels, inside the image) that were painted or changed
+        if self.composite is None or self.get_passthrough_layer() is not None:
+            return
+        for rect in rects:
+            self.blend_rect(self.composite, rect)
+
+    def flatten(self):
+        # Returns a new surface of the layers flattened together, blended from the layers over the whole image in one pass (for saving).
+        # It does not rely on the composite, which may still be missing what was painted since the last frame.
+        passthrough_layer = self.get_passthrough_layer()
+        if passthrough_layer is not None:
+            return passthrough_layer.surface
+        flattened = pygame.Surface(self.get_size(), pygame.SRCALPHA)
+        modules.profiler.count('surfaces')
+        self.blend_rect(flattened, flattened.get_rect())
+        return flattened
+
+    def blend_rect(self, target, rect):
+        # Blend the visible layers inside rect into the target surface, a block of rows at a time
+        for top in range(rect.top, rect.bottom, composite_block_height):
+            block = pygame.Rect(rect.left, top, rect.width, min(composite_block_height, rect.bottom - top))
+            colors, alpha = self.blend_block(block)
+            target_pixels = pygame.surfarray.pixels3d(target)
+            target_alpha = pygame.surfarray.pixels_alpha(target)
+            target_pixels[block.left:block.right, block.top:block.bottom] = colors
+            target_alpha[block.left:block.right, block.top:block.bottom] = alpha
+            del target_pixels, target_alpha # Unlock the target
+
+    def blend_block(self, block):
+        # Returns the (colors, alpha) of the visible layers blended together inside block, indexed [x, y] like pygame.surfarray.
+        # Each layer is put over the layers below it with the usual "over" compositing, using the color from its blend mode.
+        result_colors = numpy.zeros((block.width, block.height, 3), dtype=numpy.float32)
+        result_alpha = numpy.zeros((block.width, block.height, 1), dtype=numpy.float32) # 0 to 1
+        for layer in self.get_visible_layers():
+            colors = pygame.surfarray.pixels3d(layer.surface)[block.left:block.right, block.top:block.bottom].astype(numpy.float32)
+            alpha = pygame.surfarray.pixels_alpha(layer.surface)[block.left:block.right, block.top:block.bottom, numpy.newaxis] * numpy.float32(layer.opacity / 255)
+            if layer.blend_mode != 'normal':
+                # Where there is nothing below the layer, its own color shows instead of the blended one
+                colors += (blend_colors(layer.blend_mode, result_colors, colors) - colors) * result_alpha
+            below_weight = result_alpha * (1 - alpha)
+            result_alpha = alpha + below_weight
+            result_colors = (colors * alpha + result_colors * below_weight) / numpy.maximum(result_alpha, 1e-6)
+        return numpy.clip(numpy.rint(result_colors), 0, 255).astype(numpy.uint8), numpy.rint(result_alpha[:, :, 0] * 255).astype(numpy.uint8)
+
+    def get_project_data(self):
+        # Copies of everything a project file holds, taken on the main thread so the layers can keep being painted while the project is written
+        return [(layer.get_info(), pygame.image.tobytes(layer.surface, 'RGBA')) for layer in self.layers], self.active_index
+
+def write_project(project_filepath, size, layer_data, active_index):
+    # Runs on a worker thread. The project is written to a temporary file first, so a failed save does not destroy the previous project.
+    project = {'size': list(size), 'active_layer': active_index, 'layers': []}
+    temporary_filepath = project_filepath + '.tmp'
+    with zipfile.ZipFile(temporary_filepath, 'w', zipfile.ZIP_STORED) as project_file:
+        for index, (info, pixels) in enumerate(layer_data):
+            layer_filename = f"layers/{index}.png"
+            # The PNGs are already compressed, so the zip only stores them
+            project_file.writestr(layer_filename, modules.image_io.encode_png(pixels, size))
+            project['layers'].append(dict(info, file=layer_filename))
+        project_file.writestr('project.json', json.dumps(project, indent=1))
+    os.replace(temporary_filepath, project_filepath)
+
+def read_project(project_filepath):
+    # Runs on a worker thread. Returns (layer infos, layer surfaces, active layer index).
+    with zipfile.ZipFile(project_filepath) as project_file:
+        project = json.loads(project_file.read('project.json'))
+        surfaces = []
+        for info in project['layers']:
+            surface = pygame.image.load(io.BytesIO(project_file.read(info['file'])), info['file'])
+            if surface.get_size() != tuple(project['size']):
+                raise pygame.error(f"Layer {info['file']} is not the size of the project")
+            surfaces.append(surface)
+    return project['layers'], surfaces, project['active_layer']
+
+def write_image_and_project(image_pixels, size, image_filepath, layer_data, active_index):
+    # Runs on a worker thread
+    modules.image_io.write_image(image_pixels, size, image_filepath)
+    write_project(get_project_filepath(image_filepath), size, layer_data, active_index)
+
+def start_open_project(project_filepath):
+    task = modules.image_io.ImageTask('open', project_filepath)
+    task.start(read_project, project_filepath)
+    return task
+
+def finish_open_project(task):
+    # Called on the main thread once a project is read. Returns the LayerStack.
+    infos, surfaces, active_index = task.result
+    layers = []
+    for info, surface in zip(infos, surfaces):
+        layer = Layer(surface.convert_alpha(), info['name'])
+        layer.set_info(info)
+        layers.append(layer)
+    # LayerStack() makes a layer out of the image it is given, which is replaced by the layers of the project
+    layer_stack = LayerStack(layers[0].surface)
+    layer_stack.layers = layers
+    layer_stack.layer_count = len(layers)
+    layer_stack.select_layer(active_index)
+    return layer_stack
+
+def start_save_project(layer_stack, image_filepath):
+    # Save the flattened image to image_filepath and the layers to the project file next to it
+    image = layer_stack.flatten()
+    layer_data, active_index = layer_stack.get_project_data()
+    task = modules.image_io.ImageTask('save', image_filepath)
+    task.start(write_image_and_project, pygame.image.tobytes(image, 'RGBA'), image.get_size(), image_filepath, layer_data, active_index)
+    return task
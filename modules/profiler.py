@@ -0,0 +1,200 @@
+## Author: Alexander Art
+
+import csv
+import json
+import time
+from collections import deque
+
+import modules.ui.font_cache
+
+# Per-frame timings and counters, shown in a HUD (toggled with F3) and optionally written to a trace file (toggled with F4).
+# Nothing is measured unless the HUD is shown or a trace is being recorded.
+
+# Timings (in milliseconds) and counters that are recorded every frame, in the order they are shown and written.
+# 'render' is the whole UI tree including the canvas. 'paint', 'scale', 'tile_blits', and 'final_blit' are the parts of it spent in the canvas (painting at a click and at the end of a stroke happens during 'events' and is only counted there).
+timing_fields = ['events', 'mouse_over', 'paint', 'scale', 'tile_blits', 'final_blit', 'render', 'display_update']
+counter_fields = ['stamps', 'surfaces']
+trace_fields = ['frame', 'time_ms', 'frame_ms', 'rendered', 'zoom'] + timing_fields + counter_fields
+
+hud_enabled = False
+
+# Number of frames that the HUD averages over
+history_length = 60
+history = deque(maxlen=history_length)
+
+# The record of the frame in progress, or None if nothing is being measured
+frame_record = None
+frame_start = 0
+frame_number = 0
+start_time = time.perf_counter()
+
+# The open trace file, its format ('csv' or 'json'), and the csv writer (for csv traces)
+trace_file = None
+trace_format = None
+trace_writer = None
+trace_filepath = None
+trace_records_written = 0
+
+def is_active():
+    return hud_enabled or trace_file is not None
+
+def toggle_hud():
+    global hud_enabled
+    hud_enabled = not hud_enabled
+    history.clear()
+
+# Measures the time spent inside a with block and adds it to a timing of the current frame
+class Measurement:
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, exception_type, exception, traceback):
+        if frame_record is not None:
+            frame_record[self.name] += (time.perf_counter() - self.start) * 1000
+
+# Used instead of a Measurement when nothing is being measured
+class NoMeasurement:
+    def __enter__(self):
+        pass
+
+    def __exit__(self, exception_type, exception, traceback):
+        pass
+
+no_measurement = NoMeasurement()
+
+def measure(name):
+    # Use as: with modules.profiler.measure('scale'): ...
+    if frame_record is None:
+        return no_measurement
+    return Measurement(name)
+
+# Start and stop timing code that does not fit in a with block. The time is added to a timing of the current frame.
+timer_starts = {}
+
+def start_timer(name):
+    if frame_record is not None:
+        timer_starts[name] = time.perf_counter()
+
+def stop_timer(name):
+    start = timer_starts.pop(name, None)
+    if frame_record is not None and start is not None:
+        frame_record[name] += (time.perf_counter() - start) * 1000
+
+def count(name, amount=1):
+    # Add to a counter of the current frame
+    if frame_record is not None:
+        frame_record[name] += amount
+
+def begin_frame():
+    global frame_record, frame_start, frame_number
+    frame_number += 1
+    if not is_active():
+        frame_record = None
+        return
+    frame_start = time.perf_counter()
+    frame_record = {field: 0 for field in timing_fields + counter_fields}
+    frame_record['frame'] = frame_number
+    frame_record['time_ms'] = round((frame_start - start_time) * 1000, 3)
+
+def end_frame(rendered, zoom):
+    # Finish the record of the current frame, keep it for the HUD, and write it to the trace
+    global frame_record
+    if frame_record is None:
+        return
+    frame_record['frame_ms'] = (time.perf_counter() - frame_start) * 1000
+    frame_record['rendered'] = int(rendered)
+    frame_record['zoom'] = zoom
+    for field in timing_fields + ['frame_ms']:
+        frame_record[field] = round(frame_record[field], 3)
+    history.append(frame_record)
+    write_trace_record(frame_record)
+    frame_record = None
+
+def start_trace(filepath):
+    # Start writing a record of every frame to filepath. The format depends on the file extension (.json or .csv).
+    global trace_file, trace_format, trace_writer, trace_filepath, trace_records_written
+    stop_trace()
+    trace_file = open(filepath, 'w', newline='')
+    trace_filepath = filepath
+    trace_records_written = 0
+    if filepath.endswith('.json'):
+        trace_format = 'json'
+        # The records are streamed as a json array, so the file is only valid json once the trace is stopped
+        trace_file.write('[\n')
+    else:
+        trace_format = 'csv'
+        trace_writer = csv.DictWriter(trace_file, fieldnames=trace_fields)
+        trace_writer.writeheader()
+
+def write_trace_record(record):
+    global trace_records_written
+    if trace_file is None:
+        return
+    if trace_format == 'csv':
+        trace_writer.writerow(record)
+    else:
+        if trace_records_written > 0:
+            trace_file.write(',\n')
+        trace_file.write(json.dumps({field: record[field] for field in trace_fields}))
+    trace_records_written += 1
+
+def stop_trace():
+    global trace_file, trace_format, trace_writer, trace_filepath
+    if trace_file is None:
+        return
+    if trace_format == 'json':
+        trace_file.write('\n]\n')
+    trace_file.close()
+    trace_file = None
+    trace_format = None
+    trace_writer = None
+    trace_filepath = None
+
+def toggle_trace(extension='csv'):
+    # Start a trace in a new file in the current folder, or stop the trace that is being recorded.
+    # Returns the path of the trace file.
+    if trace_file is not None:
+        filepath = trace_filepath
+        stop_trace()
+        print(f"Stopped trace: {filepath}")
+        return filepath
+    filepath = time.strftime(f"trace_%Y%m%d_%H%M%S.{extension}")
+    start_trace(filepath)
+    print(f"Recording trace: {filepath}")
+    return filepath
+
+def get_hud_lines():
+    # Text lines of the HUD: the last frame and the average of recent frames for every field.
+    if not history:
+        return []
+    rendered_frames = [record for record in history if record['rendered']]
+    lines = [f"frame {history[-1]['frame_ms']:6.2f} ms  avg {sum(record['frame_ms'] for record in history) / len(history):6.2f} ms  zoom {history[-1]['zoom']}"]
+    for field in timing_fields:
+        # Render phases are averaged over the frames that were rendered, so skipped frames do not hide slow renders
+        records = rendered_frames if field not in ('events', 'mouse_over') and rendered_frames else history
+        average = sum(record[field] for record in records) / len(records)
+        lines.append(f"{field:<15}{history[-1][field]:6.2f} ms  avg {average:6.2f} ms")
+    for field in counter_fields:
+        average = sum(record[field] for record in history) / len(history)
+        lines.append(f"{field:<15}{history[-1][field]:6d}     avg {average:6.1f}")
+    if trace_filepath is not None:
+        lines.append(f"recording {trace_filepath}")
+    return lines
+
+def render_hud(surface, pos, size=18, color=(255, 255, 0)):
+    # Draw the HUD onto surface with a dark background. Returns the rect that was drawn over.
+    lines = get_hud_lines()
+    if not lines:
+        return None
+    line_surfaces = [modules.ui.font_cache.render_text(line, size, color) for line in lines]
+    width = max(line_surface.get_width() for line_surface in line_surfaces) + 8
+    height = sum(line_surface.get_height() for line_surface in line_surfaces) + 8
+    hud_rect = surface.fill((0, 0, 0), (pos, (width, height)))
+    y = pos[1] + 4
+    for line_surface in line_surfaces:
+        surface.blit(line_surface, (pos[0] + 4, y))
+        y += line_surface.get_height()
+    return hud_rect
@@ -0,0 +1,211 @@
+## Author: Alexander Art
+
+from collections import OrderedDict
+
+import numpy
+import pygame
+
+import modules.profiler
+import modules.settings
+
+# Returns the rect of the scaled image that is covered by the pixels inside rect of the source image.
+def get_scaled_rect(rect, source_size, scaled_size):
+    left = rect.left * scaled_size[0] // source_size[0]
+    top = rect.top * scaled_size[1] // source_size[1]
+    right = -(-rect.right * scaled_size[0] // source_size[0])
+    bottom = -(-rect.bottom * scaled_size[1] // source_size[1])
+    return pygame.Rect(left, top, right - left, bottom - top)
+
+# Scale only the part of source that ends up inside region (a rect of the source as if it were scaled to scaled_size).
+# Returns the scaled part and its position within the scaled source.
+def scale_region(source, scaled_size, region):
+    return scale_piece_region(source, source.get_rect(), source.get_size(), scaled_size, region)
+
+# Like scale_region(), for a piece of a bigger source: piece is a surface holding the pixels of piece_rect of a source of source_size.
+# Only the scaled pixels that show pixels of the piece are made, so region must overlap the scaled piece.
+# Scaling a part with pygame.transform.scale() would spread its pixels over the part by the part's own ratio, which puts the edges between source pixels
+# somewhere else than scaling the whole source does. Instead, every scaled pixel is looked up the same way pygame.transform.scale() does for the whole source:
+# scaled pixel x shows source pixel x * source_width // scaled_width (the same for y). So any part matches the same part of the whole scaled source exactly.
+def scale_piece_region(piece, piece_rect, source_size, scaled_size, region):
+    source_width, source_height = source_size
+
+    # Scaled pixels inside region that show pixels of the piece
+    scaled_left = max(region.left, -(-piece_rect.left * scaled_size[0] // source_width))
+    scaled_top = max(region.top, -(-piece_rect.top * scaled_size[1] // source_height))
+    scaled_right = max(scaled_left, min(region.right, -(-piece_rect.right * scaled_size[0] // source_width)))
+    scaled_bottom = max(scaled_top, min(region.bottom, -(-piece_rect.bottom * scaled_size[1] // source_height)))
+
+    # The pixel of the piece that each scaled column and row shows
+    source_x = numpy.arange(scaled_left, scaled_right) * source_width // scaled_size[0] - piece_rect.left
+    source_y = numpy.arange(scaled_top, scaled_bottom) * source_height // scaled_size[1] - piece_rect.top
+
+    modules.profiler.count('surfaces')
+    scaled_part = pygame.Surface((scaled_right - scaled_left, scaled_bottom - scaled_top), piece.get_flags() & pygame.SRCALPHA, piece)
+    if scaled_part.get_width() > 0 and scaled_part.get_height() > 0:
+        piece_pixels = pygame.surfarray.pixels2d(piece)
+        scaled_pixels = pygame.surfarray.pixels2d(scaled_part)
+        # Gathering the columns and then the rows (out of only the source pixels that are used) is much faster than looking up every pixel at once
+        used_pixels = piece_pixels[source_x[0]:source_x[-1] + 1, source_y[0]:source_y[-1] + 1]
+        scaled_pixels[:] = numpy.take(used_pixels[source_x - source_x[0]], source_y - source_y[0], axis=1)
+        del piece_pixels, scaled_pixels # Unlock the surfaces
+    return scaled_part, (scaled_left, scaled_top)
+
+# Average every 2x2 block of pixels of source into a pixel of level (half the size of source), inside rect of level.
+# Each pixel of the level only depends on its own block, so redrawing part of a level gives the same pixels as building all of it.
+def downsample_region(source, level, rect):
+    # Sources that are a single pixel wide (or high) are only halved in the other direction
+    block_width = 2 if source.get_width() > 1 else 1
+    block_height = 2 if source.get_height() > 1 else 1
+    source_region = (slice(rect.left * block_width, rect.right * block_width), slice(rect.top * block_height, rect.bottom * block_height))
+    channels = [(pygame.surfarray.pixels3d(source), pygame.surfarray.pixels3d(level))]
+    if source.get_flags() & pygame.SRCALPHA:
+        channels.append((pygame.surfarray.pixels_alpha(source), pygame.surfarray.pixels_alpha(level)))
+    for source_channel, level_channel in channels:
+        block_pixels = source_channel[source_region].astype(numpy.uint16)
+        block_sum = 0
+        for x in range(block_width):
+            for y in range(block_height):
+                block_sum = block_sum + block_pixels[x::block_width, y::block_height]
+        level_channel[rect.left:rect.right, rect.top:rect.bottom] = (block_sum + block_width * block_height // 2) // (block_width * block_height)
+    del channels # Unlock the surfaces
+
+# Replace the pixels of destination inside region with source (positioned at pos), including the alpha values.
+def replace_region(destination, source, pos, region):
+    # A normal blit would blend the transparent pixels with what is already there.
+    # Clearing the region first and keeping the maximum of each channel copies the source exactly.
+    destination.set_clip(region)
+    destination.fill((0, 0, 0, 0), region)
+    destination.blit(source, pos, special_flags=pygame.BLEND_RGBA_MAX)
+    destination.set_clip(None)
+
+# Class for keeping scaled copies (renditions) of an image between frames, so the image only has to be rescaled when the zoom or the pixels change.
+class ScaledImageCache:
+    def __init__(self, memory_budget=None):
+        # Maximum number of bytes the cache may use. If None, modules.settings.scaled_image_cache_budget is used.
+        self.memory_budget = memory_budget
+
+        # The image that the renditions are scaled from
+        self.image = None
+
+        # Scaled renditions of the image keyed by zoom level, ordered from least to most recently used.
+        # Each entry is (rendition, source) where source is the image or mipmap level that it was scaled from.
+        self.renditions = OrderedDict()
+        self.rendition_memory = 0
+
+        # Mipmap pyramid of the image: [image, half size, quarter size, ...]. Built lazily for zoom levels below 1.
+        self.mipmaps = None
+        self.mipmap_memory = 0
+
+    def get_memory_budget(self):
+        if self.memory_budget is None:
+            return modules.settings.scaled_image_cache_budget
+        return self.memory_budget
+
+    def get_memory_used(self):
+        return self.rendition_memory + self.mipmap_memory
+
+    def invalidate(self):
+        # Forget every rendition and mipmap. Called when the pixels of the image are edited.
+        self.renditions.clear()
+        self.rendition_memory = 0
+        self.mipmaps = None
+        self.mipmap_memory = 0
+
+    def set_image(self, image):
+        # Start caching a different image
+        if image is not self.image:
+            self.invalidate()
+            self.image = image
+
+    def get_mipmaps(self):
+        # Build the mipmap pyramid by repeatedly halving the image, down to a single pixel.
+        if self.mipmaps is None:
+            self.mipmaps = [self.image]
+            self.mipmap_memory = 0
+            while self.mipmaps[-1].get_width() > 1 or self.mipmaps[-1].get_height() > 1:
+                previous_level = self.mipmaps[-1]
+                level_size = (max(1, previous_level.get_width() // 2), max(1, previous_level.get_height() // 2))
+                level = pygame.Surface(level_size, previous_level.get_flags() & pygame.SRCALPHA, previous_level)
+                downsample_region(previous_level, level, level.get_rect())
+                self.mipmaps.append(level)
+                modules.profiler.count('surfaces')
+                self.mipmap_memory += level_size[0] * level_size[1] * 4
+        return self.mipmaps
+
+    def get_mipmap_level(self, scaled_size):
+        # Returns the smallest mipmap level that is still at least as big as scaled_size.
+        best_level = self.image
+        for level in self.get_mipmaps():
+            if level.get_width() < scaled_size[0] or level.get_height() < scaled_size[1]:
+                break
+            best_level = level
+        return best_level
+
+    def scale(self, source, scaled_size):
+        # Scale the source to scaled_size, keeping the pixels sharp. When zoomed out, the source is a mipmap level less than twice the scaled size, which is already smoothed.
+        # This is the same lookup as scale_region(), so the parts that patch() redraws match a rendition that is scaled again from scratch.
+        modules.profiler.count('surfaces')
+        return pygame.transform.scale(source, scaled_size)
+
+    def get(self, image, zoom, scaled_size):
+        # Returns the image scaled to scaled_size, or None if it does not fit in the memory budget.
+        self.set_image(image)
+
+        if zoom in self.renditions:
+            # Mark the rendition as the most recently used one
+            self.renditions.move_to_end(zoom)
+            return self.renditions[zoom][0]
+
+        rendition_memory = scaled_size[0] * scaled_size[1] * 4
+        mipmap_memory = self.mipmap_memory
+        if zoom < 1 and self.mipmaps is None:
+            # The levels of a mipmap pyramid add up to about a third of the image
+            mipmap_memory = self.image.get_width() * self.image.get_height() * 4 // 3
+        if rendition_memory + mipmap_memory > self.get_memory_budget():
+            return None
+
+        if zoom < 1:
+            source = self.get_mipmap_level(scaled_size)
+        else:
+            source = self.image
+
+        # Evict the least recently used renditions until the new one fits
+        while self.renditions and self.get_memory_used() + rendition_memory > self.get_memory_budget():
+            evicted_rendition = self.renditions.popitem(last=False)[1][0]
+            self.rendition_memory -= evicted_rendition.get_width() * evicted_rendition.get_height() * 4
+
+        rendition = self.scale(source, scaled_size)
+        self.renditions[zoom] = (rendition, source)
+        self.rendition_memory += rendition_memory
+        return rendition
+
+    def patch(self, image, rects):
+        # Redraw only the edited rects (in image pixels) of every mipmap level and rendition, instead of forgetting them.
+        if image is not self.image:
+            self.set_image(image)
+            return
+
+        # Edited rects of each source that renditions may be scaled from, keyed by id
+        source_rects = {id(self.image): rects}
+
+        if self.mipmaps is not None:
+            level_rects = rects
+            for previous_level, level in zip(self.mipmaps, self.mipmaps[1:]):
+                next_level_rects = []
+                for rect in level_rects:
+                    # The 2x2 blocks that the rect touches
+                    level_rect = pygame.Rect(rect.left // 2, rect.top // 2, -(-rect.right // 2) - rect.left // 2, -(-rect.bottom // 2) - rect.top // 2).clip(level.get_rect())
+                    if level.get_width() == previous_level.get_width():
+                        level_rect.left, level_rect.width = rect.left, rect.width
+                    if level.get_height() == previous_level.get_height():
+                        level_rect.top, level_rect.height = rect.top, rect.height
+                    downsample_region(previous_level, level, level_rect)
+                    next_level_rects.append(level_rect)
+                level_rects = next_level_rects
+                source_rects[id(level)] = level_rects
+
+        for rendition, source in self.renditions.values():
+            for rect in source_rects.get(id(source), ()):
+                scaled_rect = get_scaled_rect(rect, source.get_size(), rendition.get_size())
+                scaled_part, pos = scale_region(source, rendition.get_size(), scaled_rect)
+                replace_region(rendition, scaled_part, pos, scaled_rect)
@@ -0,0 +1,126 @@
+## Author: Alexander Art
+
+import numpy
+import pygame
+
+import modules.chunked_image
+import modules.profiler
+
+# Class for measuring how visible the seams of a tile are, where its edges meet when it repeats.
+# For every row, the color jump across the left/right seam is compared with how much the colors change anyway near those edges (the gradient energy).
+# The same is done for every column across the top/bottom seam. A jump that is no bigger than the changes around it does not stand out.
+# The measurements are kept between frames and only the rows and columns that were painted near the edges are measured again.
+class SeamAnalyzer:
+    def __init__(self, band_width=4):
+        # Number of pixels next to each edge that the gradient energy is measured over
+        self.band_width = band_width
+
+        self.image = None
+
+        # Color jump across the left/right seam for each row, and across the top/bottom seam for each column (0-255)
+        self.row_jumps = None
+        self.column_jumps = None
+        # Average color change between neighboring pixels near the edges, for each row and each column
+        self.row_energy = None
+        self.column_energy = None
+
+        # Heatmap surfaces (1 pixel wide or high) of the seams, made by get_heatmaps(). None when they need to be made again.
+        self.heatmaps = None
+
+    def set_image(self, image):
+        # Start analyzing a different image
+        if image is not self.image:
+            self.image = image
+            width, height = image.get_size()
+            self.row_jumps = numpy.zeros(height, dtype=numpy.float32)
+            self.row_energy = numpy.zeros(height, dtype=numpy.float32)
+            self.column_jumps = numpy.zeros(width, dtype=numpy.float32)
+            self.column_energy = numpy.zeros(width, dtype=numpy.float32)
+            self.measure_rows(0, height)
+            self.measure_columns(0, width)
+
+    def get_band_width(self, size):
+        # The bands near opposite edges must not overlap on small images
+        return max(1, min(self.band_width, size // 2 - 1))
+
+    def measure_rows(self, top, bottom):
+        # Measure the left/right seam of rows top to bottom
+        width, height = self.image.get_size()
+        if width < 2:
+            # A single column of pixels meets itself at the seam, so there is nothing to measure
+            self.row_jumps[top:bottom] = 0
+            self.row_energy[top:bottom] = 0
+            self.heatmaps = None
+            return
+        band_width = self.get_band_width(width)
+        left_band = modules.chunked_image.read_colors(self.image, (0, top, band_width + 1, bottom - top)).astype(numpy.float32)
+        right_band = modules.chunked_image.read_colors(self.image, (width - band_width - 1, top, band_width + 1, bottom - top)).astype(numpy.float32)
+        # Jump from the last pixel of each row to the first one, like when the image repeats
+        self.row_jumps[top:bottom] = numpy.linalg.norm(left_band[0] - right_band[-1], axis=1) / numpy.sqrt(3)
+        band_changes = numpy.concatenate((numpy.diff(left_band, axis=0), numpy.diff(right_band, axis=0)))
+        self.row_energy[top:bottom] = numpy.linalg.norm(band_changes, axis=2).mean(axis=0) / numpy.sqrt(3)
+        self.heatmaps = None
+
+    def measure_columns(self, left, right):
+        # Measure the top/bottom seam of columns left to right
+        width, height = self.image.get_size()
+        if height < 2:
+            self.column_jumps[left:right] = 0
+            self.column_energy[left:right] = 0
+            self.heatmaps = None
+            return
+        band_width = self.get_band_width(height)
+        top_band = modules.chunked_image.read_colors(self.image, (left, 0, right - left, band_width + 1)).astype(numpy.float32)
+        bottom_band = modules.chunked_image.read_colors(self.image, (left, height - band_width - 1, right - left, band_width + 1)).astype(numpy.float32)
+        self.column_jumps[left:right] = numpy.linalg.norm(top_band[:, 0] - bottom_band[:, -1], axis=1) / numpy.sqrt(3)
+        band_changes = numpy.concatenate((numpy.diff(top_band, axis=1), numpy.diff(bottom_band, axis=1)), axis=1)
+        self.column_energy[left:right] = numpy.linalg.norm(band_changes, axis=2).mean(axis=1) / numpy.sqrt(3)
+        self.heatmaps = None
+
+    def update(self, image, rects):
+        # Measure again where rects (in image pixels, inside the image) were painted. Only rects that reach the bands near the edges matter.
+        if image is not self.image:
+            self.set_image(image)
+            return
+        width, height = image.get_size()
+        band_width_x = self.get_band_width(width) + 1
+        band_width_y = self.get_band_width(height) + 1
+        for rect in rects:
+            if rect.left < band_width_x or rect.right > width - band_width_x:
+                self.measure_rows(rect.top, rect.bottom)
+            if rect.top < band_width_y or rect.bottom > height - band_width_y:
+                self.measure_columns(rect.left, rect.right)
+
+    def get_row_visibility(self):
+        # How much the jump across the left/right seam stands out from the changes around it, for each row
+        return numpy.maximum(self.row_jumps - self.row_energy, 0)
+
+    def get_column_visibility(self):
+        return numpy.maximum(self.column_jumps - self.column_energy, 0)
+
+    def get_score(self):
+        # A single number for how visible the seams are: the average of how much they stand out (0 means they do not stand out at all)
+        return float(numpy.concatenate((self.get_row_visibility(), self.get_column_visibility())).mean())
+
+    def get_score_text(self):
+        if self.image is None:
+            return ""
+        return f"Seam score: {self.get_score():.1f}"
+
+    def get_heatmaps(self):
+        # Returns (vertical, horizontal) heatmap surfaces of the seams. The vertical one is 1 pixel wide and as high as the image, showing each row of the left/right seam.
+        # The horizontal one shows each column of the top/bottom seam. Green is seamless, red stands out.
+        if self.heatmaps is None:
+            vertical_heatmap = pygame.surfarray.make_surface(self.make_heatmap(self.get_row_visibility())[numpy.newaxis])
+            horizontal_heatmap = pygame.surfarray.make_surface(self.make_heatmap(self.get_column_visibility())[:, numpy.newaxis])
+            modules.profiler.count('surfaces', 2)
+            self.heatmaps = (vertical_heatmap, horizontal_heatmap)
+        return self.heatmaps
+
+    def make_heatmap(self, visibility):
+        # Colors (indexed [position, channel]) from green (0) to red (64 or more)
+        heat = numpy.clip(visibility / 64, 0, 1)
+        colors = numpy.zeros((len(visibility), 3), dtype=numpy.uint8)
+        colors[:, 0] = numpy.rint(255 * numpy.minimum(1, heat * 2))
+        colors[:, 1] = numpy.rint(255 * numpy.minimum(1, (1 - heat) * 2))
+        return colors
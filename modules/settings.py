@@ -4,4 +4,41 @@ tiling_enabled = True
 
 def toggle_tiling():
     global tiling_enabled
-    tiling_enabled = not tiling_enabled
\ No newline at end of file
+    tiling_enabled = not tiling_enabled
+
+# Pattern that the image repeats in while tiling is enabled (see modules/tile_patterns.py)
+tiling_patterns = ['grid', 'mirror', 'half_drop', 'brick', 'rotated']
+tiling_pattern = 'grid'
+
+def cycle_tiling_pattern():
+    global tiling_pattern
+    tiling_pattern = tiling_patterns[(tiling_patterns.index(tiling_pattern) + 1) % len(tiling_patterns)]
+
+def get_tiling_pattern_text():
+    if not tiling_enabled:
+        return "Tiling off"
+    return "Pattern: " + tiling_pattern.replace('_', '-')
+
+# Memory budget (in bytes) for the scaled copies of the image that the canvas keeps between frames.
+# Zoom levels whose scaled image would not fit are rendered by only scaling the visible part of the image instead.
+scaled_image_cache_budget = 128 * 1024 * 1024
+
+# Memory budget (in bytes) for the compressed undo/redo history. The oldest strokes are forgotten when it is full.
+history_memory_budget = 64 * 1024 * 1024
+
+# Very large images are kept in chunks (see modules/chunked_image.py) instead of a single surface, so they do not have to fit in memory all at once.
+chunked_images_enabled = True
+# Images with at least this many pixels are kept in chunks
+chunked_image_min_pixels = 8192 * 8192
+# Memory budget (in bytes) for the chunks of an image. Chunks over the budget are paged out to a temporary file.
+chunked_image_memory_budget = 256 * 1024 * 1024
+
+# Changes to an image are written to a journal file next to it (image.png.journal), so they can be recovered if the program closes without saving.
+journal_enabled = True
+# Seconds between writes of new changes to the journal
+journal_flush_interval = 2
+# Size (in bytes) at which the journal is compacted into a single checkpoint
+journal_checkpoint_size = 16 * 1024 * 1024
+
+# Width (in pixels) that the "Blend seams" button cross-fades the edges of the image over
+seam_blend_width = 16
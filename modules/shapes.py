@@ -0,0 +1,77 @@
+## Author: Alexander Art
+
+import numpy
+
+import modules.stamp
+
+# Line, rectangle, and ellipse shapes that are dragged out from one point to another.
+# The outline of a shape is worked out as arrays of pixel positions with numpy, then widened to the brush size as spans (runs of pixels in a row),
+# so drawing a shape does not need a python call for every pixel. Positions may be outside of the image; the shape wraps around the edges like the image tiles.
+
+shape_names = ['line', 'rectangle', 'ellipse']
+
+def get_line_points(start, end):
+    # Pixels of a 1 pixel wide line from start to end (both included), the same pixels Bresenham's algorithm picks (up to how ties are rounded)
+    delta_x = end[0] - start[0]
+    delta_y = end[1] - start[1]
+    steps = max(abs(delta_x), abs(delta_y))
+    if steps == 0:
+        return numpy.array([start[0]]), numpy.array([start[1]])
+    # Move one pixel along the longer axis every step, rounding the position along the other axis to the nearest pixel
+    step_numbers = numpy.arange(steps + 1)
+    points_x = start[0] + (2 * step_numbers * delta_x + steps) // (2 * steps)
+    points_y = start[1] + (2 * step_numbers * delta_y + steps) // (2 * steps)
+    return points_x, points_y
+
+def get_rectangle_points(start, end):
+    # Outline of the rectangle with opposite corners at start and end
+    corners = [start, (end[0], start[1]), end, (start[0], end[1]), start]
+    sides = [get_line_points(corners[index], corners[index + 1]) for index in range(4)]
+    return numpy.concatenate([side[0] for side in sides]), numpy.concatenate([side[1] for side in sides])
+
+def get_ellipse_points(start, end):
+    # Outline of the ellipse that fits in the rectangle with opposite corners at start and end
+    left, right = min(start[0], end[0]), max(start[0], end[0])
+    top, bottom = min(start[1], end[1]), max(start[1], end[1])
+    if left == right or top == bottom:
+        return get_line_points((left, top), (right, bottom))
+    center_x = (left + right) / 2
+    center_y = (top + bottom) / 2
+    radius_x = (right - left) / 2
+    radius_y = (bottom - top) / 2
+
+    # One point above and below the center for every column, and one left and right of the center for every row.
+    # Together they leave no gaps, where the outline is flat as well as where it is steep (like the two regions of the midpoint ellipse algorithm).
+    columns = numpy.arange(left, right + 1)
+    column_heights = radius_y * numpy.sqrt(numpy.maximum(0, 1 - ((columns - center_x) / radius_x) ** 2))
+    rows = numpy.arange(top, bottom + 1)
+    row_widths = radius_x * numpy.sqrt(numpy.maximum(0, 1 - ((rows - center_y) / radius_y) ** 2))
+    points_x = numpy.concatenate((columns, columns, numpy.floor(center_x - row_widths + 0.5), numpy.floor(center_x + row_widths + 0.5)))
+    points_y = numpy.concatenate((numpy.floor(center_y - column_heights + 0.5), numpy.floor(center_y + column_heights + 0.5), rows, rows))
+    return points_x.astype(int), points_y.astype(int)
+
+def get_shape_points(shape, start, end):
+    if shape == 'line':
+        return get_line_points(start, end)
+    if shape == 'rectangle':
+        return get_rectangle_points(start, end)
+    return get_ellipse_points(start, end)
+
+def get_stroke_spans(points_x, points_y, coverage):
+    # Widen 1 pixel wide outline points to spans covering the stamp coverage (see modules/stamp.py) centered on each point.
+    # Returns arrays of the rows, starts, and ends of the spans. Spans of neighboring points overlap.
+    size = coverage.shape[0] // 2
+    stamp_rows = numpy.flatnonzero(coverage.any(axis=0))
+    stamp_starts = coverage[:, stamp_rows].argmax(axis=0)
+    stamp_ends = coverage.shape[0] - coverage[::-1, stamp_rows].argmax(axis=0)
+    rows = points_y[:, numpy.newaxis] - size + stamp_rows
+    starts = points_x[:, numpy.newaxis] - size + stamp_starts
+    ends = points_x[:, numpy.newaxis] - size + stamp_ends
+    return rows.ravel(), starts.ravel(), ends.ravel()
+
+def get_shape_region(shape, start, end, coverage, size):
+    # Returns the region (see modules.stamp.get_spans_region()) of the shape dragged from start to end (in image pixels, may be outside of the image)
+    # on an image of the given size, drawn with the stamp coverage.
+    points_x, points_y = get_shape_points(shape, start, end)
+    rows, starts, ends = get_stroke_spans(points_x, points_y, coverage)
+    return modules.stamp.get_spans_region(*modules.stamp.wrap_spans(rows, starts, ends, size))
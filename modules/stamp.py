@@ -0,0 +1,127 @@
+## Author: Alexander Art
+
+import numpy
+import pygame
+
+import modules.chunked_image
+import modules.utils
+
+# Stamps are square arrays with sides of 2 * size + 1 pixels, indexed [x, y] like pygame.surfarray.
+
+# Distance of every pixel of a stamp from the center pixel
+def get_distance_field(size):
+    offsets = numpy.arange(-size, size + 1, dtype=numpy.float64)
+    return numpy.hypot(offsets[:, numpy.newaxis], offsets[numpy.newaxis, :])
+
+# Coverage (which pixels get painted) and opacity of the soft 'brush' shape. The opacity fades out linearly towards the edge.
+# hardness is the fraction of the radius that stays fully opaque before fading out (0 fades out from the center).
+def get_brush_masks(size, hardness=0):
+    distance_field = get_distance_field(size)
+    coverage = distance_field <= size
+    opacity = 1 - distance_field / size
+    if hardness >= 1:
+        opacity = numpy.ones_like(opacity)
+    elif hardness > 0:
+        opacity = numpy.minimum(opacity / (1 - hardness), 1)
+    opacity = numpy.where(coverage, opacity, 0)
+    return coverage, opacity
+
+# Coverage of the hard 'circle' shape
+def get_circle_mask(size):
+    return get_distance_field(size) <= size
+
+# Blend a color onto an image inside a stamp centered at center, wrapping around the edges of the image.
+# coverage is a boolean array of which stamp pixels to blend, opacity scales the color's alpha for each stamp pixel.
+# Returns the rects of the image that were changed.
+def blend_stamp(image, center, color, coverage, opacity):
+    size = coverage.shape[0] // 2
+    stamp_rect = pygame.Rect(center[0] - size, center[1] - size, coverage.shape[0], coverage.shape[1])
+    pieces = modules.utils.split_wrapped_rect(stamp_rect, image.get_size())
+
+    for piece, offset in pieces:
+        # The image may be split into several surfaces (see modules/chunked_image.py)
+        for surface, surface_rect, surface_offset in modules.chunked_image.get_pieces(image, piece):
+            start_x = offset[0] + surface_offset[0]
+            start_y = offset[1] + surface_offset[1]
+            piece_coverage = coverage[start_x:start_x + surface_rect.width, start_y:start_y + surface_rect.height]
+            piece_opacity = opacity[start_x:start_x + surface_rect.width, start_y:start_y + surface_rect.height]
+            # Pixels outside of the coverage get an alpha of 0, which leaves them unchanged
+            modules.utils.blend_color(surface, surface_rect, color, numpy.where(piece_coverage, color[3] * piece_opacity, 0))
+
+    return [piece for piece, offset in pieces]
+
+# Set the pixels of an image inside a stamp centered at center to a color, wrapping around the edges of the image.
+# coverage is a boolean array of which stamp pixels to set.
+# Returns the rects of the image that were changed.
+def fill_stamp(image, center, color, coverage):
+    size = coverage.shape[0] // 2
+    stamp_rect = pygame.Rect(center[0] - size, center[1] - size, coverage.shape[0], coverage.shape[1])
+    pieces = modules.utils.split_wrapped_rect(stamp_rect, image.get_size())
+
+    for piece, offset in pieces:
+        # The image may be split into several surfaces (see modules/chunked_image.py)
+        for surface, surface_rect, surface_offset in modules.chunked_image.get_pieces(image, piece):
+            start_x = offset[0] + surface_offset[0]
+            start_y = offset[1] + surface_offset[1]
+            piece_coverage = coverage[start_x:start_x + surface_rect.width, start_y:start_y + surface_rect.height]
+            surface_pixels = pygame.surfarray.pixels3d(surface)
+            surface_alpha = pygame.surfarray.pixels_alpha(surface)
+            surface_pixels[surface_rect.left:surface_rect.right, surface_rect.top:surface_rect.bottom][piece_coverage] = color[:3]
+            surface_alpha[surface_rect.left:surface_rect.right, surface_rect.top:surface_rect.bottom][piece_coverage] = color[3]
+            del surface_pixels, surface_alpha # Unlock the surface
+
+    return [piece for piece, offset in pieces]
+
+# Regions are lists of (rect, mask) pieces, where each mask is indexed [x, y] like pygame.surfarray and says which pixels of its rect (inside the image) belong to the region.
+# They are made from spans: runs of pixels in a row, from start to end (not included).
+# The pieces are bands of this many rows, matching the tiles of the undo history, so painting a region only records the tiles it touches.
+region_band_height = 64
+
+# Returns the region covered by spans given as arrays of rows, starts, and ends (inside the image). Spans may overlap each other.
+def get_spans_region(rows, starts, ends):
+    order = numpy.argsort(rows, kind='stable')
+    rows, starts, ends = rows[order], starts[order], ends[order]
+    pieces = []
+    bands = rows // region_band_height
+    band_offsets = numpy.flatnonzero(numpy.diff(bands, prepend=-1))
+    for band_index, first in enumerate(band_offsets):
+        last = band_offsets[band_index + 1] if band_index + 1 < len(band_offsets) else len(rows)
+        band_rows, band_starts, band_ends = rows[first:last], starts[first:last], ends[first:last]
+        rect = pygame.Rect(int(band_starts.min()), int(band_rows[0]), 0, 0)
+        rect.width = int(band_ends.max()) - rect.left
+        rect.height = int(band_rows[-1]) + 1 - rect.top
+
+        # Count the spans that start and end at each pixel, then add up along the rows: pixels inside at least one span add up to more than 0
+        span_offsets = (band_rows - rect.top) * (rect.width + 1) - rect.left
+        mask_length = rect.height * (rect.width + 1)
+        changes = numpy.bincount(span_offsets + band_starts, minlength=mask_length) - numpy.bincount(span_offsets + band_ends, minlength=mask_length)
+        mask = numpy.cumsum(changes.reshape(rect.height, rect.width + 1), axis=1)[:, :rect.width] > 0
+        pieces.append((rect, mask.T))
+    return pieces
+
+# Split spans that may stick out of an image (of the given size) where they wrap around to the other sides of the image, the same way the image tiles.
+# Returns the rows, starts, and ends of spans inside the image.
+def wrap_spans(rows, starts, ends, size):
+    width, height = size
+    rows = rows % height
+    # Spans at least as wide as the image cover the whole row
+    lengths = numpy.minimum(ends - starts, width)
+    starts = numpy.where(lengths == width, 0, starts % width)
+    ends = starts + lengths
+    # Spans that go past the right edge continue from the left edge
+    wrapped = ends > width
+    rows = numpy.concatenate((rows, rows[wrapped]))
+    starts = numpy.concatenate((starts, numpy.zeros(numpy.count_nonzero(wrapped), dtype=starts.dtype)))
+    ends = numpy.concatenate((numpy.minimum(ends, width), ends[wrapped] - width))
+    return rows, starts, ends
+
+# Set the pixels of a region to a color. Returns the rects of the image that were changed.
+def fill_region(image, region, color):
+    for rect, mask in region:
+        # The image may be split into several surfaces (see modules/chunked_image.py)
+        for surface, surface_rect, offset in modules.chunked_image.get_pieces(image, rect):
+            piece_mask = mask[offset[0]:offset[0] + surface_rect.width, offset[1]:offset[1] + surface_rect.height]
+            surface_pixels = pygame.surfarray.pixels2d(surface)
+            surface_pixels[surface_rect.left:surface_rect.right, surface_rect.top:surface_rect.bottom][piece_mask] = surface.map_rgb(color) & 0xFFFFFFFF # map_rgb() can return the pixel as a negative number
+            del surface_pixels # Unlock the surface
+    return [rect for rect, mask in region]
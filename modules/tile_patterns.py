@@ -0,0 +1,208 @@
+## Author: Alexander Art
+
+import numpy
+import pygame
+
+import modules.profiler
+import modules.utils
+
+# Patterns that a tile can repeat in besides a plain grid. Each pattern is a block of copies of the tile (the super-tile), some of them flipped, rotated, or shifted.
+# The super-tile repeats in a plain grid, so the canvas draws it the same way it draws a tile that repeats in a grid.
+# The super-tile is built once and afterwards only the parts of it that show painted pixels are updated.
+# Painting on the super-tile is mapped back through the transform of the copy that was painted on, so it lands on the right pixels of the tile.
+#
+# Every copy in a super-tile is the size of the tile, laid out in a grid of rows and columns. Each copy is (transform, shift), where the tile is
+# first shifted by (x, y) pixels (wrapping around its edges) and then transformed by one of:
+#     'none', 'flip_x', 'flip_y', 'flip_xy', 'rotate_90', 'rotate_180', 'rotate_270' (rotations are clockwise)
+#
+# The patterns:
+#     'grid'      the tile repeats as it is
+#     'mirror'    every other copy is mirrored, so neighboring copies always meet at matching edges
+#     'half_drop' every other column of copies is shifted down by half the tile
+#     'brick'     every other row of copies is shifted right by half the tile
+#     'rotated'   the copies turn around a corner (square tiles only; other tiles alternate with copies turned by 180 degrees)
+
+inverse_transforms = {'none': 'none', 'flip_x': 'flip_x', 'flip_y': 'flip_y', 'flip_xy': 'flip_xy', 'rotate_90': 'rotate_270', 'rotate_180': 'rotate_180', 'rotate_270': 'rotate_90'}
+
+def get_pattern_copies(pattern, size):
+    # Returns the copies of the tile in the super-tile of a pattern, as rows of (transform, shift)
+    width, height = size
+    if pattern == 'mirror':
+        return [[('none', (0, 0)), ('flip_x', (0, 0))],
+                [('flip_y', (0, 0)), ('flip_xy', (0, 0))]]
+    if pattern == 'half_drop':
+        return [[('none', (0, 0)), ('none', (0, height // 2))]]
+    if pattern == 'brick':
+        return [[('none', (0, 0))],
+                [('none', (width // 2, 0))]]
+    if pattern == 'rotated':
+        if width == height:
+            return [[('none', (0, 0)), ('rotate_90', (0, 0))],
+                    [('rotate_270', (0, 0)), ('rotate_180', (0, 0))]]
+        return [[('none', (0, 0)), ('rotate_180', (0, 0))],
+                [('rotate_180', (0, 0)), ('none', (0, 0))]]
+    return [[('none', (0, 0))]]
+
+def transform_pixels(pixels, transform):
+    # Returns a view of an array of pixels (indexed [x, y] like pygame.surfarray) with the transform applied
+    if transform == 'flip_x':
+        return pixels[::-1]
+    if transform == 'flip_y':
+        return pixels[:, ::-1]
+    if transform == 'flip_xy' or transform == 'rotate_180':
+        return pixels[::-1, ::-1]
+    if transform == 'rotate_90':
+        return pixels.swapaxes(0, 1)[::-1]
+    if transform == 'rotate_270':
+        return pixels.swapaxes(0, 1)[:, ::-1]
+    return pixels
+
+def transform_points(points_x, points_y, transform, size):
+    # Where pixels (numbers or arrays, may be outside of the tile) of a tile of the given size end up after the transform
+    width, height = size
+    if transform == 'flip_x':
+        return width - 1 - points_x, points_y
+    if transform == 'flip_y':
+        return points_x, height - 1 - points_y
+    if transform == 'flip_xy' or transform == 'rotate_180':
+        return width - 1 - points_x, height - 1 - points_y
+    if transform == 'rotate_90':
+        return height - 1 - points_y, points_x
+    if transform == 'rotate_270':
+        return points_y, width - 1 - points_x
+    return points_x, points_y
+
+def transform_rect(rect, transform, size):
+    # Where a rect (inside a tile of the given size) ends up after the transform
+    width, height = size
+    if transform == 'flip_x':
+        return pygame.Rect(width - rect.right, rect.top, rect.width, rect.height)
+    if transform == 'flip_y':
+        return pygame.Rect(rect.left, height - rect.bottom, rect.width, rect.height)
+    if transform == 'flip_xy' or transform == 'rotate_180':
+        return pygame.Rect(width - rect.right, height - rect.bottom, rect.width, rect.height)
+    if transform == 'rotate_90':
+        return pygame.Rect(height - rect.bottom, rect.left, rect.height, rect.width)
+    if transform == 'rotate_270':
+        return pygame.Rect(rect.top, width - rect.right, rect.height, rect.width)
+    return pygame.Rect(rect)
+
+def transform_surface(surface, transform):
+    # Returns a transformed copy of a surface, with the same pixel format
+    pixels = pygame.surfarray.pixels2d(surface)
+    transformed_pixels = transform_pixels(pixels, transform)
+    transformed = pygame.Surface(transformed_pixels.shape, surface.get_flags() & pygame.SRCALPHA, surface)
+    transformed_view = pygame.surfarray.pixels2d(transformed)
+    transformed_view[:] = transformed_pixels
+    del pixels, transformed_view # Unlock the surfaces
+    return transformed
+
+# Class for the super-tile of the image that the canvas shows, in the pattern that it repeats in
+class SuperTile:
+    def __init__(self):
+        # The tile and pattern that the super-tile was built from
+        self.source = None
+        self.pattern = 'grid'
+        # Rows of (transform, shift) for each copy of the tile (see get_pattern_copies())
+        self.copies = [[('none', (0, 0))]]
+        # The super-tile, or None while the pattern is a plain grid (the tile is shown as it is)
+        self.surface = None
+
+    def get_image(self, source, pattern):
+        # Returns the super-tile of source repeating in pattern. It is built again if the tile (or its size) or the pattern changed.
+        if source is not self.source or pattern != self.pattern or (self.surface is not None and self.surface.get_size() != self.get_size(source)):
+            self.source = source
+            self.pattern = pattern
+            self.copies = get_pattern_copies(pattern, source.get_size())
+            if pattern == 'grid':
+                self.surface = None
+            else:
+                self.surface = pygame.Surface(self.get_size(source), pygame.SRCALPHA, source)
+                modules.profiler.count('surfaces')
+                self.update([source.get_rect()])
+        if self.surface is None:
+            return source
+        return self.surface
+
+    def get_size(self, source=None):
+        # Size of the super-tile
+        if source is None:
+            source = self.source
+        return (source.get_width() * len(self.copies[0]), source.get_height() * len(self.copies))
+
+    def update(self, rects):
+        # Copy the pixels inside rects (of the tile, inside the tile) that were painted to every copy in the super-tile.
+        # Returns where the copies of rects are in the super-tile.
+        if self.surface is None:
+            return rects
+        size = self.source.get_size()
+        source_pixels = pygame.surfarray.pixels2d(self.source)
+        super_tile_pixels = pygame.surfarray.pixels2d(self.surface)
+        super_tile_rects = []
+        for rect in rects:
+            for row, copies in enumerate(self.copies):
+                for column, (transform, shift) in enumerate(copies):
+                    # The rect is shifted first, which may wrap it around the edges of the tile
+                    for piece, offset in modules.utils.split_wrapped_rect(pygame.Rect(rect).move(shift), size):
+                        source_rect = pygame.Rect(rect.left + offset[0], rect.top + offset[1], piece.width, piece.height)
+                        copy_rect = transform_rect(piece, transform, size).move(column * size[0], row * size[1])
+                        super_tile_pixels[copy_rect.left:copy_rect.right, copy_rect.top:copy_rect.bottom] = transform_pixels(source_pixels[source_rect.left:source_rect.right, source_rect.top:source_rect.bottom], transform)
+                        super_tile_rects.append(copy_rect)
+        del source_pixels, super_tile_pixels # Unlock the surfaces
+        return super_tile_rects
+
+    def map_pieces(self, pieces):
+        # Returns the pieces (rect in the tile, surface the size of the rect) as they are shown in the super-tile, as (rect in the super-tile, surface).
+        # Used for drawing things over the view that are not part of the image (like the preview of a shape).
+        if self.surface is None:
+            return pieces
+        size = self.source.get_size()
+        super_tile_pieces = []
+        for rect, surface in pieces:
+            for row, copies in enumerate(self.copies):
+                for column, (transform, shift) in enumerate(copies):
+                    for piece, offset in modules.utils.split_wrapped_rect(pygame.Rect(rect).move(shift), size):
+                        piece_surface = transform_surface(surface.subsurface((offset, piece.size)), transform)
+                        super_tile_pieces.append((transform_rect(piece, transform, size).move(column * size[0], row * size[1]), piece_surface))
+        return super_tile_pieces
+
+    def to_source(self, points_x, points_y, anchor=None):
+        # Returns the pixels of the tile (wrapped inside the tile) that pixels of the super-tile (numbers or numpy arrays, may be outside of the super-tile) show.
+        # If anchor (a pixel of the super-tile) is given, every point is mapped through the copy that the anchor is in, as if that copy continued past its edges.
+        # That keeps shapes that are dragged out from the anchor in one piece, even where they reach into other copies.
+        width, height = self.source.get_size()
+        super_width, super_height = self.get_size()
+        points_x = numpy.asarray(points_x)
+        points_y = numpy.asarray(points_y)
+        if anchor is None:
+            wrapped_x = points_x % super_width
+            wrapped_y = points_y % super_height
+            columns = wrapped_x // width
+            rows = wrapped_y // height
+            local_x = wrapped_x - columns * width
+            local_y = wrapped_y - rows * height
+        else:
+            column = anchor[0] % super_width // width
+            row = anchor[1] % super_height // height
+            # Top left corner of the anchor's copy, in the same (not wrapped) coordinates as the points
+            origin_x = anchor[0] - anchor[0] % super_width + column * width
+            origin_y = anchor[1] - anchor[1] % super_height + row * height
+            columns = numpy.full(points_x.shape, column)
+            rows = numpy.full(points_y.shape, row)
+            local_x = points_x - origin_x
+            local_y = points_y - origin_y
+
+        source_x = numpy.zeros(points_x.shape, dtype=numpy.int64)
+        source_y = numpy.zeros(points_y.shape, dtype=numpy.int64)
+        for row, copies in enumerate(self.copies):
+            for column, (transform, shift) in enumerate(copies):
+                in_copy = (rows == row) & (columns == column)
+                if not in_copy.any():
+                    continue
+                # Undo the transform, then the shift
+                unshifted_x, unshifted_y = transform_points(local_x[in_copy], local_y[in_copy], inverse_transforms[transform], (width, height) if transform in ('none', 'flip_x', 'flip_y', 'flip_xy', 'rotate_180') else (height, width))
+                source_x[in_copy] = unshifted_x - shift[0]
+                source_y[in_copy] = unshifted_y - shift[1]
+        if anchor is None:
+            return source_x % width, source_y % height
+        return source_x, source_y
@@ -2,6 +2,7 @@
 
 import pygame
 
+import modules.ui.font_cache
 from modules.ui.ui_style import Style
 
 # Class for button UI elements
@@ -11,6 +12,9 @@ class Button:
         # If the parent is a pygame surface instead of a panel, self.parent should remain None and rendering/input functions must be called explicitly.
         self.parent = None
 
+        # Global position, cached by get_global_pos()
+        self.cached_global_pos = None
+
         self.rect = pygame.Rect(rect) # Relative to parent
         self.action = action
         self.label = label
@@ -28,6 +32,8 @@ class Button:
     @size.setter
     def size(self, value):
         self.rect.size = value
+        self.invalidate_parent_hit_index()
+        self.request_parent_redraw()
 
     @property
     def width(self):
@@ -36,6 +42,8 @@ class Button:
     @width.setter
     def width(self, value):
         self.rect.width = value
+        self.invalidate_parent_hit_index()
+        self.request_parent_redraw()
 
     @property
     def height(self):
@@ -44,6 +52,8 @@ class Button:
     @height.setter
     def height(self, value):
         self.rect.height = value
+        self.invalidate_parent_hit_index()
+        self.request_parent_redraw()
         
     @property
     def local_x(self):
@@ -52,6 +62,9 @@ class Button:
     @local_x.setter
     def local_x(self, value):
         self.rect.x = value
+        self.invalidate_global_pos()
+        self.invalidate_parent_hit_index()
+        self.request_parent_redraw()
 
     @property
     def local_y(self):
@@ -60,16 +73,36 @@ class Button:
     @local_y.setter
     def local_y(self, value):
         self.rect.y = value
+        self.invalidate_global_pos()
+        self.invalidate_parent_hit_index()
+        self.request_parent_redraw()
+
+    def request_parent_redraw(self):
+        # The parent panel keeps an image of its children, which must be redrawn when this button changes.
+        if self.parent is not None:
+            self.parent.request_redraw()
+
+    def invalidate_global_pos(self):
+        # Forget the cached global position. Called when this element or one of its ancestors moves.
+        self.cached_global_pos = None
+
+    def invalidate_parent_hit_index(self):
+        # The parent panel finds the child under the mouse with an index of where its children are, which must be rebuilt when this element moves, resizes, or changes layer.
+        if self.parent is not None:
+            self.parent.invalidate_hit_index()
 
     def get_local_pos(self):
         return (self.local_x, self.local_y)
 
     def get_global_pos(self):
-        if self.parent is not None:
-            parent_pos = self.parent.get_global_pos() # Avoids redundant recursive calls
-            return (parent_pos[0] + self.local_x, parent_pos[1] + self.local_y)
-        else:
-            return (self.local_x, self.local_y)
+        # The global position is cached until this element or one of its ancestors moves.
+        if self.cached_global_pos is None:
+            if self.parent is not None:
+                parent_pos = self.parent.get_global_pos() # Avoids redundant recursive calls
+                self.cached_global_pos = (parent_pos[0] + self.local_x, parent_pos[1] + self.local_y)
+            else:
+                self.cached_global_pos = (self.local_x, self.local_y)
+        return self.cached_global_pos
 
     @property
     def global_x(self):
@@ -85,7 +118,9 @@ class Button:
     def get_global_bounding_rect(self):
         return pygame.Rect(self.get_global_pos(), self.size)
 
-    def render(self, surface):
+    def render(self, surface, offset=(0, 0)):
+        # offset is the global position of the top left corner of the passed surface.
+
         # Mouse position relative to the top left corner of the parent
         mouse_pos = (pygame.mouse.get_pos()[0] - self.parent.global_x, pygame.mouse.get_pos()[1] - self.parent.global_y)
 
@@ -96,18 +131,21 @@ class Button:
             color = self.style.button_default_bg_color
 
         # Draw button bounding rect
-        pygame.draw.rect(surface, color, self.get_global_bounding_rect())
+        pygame.draw.rect(surface, color, self.get_global_bounding_rect().move(-offset[0], -offset[1]))
 
         # Draw button label
         if self.is_hovered:
-            surface.blit(pygame.font.Font(None, self.style.button_text_size).render(self.label, True, self.style.button_hovered_text_color), (self.global_x + self.style.button_text_padding[0], self.global_y + self.style.button_text_padding[1]))
+            surface.blit(modules.ui.font_cache.render_text(self.label, self.style.button_text_size, self.style.button_hovered_text_color), (self.global_x + self.style.button_text_padding[0] - offset[0], self.global_y + self.style.button_text_padding[1] - offset[1]))
         else:
-            surface.blit(pygame.font.Font(None, self.style.button_text_size).render(self.label, True, self.style.button_default_text_color), (self.global_x + self.style.button_text_padding[0], self.global_y + self.style.button_text_padding[1]))
+            surface.blit(modules.ui.font_cache.render_text(self.label, self.style.button_text_size, self.style.button_default_text_color), (self.global_x + self.style.button_text_padding[0] - offset[0], self.global_y + self.style.button_text_padding[1] - offset[1]))
 
     def mouse_over(self, hovered):
         # Runs every frame. Set self.is_hovered.
         # hovered is True only if the mouse is over this button and is not being blocked by a UI element on a higher layer.        
-        self.is_hovered = hovered
+        if hovered != self.is_hovered:
+            # The button changes color when hovered
+            self.is_hovered = hovered
+            self.request_parent_redraw()
 
     def left_mouse_down(self):
         # This function runs on the left mousedown event.
@@ -116,6 +154,8 @@ class Button:
         if self.is_hovered and self.parent is not None:
             self.parent.buttons.remove(self)
             self.parent.buttons.append(self)
+            self.invalidate_parent_hit_index()
+            self.request_parent_redraw()
     
         # If this button is pressed, run its function.
         if self.is_hovered:
@@ -1,12 +1,28 @@
 ## Author: Alexander Art
 
 import math
-from tkinter import filedialog
+import os
+from tkinter import filedialog, simpledialog
 
+import numpy
 import pygame
 
+import modules.atlas
+import modules.chunked_image
+import modules.flood_fill
+import modules.image_io
+import modules.image_ops
+import modules.journal
+import modules.layers
+import modules.profiler
 import modules.settings
+import modules.shapes
+import modules.stamp
 import modules.utils
+from modules.history import History
+from modules.seam_analyzer import SeamAnalyzer
+from modules.tile_patterns import SuperTile
+from modules.scaled_image_cache import ScaledImageCache, get_scaled_rect, scale_region, scale_piece_region
 
 # Class for canvas UI element
 class Canvas:
@@ -15,6 +31,9 @@ class Canvas:
         # If the parent is a pygame surface instead of a panel, self.parent should remain None and rendering/input functions must be called explicitly.
         self.parent = None
 
+        # Global position, cached by get_global_pos()
+        self.cached_global_pos = None
+
         # Create rect object from rect argument.
         # Rect left (x) and top (y) values become the local x and y values for the canvas.
         self.rect = pygame.Rect(rect)
@@ -28,14 +47,65 @@ class Canvas:
         self.zoom = 1 # zoom < 1 means zoomed out. zoom > 1 means zoomed in.
         self.scroll = [0, 0]
 
+        # Layers of the image (see modules/layers.py), or None. The loaded image is the active layer, which is the one that gets painted.
+        self.layers = None
         self.loaded_image = None
+        # Tileset that the loaded image is a tile of (see modules/atlas.py), or None
+        self.atlas = None
+        # Index of the tile that is loaded, and of a tile that gets loaded once it is decoded (or None)
+        self.atlas_index = None
+        self.atlas_selection = None
+        # The flattened layers repeated in the tiling pattern (see modules/tile_patterns.py). Kept between frames and updated where the image is painted.
+        self.super_tile = SuperTile()
+        # Scaled copies of the view image (see get_view_image()), so it only gets rescaled when the zoom changes or the image is edited
+        self.scaled_image_cache = ScaledImageCache()
+        # Undo/redo history of the strokes painted on the loaded image (on every layer)
+        self.history = History()
+        # Journal of the changes since the loaded image was last saved (see modules/journal.py), or None
+        self.journal = None
+        # Number of changes in the journal when the save that is in progress started
+        self.saved_change_count = 0
+
+        # Measures how visible the seams of the image are. When enabled, a heatmap of the seams is drawn over the tiled image.
+        self.seam_analyzer = SeamAnalyzer()
+        self.seam_analyzer_enabled = False
+        # The heatmaps scaled to the zoomed image: (heatmaps they were scaled from, scaled size, vertical strip, horizontal strip)
+        self.seam_overlay = None
+
+        # The tiled view of the image is kept between frames, so only the parts that change need to be redrawn.
+        self.view_surface = None
+        self.view_state = None # Everything that affects the whole view. The whole view is redrawn when this changes.
+
+        # Rects (in image pixels) that were painted since the last render.
+        self.dirty_image_rects = []
+        # Rects (relative to the display) that changed in the last render. None if the whole canvas changed.
+        self.dirty_screen_rects = []
         self.open_filepath = None
+        # The image that is being opened or saved on a worker thread (an ImageTask), or None
+        self.image_task = None
         self.image_loaded = False
         self.image_unsaved = False # When True, an asterisk is added to the window caption ("Tile Art Helper" to "*Tile Art Helper")
 
         # True when the brush is being painted on the canvas.
         self.brush_down = False
 
+        # Mouse positions of the current stroke that have not been painted yet.
+        # They are in pixels of the view image (not wrapped around it), and get painted all at once on the next render.
+        self.stroke_points = []
+        # Last mouse position of the stroke that was painted up to, in the same coordinates as self.stroke_points
+        self.stroke_last_point = None
+        # Distance along the stroke since the last stamp, in pixels of the view image
+        self.stroke_distance = 0
+
+        # Pixel of the view image (not wrapped around it) where the line, rectangle, or ellipse being dragged out started, or None.
+        # The shape is only drawn over the view while it is dragged, and painted onto the image when the mouse is released.
+        self.shape_start = None
+        # Region of the shape (see modules.stamp.get_spans_region()), and a surface in the brush color for each of its pieces to draw over the view (as rects of the view image)
+        self.shape_region = None
+        self.shape_preview = []
+        # Rects (in pixels of the view image) where the shape preview changed since the last render. The view is redrawn there without the image having changed.
+        self.dirty_preview_rects = []
+
         # Have the canvas keep track of its own tiling setting. Updates on render() to detect when modules.settings.tiling_enabled changes.
         self.tiling_enabled = modules.settings.tiling_enabled
 
@@ -46,6 +116,7 @@ class Canvas:
     @size.setter
     def size(self, value):
         self.rect.size = value
+        self.invalidate_parent_hit_index()
 
     @property
     def width(self):
@@ -54,6 +125,7 @@ class Canvas:
     @width.setter
     def width(self, value):
         self.rect.width = value
+        self.invalidate_parent_hit_index()
 
     @property
     def height(self):
@@ -62,6 +134,7 @@ class Canvas:
     @height.setter
     def height(self, value):
         self.rect.height = value
+        self.invalidate_parent_hit_index()
         
     @property
     def local_x(self):
@@ -70,6 +143,8 @@ class Canvas:
     @local_x.setter
     def local_x(self, value):
         self.rect.x = value
+        self.invalidate_global_pos()
+        self.invalidate_parent_hit_index()
 
     @property
     def local_y(self):
@@ -78,16 +153,30 @@ class Canvas:
     @local_y.setter
     def local_y(self, value):
         self.rect.y = value
+        self.invalidate_global_pos()
+        self.invalidate_parent_hit_index()
+
+    def invalidate_global_pos(self):
+        # Forget the cached global position. Called when this element or one of its ancestors moves.
+        self.cached_global_pos = None
+
+    def invalidate_parent_hit_index(self):
+        # The parent panel finds the child under the mouse with an index of where its children are, which must be rebuilt when this element moves, resizes, or changes layer.
+        if self.parent is not None:
+            self.parent.invalidate_hit_index()
 
     def get_local_pos(self):
         return (self.local_x, self.local_y)
 
     def get_global_pos(self):
-        if self.parent is not None:
-            parent_pos = self.parent.get_global_pos() # Avoids redundant recursive calls
-            return (parent_pos[0] + self.local_x, parent_pos[1] + self.local_y)
-        else:
-            return (self.local_x, self.local_y)
+        # The global position is cached until this element or one of its ancestors moves.
+        if self.cached_global_pos is None:
+            if self.parent is not None:
+                parent_pos = self.parent.get_global_pos() # Avoids redundant recursive calls
+                self.cached_global_pos = (parent_pos[0] + self.local_x, parent_pos[1] + self.local_y)
+            else:
+                self.cached_global_pos = (self.local_x, self.local_y)
+        return self.cached_global_pos
 
     @property
     def global_x(self):
@@ -114,8 +203,8 @@ class Canvas:
         elif not self.brush_down and not self.get_global_bounding_rect().collidepoint(pygame.mouse.get_pos()):
             return ""
 
-        pos_x = int((mouse_pos[0] - self.scroll[0]) % (math.floor(self.loaded_image.get_width() * self.zoom)) / self.zoom)
-        pos_y = int((mouse_pos[1] - self.scroll[1]) % (math.floor(self.loaded_image.get_height() * self.zoom)) / self.zoom)
+        view_size = self.get_view_image().get_size()
+        pos_x, pos_y = self.get_image_pos(int((mouse_pos[0] - self.scroll[0]) % (math.floor(view_size[0] * self.zoom)) / self.zoom), int((mouse_pos[1] - self.scroll[1]) % (math.floor(view_size[1] * self.zoom)) / self.zoom))
         return f"Mouse position: ({pos_x}, {pos_y})"            
 
     def get_zoom_text(self):
@@ -139,24 +228,96 @@ class Canvas:
         # This will block all mouse clicks until the next time the root has mouse_over() updated (which happens every frame)
         root.mouse_over(False) 
         
+        if self.image_task is not None:
+            print("Wait for the current image to finish opening or saving.")
+            return
+
+        filepath = filedialog.askopenfilename(filetypes=[("Images and projects", "*.png *.bmp *.tga *.jpg *.jpeg *.gif *.webp *" + modules.layers.project_extension), ("All files", "*")])
+        # The dialog was cancelled
+        if not filepath:
+            return
+        # The file is read on a worker thread. The image is shown once update_image_task() sees that it is done.
+        if filepath.lower().endswith(modules.layers.project_extension):
+            self.image_task = modules.layers.start_open_project(filepath)
+        else:
+            self.image_task = modules.image_io.start_open(filepath)
+
+    def open_tileset_folder(self):
+        # Open every image of a folder as the tiles of a tileset
+
+        # Block mouse before opening filedialog
+        root = self
+        while root.parent is not None: # Find root parent
+            root = root.parent
+        # Tell the root parent (which will tell the whole hierarchy) that the mouse is not hovering over it
+        # This will block all mouse clicks until the next time the root has mouse_over() updated (which happens every frame)
+        root.mouse_over(False)
+
+        if self.image_task is not None:
+            print("Wait for the current image to finish opening or saving.")
+            return
+
+        folder = filedialog.askdirectory()
+        if folder:
+            self.image_task = modules.atlas.start_open_folder(folder)
+
+    def open_spritesheet(self):
+        # Open a spritesheet as the tiles of a tileset, split into a grid of tiles of the size that is asked for
+
+        # Block mouse before opening filedialog
+        root = self
+        while root.parent is not None: # Find root parent
+            root = root.parent
+        # Tell the root parent (which will tell the whole hierarchy) that the mouse is not hovering over it
+        # This will block all mouse clicks until the next time the root has mouse_over() updated (which happens every frame)
+        root.mouse_over(False)
+
+        if self.image_task is not None:
+            print("Wait for the current image to finish opening or saving.")
+            return
+
         filepath = filedialog.askopenfilename()
+        if not filepath:
+            return
+        tile_size_text = simpledialog.askstring("Tile size", "Size of the tiles (width x height):", initialvalue="32x32")
+        if tile_size_text is None:
+            return
         try:
-            self.loaded_image = pygame.image.load(filepath).convert_alpha()
-            self.open_filepath = filepath
-            self.image_loaded = True
-        except FileNotFoundError:
-            print("File not found.")
-        except pygame.error:
-            print("Error with file format.")
+            tile_size = modules.atlas.parse_tile_size(tile_size_text)
+        except ValueError:
+            print(f"Invalid tile size: {tile_size_text}")
+            return
+        self.image_task = modules.atlas.start_open_sheet(filepath, tile_size)
+
+    def start_save(self, filepath):
+        # Start saving the image to filepath on a worker thread.
+        # Images with layers (or that were saved with layers before) are flattened into filepath, and their layers are saved to the project file next to it.
+        if self.layers is None or (len(self.layers.layers) == 1 and self.layers.get_passthrough_layer() is not None and not os.path.exists(modules.layers.get_project_filepath(filepath))):
+            self.image_task = modules.image_io.start_save(self.loaded_image, filepath)
+        else:
+            self.image_task = modules.layers.start_save_project(self.layers, filepath)
 
     def save_image(self):
-        # Note that this function does not reload the image after saving, unlike the save as function. Maybe this should be changed in the future.
         if self.image_loaded:
-            pygame.image.save(self.loaded_image, self.open_filepath)
+            if self.image_task is not None:
+                print("Wait for the current image to finish opening or saving.")
+                return
+
+            # The image is saved on a worker thread and can keep being painted meanwhile. Painting marks it as unsaved again.
+            if self.atlas is not None:
+                # Tilesets save the whole spritesheet, or every changed tile of the folder
+                self.image_task = modules.atlas.start_save_atlas(self.atlas)
+            else:
+                self.start_save(self.open_filepath)
+            self.saved_change_count = self.get_change_count()
             self.image_unsaved = False
 
     def save_as(self):
         if self.image_loaded:
+            if self.image_task is not None:
+                print("Wait for the current image to finish opening or saving.")
+                return
+
             # Block mouse before opening filedialog
             root = self
             while root.parent is not None: # Find root parent
@@ -166,88 +327,525 @@ class Canvas:
             root.mouse_over(False) 
             
             filepath = filedialog.asksaveasfilename(filetypes=[("PNG", "*.png")], defaultextension='.png')
-            try:
-                pygame.image.save(self.loaded_image, filepath)
-                self.loaded_image = pygame.image.load(filepath).convert_alpha()
-                self.open_filepath = filepath
+            # The dialog was cancelled
+            if not filepath:
+                return
+            self.start_save(filepath)
+            self.saved_change_count = self.get_change_count()
+            # For a tileset, only the loaded tile is saved to the new file, so the tileset itself may still have unsaved changes
+            self.image_unsaved = self.atlas is not None and len(self.atlas.modified) > 0
+
+    def update_image_task(self):
+        # Runs every frame. When the image that is being opened or saved is done, use the result.
+        if self.image_task is None or not self.image_task.is_done():
+            return
+        task = self.image_task
+        self.image_task = None
+
+        if task.action == 'open':
+            if isinstance(task.error, FileNotFoundError):
+                print("File not found.")
+            elif task.error is not None or task.result is None:
+                print("Error with file format.")
+            elif task.filepath.lower().endswith(modules.layers.project_extension):
+                # Projects are saved as a flattened image next to the project file, which is what gets saved to
+                self.close_atlas()
+                self.close_journal()
+                self.layers = modules.layers.finish_open_project(task)
+                self.loaded_image = self.layers.get_active_surface()
+                self.open_filepath = modules.layers.get_image_filepath(task.filepath)
+                self.image_loaded = True
+                self.image_unsaved = False
+                self.history.clear()
+            else:
+                self.close_atlas()
+                # The journal of the previous image is kept if it has unsaved changes, so it must be closed before they are forgotten
+                self.close_journal()
+                self.layers = modules.layers.LayerStack(modules.image_io.finish_open(task))
+                self.loaded_image = self.layers.get_active_surface()
+                self.open_filepath = task.filepath
+                self.image_loaded = True
                 self.image_unsaved = False
-            except pygame.error:
+                self.history.clear()
+                self.open_journal()
+        elif task.action == 'open_tileset':
+            if task.error is not None or task.result is None:
+                print(f"Could not open the tileset: {task.error}")
+                return
+            try:
+                atlas = modules.atlas.finish_open_tileset(task)
+            except ValueError as error:
+                print(f"Could not open the tileset: {error}")
+                return
+            self.close_atlas()
+            self.close_journal()
+            self.atlas = atlas
+            self.open_filepath = task.filepath
+            self.image_unsaved = False
+            self.load_atlas_tile(0)
+        else:
+            if task.action == 'save_tileset' and self.atlas is not None and task.error is not None:
+                # The tiles that were being saved still need to be saved
+                self.atlas.modified.update(self.atlas.saving_tiles)
+            if isinstance(task.error, pygame.error):
                 print(f"Invalid file format. Try '.png'")
+            elif task.error is not None:
+                print(f"Could not save the image: {task.error}")
+            elif task.action == 'save' and self.atlas is None:
+                # Only a single image moves to the file it was saved to. A tileset keeps the folder or spritesheet it was opened from, even when one of its tiles is saved somewhere else.
+                self.open_filepath = task.filepath
+                # The saved file now holds the changes made before the save started, so the journal starts over from it
+                if self.journal is not None:
+                    self.journal.rebase(task.filepath, self.loaded_image.get_size(), self.saved_change_count)
+            if task.error is not None:
+                self.image_unsaved = True
+
+    def open_journal(self):
+        # Start a journal for the image that was just opened, recovering the changes of a session that did not save
+        self.close_journal()
+        if not modules.settings.journal_enabled:
+            return
+        self.journal = modules.journal.Journal(self.open_filepath)
+        try:
+            recovered_count = self.journal.open(self.loaded_image)
+        except OSError as error:
+            print(f"Could not open the journal: {error}")
+            self.journal = None
+            return
+        if recovered_count > 0:
+            print(f"Recovered {recovered_count} unsaved changes from {self.journal.filepath}")
+            self.image_unsaved = True
+
+    def close_journal(self):
+        # Stop journaling the loaded image. The journal is kept if there are unsaved changes, so they can be recovered later.
+        if self.journal is not None:
+            self.journal.close(self.image_unsaved)
+            self.journal = None
+
+    def get_change_count(self):
+        if self.journal is None:
+            return 0
+        return self.journal.change_count
+
+    def select_atlas_tile(self, index):
+        # Load a tile of the tileset into the canvas. A tile that is not decoded yet is loaded once it is.
+        if self.atlas is None or self.brush_down:
+            return
+        if self.atlas.failed[index]:
+            print(f"{self.atlas.names[index]} could not be opened.")
+        elif self.atlas.loaded[index]:
+            self.atlas_selection = None
+            self.load_atlas_tile(index)
+        else:
+            self.atlas_selection = index
+            self.atlas.request_tile(index)
+
+    def load_atlas_tile(self, index):
+        # The canvas paints straight into the tile's part of the atlas, so nothing is copied or decoded
+        self.atlas_index = index
+        self.layers = modules.layers.LayerStack(self.atlas.get_tile_surface(index))
+        self.loaded_image = self.layers.get_active_surface()
+        self.image_loaded = True
+        # Strokes can only be undone on the tile they were painted on
+        self.history.clear()
+
+    def update_atlas(self):
+        # Runs every frame. Put the tiles that finished decoding into the atlas, and load the selected tile once it is decoded.
+        if self.atlas is None:
+            return
+        loaded_tiles = self.atlas.update()
+        if self.atlas_selection in loaded_tiles and not self.brush_down:
+            self.load_atlas_tile(self.atlas_selection)
+            self.atlas_selection = None
+        elif self.atlas_selection is not None and self.atlas.failed[self.atlas_selection]:
+            self.atlas_selection = None
+
+    def close_atlas(self):
+        if self.atlas is not None:
+            self.atlas.close()
+            self.atlas = None
+            self.atlas_index = None
+            self.atlas_selection = None
+
+    def get_atlas_text(self):
+        # Used by a text object to show which tile of the tileset is loaded
+        if self.atlas is None:
+            return "No tileset open"
+        return f"Tile {self.atlas_index + 1}/{self.atlas.tile_count}: {self.atlas.names[self.atlas_index]}"
+
+    def get_flattened_image(self):
+        # The layers flattened together, or the loaded image if it has no layers
+        if self.layers is None:
+            return self.loaded_image
+        return self.layers.get_composite()
+
+    def get_tiling_pattern(self):
+        # Chunked images are too big for a super-tile, so they only repeat in a grid
+        if not modules.settings.tiling_enabled or isinstance(self.get_flattened_image(), modules.chunked_image.ChunkedImage):
+            return 'grid'
+        return modules.settings.tiling_pattern
+
+    def get_view_image(self):
+        # The image that is shown: the flattened image, or its super-tile if it repeats in a pattern other than a grid
+        return self.super_tile.get_image(self.get_flattened_image(), self.get_tiling_pattern())
+
+    def get_image_pos(self, view_x, view_y):
+        # Pixel of the loaded image that a pixel of the view image shows
+        self.get_view_image()
+        image_x, image_y = self.super_tile.to_source(view_x, view_y)
+        return (int(image_x), int(image_y))
+
+    def get_image_task_text(self):
+        # Used by a text object to show that an image is being opened or saved
+        if self.image_task is None:
+            return ""
+        return self.image_task.get_status_text()
+
+    def get_scaled_image_size(self):
+        # Size of the view image after it is scaled by the zoom.
+        view_image = self.get_view_image()
+        return (max(1, math.floor(view_image.get_width() * self.zoom)), max(1, math.floor(view_image.get_height() * self.zoom)))
+
+    def get_tile_positions(self, scaled_size):
+        # Returns the positions (relative to the canvas) of every copy of the scaled image that is drawn onto the canvas.
+        if modules.settings.tiling_enabled:
+            positions = []
+            for y in range(math.ceil(self.height / scaled_size[1]) + 1):
+                for x in range(math.ceil(self.width / scaled_size[0]) + 1):
+                    positions.append((x * scaled_size[0] + self.scroll[0], y * scaled_size[1] + self.scroll[1]))
+            return positions
+        else:
+            return [(scaled_size[0] + self.scroll[0], scaled_size[1] + self.scroll[1])]
+
+    def draw_visible_region(self, view_surface, region, scaled_size):
+        # Draw the part of the tiled image that falls within region (a rect relative to the canvas) onto view_surface.
+        # Only the source pixels that are actually visible get scaled, so the cost depends on the size of the region instead of the zoomed image size.
+        for tile_pos in self.get_tile_positions(scaled_size):
+            visible_rect = pygame.Rect(tile_pos, scaled_size).clip(region)
+            if visible_rect.width == 0 or visible_rect.height == 0:
+                continue
+
+            # Scale only the visible source pixels and draw them, cutting off the partially visible source pixels that stick out of the region
+            with modules.profiler.measure('scale'):
+                scaled_part, scaled_pos = scale_region(self.get_view_image(), scaled_size, visible_rect.move(-tile_pos[0], -tile_pos[1]))
+            with modules.profiler.measure('tile_blits'):
+                view_surface.set_clip(visible_rect)
+                view_surface.blit(scaled_part, (tile_pos[0] + scaled_pos[0], tile_pos[1] + scaled_pos[1]))
+                view_surface.set_clip(None)
+
+    def draw_view_region(self, region, scaled_size, scaled_image):
+        # Redraw region (a rect relative to the canvas) of the view surface.
+        with modules.profiler.measure('tile_blits'):
+            self.view_surface.fill((0, 0, 0), region)
+        view_image = self.get_view_image()
+        if isinstance(view_image, modules.chunked_image.ChunkedImage):
+            # The image is split into chunks, which keep their own scaled renditions
+            with modules.profiler.measure('tile_blits'):
+                for tile_pos in self.get_tile_positions(scaled_size):
+                    view_image.draw_scaled(self.view_surface, region, tile_pos, scaled_size)
+        elif scaled_image is not None:
+            # The scaled image fits in the cache, so just draw the copies of it that overlap the region.
+            with modules.profiler.measure('tile_blits'):
+                self.view_surface.set_clip(region)
+                for tile_pos in self.get_tile_positions(scaled_size):
+                    if region.colliderect((tile_pos, scaled_size)):
+                        self.view_surface.blit(scaled_image, tile_pos)
+                self.view_surface.set_clip(None)
+        else:
+            # The scaled image is too big to keep around (zoomed far in), so only scale the source pixels that can be seen.
+            self.draw_visible_region(self.view_surface, region, scaled_size)
+        if self.shape_preview:
+            self.draw_shape_preview(region, scaled_size)
+
+    def draw_shape_preview(self, region, scaled_size):
+        # Draw the shape that is being dragged out over region (a rect relative to the canvas) of the view surface, in every copy of the image
+        image_size = self.get_view_image().get_size()
+        with modules.profiler.measure('tile_blits'):
+            for tile_pos in self.get_tile_positions(scaled_size):
+                tile_region = region.move(-tile_pos[0], -tile_pos[1]).clip(pygame.Rect((0, 0), scaled_size))
+                if tile_region.width == 0 or tile_region.height == 0:
+                    continue
+                for rect, preview in self.shape_preview:
+                    visible_rect = get_scaled_rect(rect, image_size, scaled_size).clip(tile_region)
+                    if visible_rect.width == 0 or visible_rect.height == 0:
+                        continue
+                    scaled_part, scaled_pos = scale_piece_region(preview, rect, image_size, scaled_size, visible_rect)
+                    self.view_surface.set_clip(visible_rect.move(tile_pos))
+                    self.view_surface.blit(scaled_part, (tile_pos[0] + scaled_pos[0], tile_pos[1] + scaled_pos[1]))
+                    self.view_surface.set_clip(None)
+
+    def mark_image_dirty(self, rect):
+        # Record a rect (in image pixels, may stick out of the image) that was painted, so it gets redrawn on the next render.
+        for piece, offset in modules.utils.split_wrapped_rect(pygame.Rect(rect), self.loaded_image.get_size()):
+            self.dirty_image_rects.append(piece)
+        if self.atlas is not None:
+            self.atlas.mark_modified(self.atlas_index)
+
+    def get_dirty_screen_rects(self):
+        # Returns the rects of the display that the canvas changed in the last render, or None if the whole canvas changed.
+        return self.dirty_screen_rects
 
     def render(self, surface):
         # Render and tile the loaded image onto the passed surface.
+        self.update_image_task()
+        self.update_atlas()
+        if self.journal is not None:
+            self.journal.update()
         if self.image_loaded:
-            # Create a surface to render and tile the loaded image within a fixed region.
-            temporary_surface = pygame.Surface(self.size)
-            
-            # Scale the loaded image to be rendered
-            # This gets laggy when zoomed in due to large image sizes. This should be fixed in future versions.
-            scaled_image = pygame.transform.scale(self.loaded_image, (self.loaded_image.get_width() * self.zoom, self.loaded_image.get_height() * self.zoom))
+            # Paint the mouse movements that were collected since the last frame
+            with modules.profiler.measure('paint'):
+                self.paint_stroke()
+
+            scaled_size = self.get_scaled_image_size()
 
             # Center the image when tiling is disabled
             if self.tiling_enabled and not modules.settings.tiling_enabled:
-                self.scroll[0] += scaled_image.get_width() * (math.ceil(surface.get_width() / scaled_image.get_width()) // 2 - 1)
-                self.scroll[1] += scaled_image.get_height() * (math.ceil(surface.get_height() / scaled_image.get_height()) // 2 - 1)
+                self.scroll[0] += scaled_size[0] * (math.ceil(surface.get_width() / scaled_size[0]) // 2 - 1)
+                self.scroll[1] += scaled_size[1] * (math.ceil(surface.get_height() / scaled_size[1]) // 2 - 1)
             
             # Update self.tiling_enabled
             self.tiling_enabled = modules.settings.tiling_enabled
 
             if modules.settings.tiling_enabled:
                 # Apply the modulo function to the scroll to make the tiled image rendering appear continuous.
-                self.scroll[0] %= -scaled_image.get_width()
-                self.scroll[1] %= -scaled_image.get_height()
-                
-                # Tile and draw the image onto the temporary surface.
-                for y in range(math.ceil(surface.get_height() / scaled_image.get_height()) + 1):
-                    for x in range(math.ceil(surface.get_width() / scaled_image.get_width()) + 1):
-                        temporary_surface.blit(scaled_image, (x * scaled_image.get_width() + self.scroll[0], y * scaled_image.get_height() + self.scroll[1]))
+                self.scroll[0] %= -scaled_size[0]
+                self.scroll[1] %= -scaled_size[1]
+
+            # Bring the flattened layers and the cached scaled copies of the image up to date with what was painted
+            with modules.profiler.measure('scale'):
+                dirty_image_rects = modules.utils.merge_rects(self.dirty_image_rects)
+                self.dirty_image_rects = []
+                dirty_preview_rects = modules.utils.merge_rects(self.dirty_preview_rects)
+                self.dirty_preview_rects = []
+                # Flatten the layers again where they were painted or changed
+                if self.layers is not None:
+                    self.layers.update_composite(dirty_image_rects)
+                view_image = self.get_view_image()
+                # Copy what was painted to every copy of the image in the super-tile
+                dirty_view_rects = self.super_tile.update(dirty_image_rects)
+                if self.seam_analyzer_enabled:
+                    self.seam_analyzer.update(view_image, dirty_view_rects)
+                if isinstance(view_image, modules.chunked_image.ChunkedImage):
+                    # Chunked images keep a scaled rendition of each chunk instead of the whole image
+                    self.scaled_image_cache.set_image(None)
+                    for rect in dirty_view_rects:
+                        view_image.mark_dirty(rect)
+                    scaled_image = None
+                else:
+                    if dirty_view_rects:
+                        self.scaled_image_cache.patch(view_image, dirty_view_rects)
+                    scaled_image = self.scaled_image_cache.get(view_image, self.zoom, scaled_size)
+
+            view_rect = pygame.Rect((0, 0), self.size)
+            view_state = (view_image, self.zoom, tuple(self.scroll), self.size, self.tiling_enabled)
+            if view_state != self.view_state:
+                # Something that affects the whole view changed (zoom, scroll, size, etc.), so redraw all of it.
+                self.view_state = view_state
+                self.view_surface = pygame.Surface(self.size)
+                modules.profiler.count('surfaces')
+                self.draw_view_region(view_rect, scaled_size, scaled_image)
+                self.dirty_screen_rects = None
             else:
-                # Render the image without tiling it
-                temporary_surface.blit(scaled_image, (scaled_image.get_width() + self.scroll[0], scaled_image.get_height() + self.scroll[1]))
+                # Only redraw the painted parts of the view (and where the shape preview changed), in every copy of the image that can be seen.
+                view_rects = []
+                for rect in dirty_view_rects + dirty_preview_rects:
+                    scaled_rect = get_scaled_rect(rect, view_image.get_size(), scaled_size)
+                    for tile_pos in self.get_tile_positions(scaled_size):
+                        visible_rect = scaled_rect.move(tile_pos).clip(view_rect)
+                        if visible_rect.width > 0 and visible_rect.height > 0:
+                            view_rects.append(visible_rect)
+                    if len(view_rects) > 64:
+                        break
+
+                if len(view_rects) > 64 or sum(rect.width * rect.height for rect in view_rects) > view_rect.width * view_rect.height // 2:
+                    # The painted area shows up in so many places that redrawing everything is cheaper
+                    self.draw_view_region(view_rect, scaled_size, scaled_image)
+                    self.dirty_screen_rects = None
+                else:
+                    for rect in view_rects:
+                        self.draw_view_region(rect, scaled_size, scaled_image)
+                    global_pos = self.get_global_pos()
+                    self.dirty_screen_rects = [rect.move(global_pos) for rect in view_rects]
+
+            # Render the view surface onto the passed surface.
+            with modules.profiler.measure('final_blit'):
+                surface.blit(self.view_surface, self.get_global_pos())
+
+            if self.seam_analyzer_enabled:
+                self.draw_seam_overlay(surface, scaled_size)
+
+    def draw_seam_overlay(self, surface, scaled_size):
+        # Draw the heatmap of the seams along the edges of every copy of the image
+        heatmaps = self.seam_analyzer.get_heatmaps()
+        overlay_changed = self.seam_overlay is None or self.seam_overlay[0] is not heatmaps or self.seam_overlay[1] != scaled_size
+        if overlay_changed:
+            vertical_strip = pygame.transform.scale(heatmaps[0], (6, scaled_size[1]))
+            horizontal_strip = pygame.transform.scale(heatmaps[1], (scaled_size[0], 6))
+            modules.profiler.count('surfaces', 2)
+            self.seam_overlay = (heatmaps, scaled_size, vertical_strip, horizontal_strip)
+        vertical_strip, horizontal_strip = self.seam_overlay[2], self.seam_overlay[3]
 
-            # Render the temporary surface onto the passed surface.
-            surface.blit(temporary_surface, self.get_global_pos())
+        global_pos = self.get_global_pos()
+        strip_rects = []
+        surface.set_clip(self.get_global_bounding_rect())
+        for tile_pos in self.get_tile_positions(scaled_size):
+            tile_x = global_pos[0] + tile_pos[0]
+            tile_y = global_pos[1] + tile_pos[1]
+            # The seams are where the left edge meets the right edge and the top edge meets the bottom edge
+            for seam_x in (tile_x, tile_x + scaled_size[0]):
+                strip_rects.append(surface.blit(vertical_strip, (seam_x - 3, tile_y)))
+            for seam_y in (tile_y, tile_y + scaled_size[1]):
+                strip_rects.append(surface.blit(horizontal_strip, (tile_x, seam_y - 3)))
+        surface.set_clip(None)
+
+        # The display only gets updated where things changed, so include the overlay when it changed
+        if overlay_changed and self.dirty_screen_rects is not None:
+            self.dirty_screen_rects = self.dirty_screen_rects + [rect for rect in strip_rects if rect.width > 0 and rect.height > 0]
+
+    def toggle_seam_analyzer(self):
+        self.seam_analyzer_enabled = not self.seam_analyzer_enabled
+        # Measure the whole image again when turned back on, and redraw the whole view to add or remove the overlay
+        self.seam_analyzer = SeamAnalyzer()
+        self.seam_overlay = None
+        self.view_state = None
+
+    def get_seam_score_text(self):
+        # Used by a text object to show the seam score
+        if not self.seam_analyzer_enabled or not self.image_loaded:
+            return ""
+        return self.seam_analyzer.get_score_text()
+
+    def paint_at(self, center_pos):
+        # Paint a single spot of the brush centered at center_pos (in image pixels)
+        modules.profiler.count('stamps')
+        if self.brush.shape == 'pixel':
+            self.history.capture(self.loaded_image, (center_pos[0], center_pos[1], 1, 1))
+            self.loaded_image.set_at(center_pos, self.brush.color)
+            self.mark_image_dirty((center_pos[0], center_pos[1], 1, 1))
+        elif self.brush.shape == 'brush':
+            coverage, opacity = self.brush.get_masks()
+            self.history.capture(self.loaded_image, (center_pos[0] - coverage.shape[0] // 2, center_pos[1] - coverage.shape[1] // 2, coverage.shape[0], coverage.shape[1]))
+            for rect in modules.stamp.blend_stamp(self.loaded_image, center_pos, self.brush.color, coverage, opacity):
+                self.mark_image_dirty(rect)
+        elif self.brush.shape == 'circle':
+            coverage, opacity = self.brush.get_masks()
+            self.history.capture(self.loaded_image, (center_pos[0] - coverage.shape[0] // 2, center_pos[1] - coverage.shape[1] // 2, coverage.shape[0], coverage.shape[1]))
+            for rect in modules.stamp.fill_stamp(self.loaded_image, center_pos, self.brush.color, coverage):
+                self.mark_image_dirty(rect)
+        elif self.brush.shape == 'bucket':
+            region = modules.flood_fill.find_region(self.loaded_image, center_pos, self.brush.tolerance)
+            for rect, mask in region:
+                self.history.capture(self.loaded_image, rect)
+            for rect in modules.stamp.fill_region(self.loaded_image, region, self.brush.color):
+                self.mark_image_dirty(rect)
+
+    def set_shape_preview(self, end):
+        # Show the shape dragged out from self.shape_start to end (in pixels of the view image, not wrapped around it) over the view, without painting it
+        self.clear_shape_preview()
+        coverage, opacity = self.brush.get_masks()
+        # Both ends go through the copy of the image that the shape started in, so the shape is painted where it is seen
+        self.get_view_image()
+        start_x, start_y = self.super_tile.to_source(self.shape_start[0], self.shape_start[1], self.shape_start)
+        end_x, end_y = self.super_tile.to_source(end[0], end[1], self.shape_start)
+        self.shape_region = modules.shapes.get_shape_region(self.brush.shape, (int(start_x), int(start_y)), (int(end_x), int(end_y)), coverage, self.loaded_image.get_size())
+        image_preview = []
+        for rect, mask in self.shape_region:
+            preview = pygame.Surface(rect.size, pygame.SRCALPHA)
+            preview.fill(self.brush.color)
+            preview_alpha = pygame.surfarray.pixels_alpha(preview)
+            preview_alpha[~mask] = 0
+            del preview_alpha # Unlock the surface
+            image_preview.append((rect, preview))
+        # The preview is drawn in every copy of the image in the super-tile
+        self.shape_preview = self.super_tile.map_pieces(image_preview)
+        for rect, preview in self.shape_preview:
+            self.dirty_preview_rects.append(rect)
+        modules.profiler.count('surfaces', len(self.shape_preview))
+
+    def clear_shape_preview(self):
+        for rect, preview in self.shape_preview:
+            self.dirty_preview_rects.append(rect)
+        self.shape_preview = []
+        self.shape_region = None
+
+    def paint_shape(self):
+        # Paint the shape that is being dragged out onto the image, and stop dragging it
+        region = self.shape_region
+        self.clear_shape_preview()
+        self.shape_start = None
+        for rect, mask in region:
+            self.history.capture(self.loaded_image, rect)
+        changed_rects = modules.stamp.fill_region(self.loaded_image, region, self.brush.color)
+        # Redraw the whole shape as a single dirty rect
+        self.mark_image_dirty(changed_rects[0].unionall(changed_rects[1:]))
 
     def mouse_over(self, hovered):
         # Runs every frame. Set self.is_hovered.
         # hovered is True only if the mouse is over this canvas and is not being blocked by a UI element on a higher layer.        
         self.is_hovered = hovered
 
-    def mouse_moved(self, mouse_rel):
-        # Mouse position relative to the top left corner of the canvas
-        mouse_pos = (pygame.mouse.get_pos()[0] - self.global_x, pygame.mouse.get_pos()[1] - self.global_y)
-        mouse_move_distance = math.hypot(*mouse_rel)
+    def get_stamp_spacing(self):
+        # Distance (in image pixels) between the stamps painted along a stroke.
+        # Bigger brushes overlap enough with fewer stamps. The pixel brush must not skip pixels.
+        if self.brush.shape == 'pixel':
+            return 1
+        return max(1, self.brush.size / 4)
 
-        # Spacing between each painted spot along the line that was painted
-        spacing = self.zoom # Scalar
-        space = (mouse_rel[0] / mouse_move_distance * spacing, mouse_rel[1] / mouse_move_distance * spacing) # Vector with magnitude of spacing in the direction of mouse_rel
+    def paint_stroke(self):
+        # Paint all of the stroke that was collected since the last frame at once, as a single line through the mouse positions.
+        if not self.stroke_points:
+            return
+        if self.shape_start is not None:
+            # A shape is being dragged out, so only its preview follows the mouse
+            self.stroke_last_point = self.stroke_points[-1]
+            self.stroke_points = []
+            self.set_shape_preview((math.floor(self.stroke_last_point[0]), math.floor(self.stroke_last_point[1])))
+            return
+        if self.brush.shape == 'bucket':
+            # The bucket only fills where it was clicked, not along the drag
+            self.stroke_points = []
+            return
+        stroke_points = numpy.array([self.stroke_last_point] + self.stroke_points, dtype=numpy.float64)
+        self.stroke_last_point = self.stroke_points[-1]
+        self.stroke_points = []
 
-        # If an image is loaded and the brush is down, paint between the current position and the previous position
+        # Distance along the line at each mouse position
+        segment_lengths = numpy.hypot(*numpy.diff(stroke_points, axis=0).T)
+        line_distances = numpy.concatenate(([0], numpy.cumsum(segment_lengths)))
+
+        # Place a stamp every spacing along the line, continuing from the last stamp of the previous frame
+        spacing = self.get_stamp_spacing()
+        stamp_distances = numpy.arange(spacing - self.stroke_distance, line_distances[-1], spacing)
+        if len(stamp_distances) > 0:
+            self.stroke_distance = line_distances[-1] - stamp_distances[-1]
+        else:
+            self.stroke_distance += line_distances[-1]
+            return
+
+        # Convert the stamp positions to pixels on the image, the same way as a mouse click
+        view_size = self.get_view_image().get_size()
+        stamp_x = numpy.interp(stamp_distances, line_distances, stroke_points[:, 0]) * self.zoom
+        stamp_y = numpy.interp(stamp_distances, line_distances, stroke_points[:, 1]) * self.zoom
+        center_pos_x, center_pos_y = self.super_tile.to_source((stamp_x % math.floor(view_size[0] * self.zoom) / self.zoom).astype(int), (stamp_y % math.floor(view_size[1] * self.zoom) / self.zoom).astype(int))
+
+        # Several stamps often land on the same pixel (especially when zoomed in), so only paint each position once, in stroke order.
+        centers = numpy.stack((center_pos_x, center_pos_y), axis=1)
+        first_indices = numpy.unique(centers, axis=0, return_index=True)[1]
+        for center_pos in centers[numpy.sort(first_indices)]:
+            self.paint_at((int(center_pos[0]), int(center_pos[1])))
+
+    def mouse_moved(self, mouse_rel):
+        # If an image is loaded and the brush is down, add the mouse movement to the stroke. It gets painted on the next render.
+        # The movement is added up from mouse_rel so that every mouse motion of the frame is followed, not just where the mouse ended up.
         if self.image_loaded and self.brush_down:
             # Brush was used, so the image has unsaved progress
             self.image_unsaved = True
-            
-            # Paint along the line the mouse moved
-            for i in range(max(1, int(mouse_move_distance / spacing))):
-                center_pos_x = int((mouse_pos[0] - i * space[0] - self.scroll[0]) % (math.floor(self.loaded_image.get_width() * self.zoom)) / self.zoom)
-                center_pos_y = int((mouse_pos[1] - i * space[1] - self.scroll[1]) % (math.floor(self.loaded_image.get_height() * self.zoom)) / self.zoom)
-                if self.brush.shape == 'pixel':
-                    self.loaded_image.set_at((center_pos_x, center_pos_y), self.brush.color)
-                elif self.brush.shape == 'brush':
-                    for dy in range(self.brush.size * 2 + 1):
-                        for dx in range(self.brush.size * 2 + 1):
-                            pos_x = (center_pos_x + dx - self.brush.size) % self.loaded_image.get_width()
-                            pos_y = (center_pos_y + dy - self.brush.size) % self.loaded_image.get_height()
-                            point_distance = math.dist(mouse_pos, (mouse_pos[0] + dx - self.brush.size, mouse_pos[1] + dy - self.brush.size))
-                            if point_distance <= self.brush.size:
-                                modules.utils.overlay_pixel(self.loaded_image, (pos_x, pos_y), (self.brush.color[0], self.brush.color[1], self.brush.color[2], self.brush.color[3] * (1 - point_distance / self.brush.size)))
-                elif self.brush.shape == 'circle':
-                    for dy in range(self.brush.size * 2 + 1):
-                        for dx in range(self.brush.size * 2 + 1):
-                            if math.dist(mouse_pos, (mouse_pos[0] + dx - self.brush.size, mouse_pos[1] + dy - self.brush.size)) <= self.brush.size:
-                                pos_x = (center_pos_x + dx - self.brush.size) % self.loaded_image.get_width()
-                                pos_y = (center_pos_y + dy - self.brush.size) % self.loaded_image.get_height()
-                                self.loaded_image.set_at((pos_x, pos_y), self.brush.color)
+
+            if self.stroke_points:
+                previous_point = self.stroke_points[-1]
+            else:
+                previous_point = self.stroke_last_point
+            self.stroke_points.append((previous_point[0] + mouse_rel[0] / self.zoom, previous_point[1] + mouse_rel[1] / self.zoom))
             
     def left_mouse_down(self):
         # If the canvas was clicked
@@ -256,6 +854,7 @@ class Canvas:
             if self.parent is not None:
                 self.parent.canvases.remove(self)
                 self.parent.canvases.append(self)
+                self.invalidate_parent_hit_index()
                 
             # The canvas was pressed, so the brush is down
             self.brush_down = True
@@ -263,33 +862,195 @@ class Canvas:
             # Mouse position relative to the top left corner of the canvas
             mouse_pos = (pygame.mouse.get_pos()[0] - self.global_x, pygame.mouse.get_pos()[1] - self.global_y)
 
+            # Start a new stroke from the mouse position
+            self.stroke_points = []
+            self.stroke_last_point = ((mouse_pos[0] - self.scroll[0]) / self.zoom, (mouse_pos[1] - self.scroll[1]) / self.zoom)
+            self.stroke_distance = 0
+
             # If an image is loaded, paint at the mouse position
             if self.image_loaded:
                 # Brush was used, so the image has unsaved progress
                 self.image_unsaved = True
 
-                # Calculate the pixel position on the canvas where the mouse is
-                center_pos_x = int((mouse_pos[0] - self.scroll[0]) % (math.floor(self.loaded_image.get_width() * self.zoom)) / self.zoom)
-                center_pos_y = int((mouse_pos[1] - self.scroll[1]) % (math.floor(self.loaded_image.get_height() * self.zoom)) / self.zoom)
-                # Paint
-                if self.brush.shape == 'pixel':
-                    self.loaded_image.set_at((center_pos_x, center_pos_y), self.brush.color)
-                elif self.brush.shape == 'brush':
-                    for dy in range(self.brush.size * 2 + 1):
-                        for dx in range(self.brush.size * 2 + 1):
-                            pos_x = (center_pos_x + dx - self.brush.size) % self.loaded_image.get_width()
-                            pos_y = (center_pos_y + dy - self.brush.size) % self.loaded_image.get_height()
-                            point_distance = math.dist(mouse_pos, (mouse_pos[0] + dx - self.brush.size, mouse_pos[1] + dy - self.brush.size))
-                            if point_distance <= self.brush.size:
-                                modules.utils.overlay_pixel(self.loaded_image, (pos_x, pos_y), (self.brush.color[0], self.brush.color[1], self.brush.color[2], self.brush.color[3] * (1 - point_distance / self.brush.size)))
-                elif self.brush.shape == 'circle':
-                    for dy in range(self.brush.size * 2 + 1):
-                        for dx in range(self.brush.size * 2 + 1):
-                            if math.dist(mouse_pos, (mouse_pos[0] + dx - self.brush.size, mouse_pos[1] + dy - self.brush.size)) <= self.brush.size:
-                                pos_x = (center_pos_x + dx - self.brush.size) % self.loaded_image.get_width()
-                                pos_y = (center_pos_y + dy - self.brush.size) % self.loaded_image.get_height()
-                                self.loaded_image.set_at((pos_x, pos_y), self.brush.color)
+                # Record the tiles that the stroke paints over, so it can be undone
+                self.history.begin_stroke()
+
+                if self.brush.shape in modules.shapes.shape_names:
+                    # Start dragging out a shape from the mouse position. It is painted when the mouse is released.
+                    self.shape_start = (math.floor(self.stroke_last_point[0]), math.floor(self.stroke_last_point[1]))
+                    self.set_shape_preview(self.shape_start)
+                else:
+                    # Calculate the pixel position on the image where the mouse is
+                    view_size = self.get_view_image().get_size()
+                    center_pos = self.get_image_pos(int((mouse_pos[0] - self.scroll[0]) % (math.floor(view_size[0] * self.zoom)) / self.zoom), int((mouse_pos[1] - self.scroll[1]) % (math.floor(view_size[1] * self.zoom)) / self.zoom))
+                    # Paint (timed as part of 'events', see modules/profiler.py)
+                    self.paint_at(center_pos)
 
     def left_mouse_up(self):
+        # Paint what is left of the stroke before the brush is lifted
+        if self.image_loaded and self.brush_down:
+            self.paint_stroke()
+            if self.shape_start is not None:
+                self.paint_shape()
+            patches = self.history.end_stroke(self.loaded_image)
+            if self.journal is not None:
+                self.journal.add('stroke', {'shape': self.brush.shape, 'size': self.brush.size, 'hardness': self.brush.hardness, 'color': list(self.brush.color)}, patches)
+
         # The mouse was released, so the brush is not down
         self.brush_down = False
+
+    def apply_image_operation(self, name, operation, changed_rects=None):
+        # Apply an operation on the whole image (a function that takes and changes a surface, see modules/image_ops.py) as one change that can be undone.
+        # changed_rects are the rects of the image that the operation changes, or None if it may change all of it.
+        if not self.image_loaded or self.brush_down:
+            return
+        if changed_rects is None:
+            changed_rects = [pygame.Rect((0, 0), self.loaded_image.get_size())]
+
+        self.history.begin_stroke()
+        for rect in changed_rects:
+            self.history.capture(self.loaded_image, rect)
+
+        if isinstance(self.loaded_image, modules.chunked_image.ChunkedImage):
+            # The operations work on a single surface, so the chunks are put together for it
+            surface = self.loaded_image.to_surface()
+            operation(surface)
+            self.loaded_image.copy_from(surface)
+        else:
+            operation(self.loaded_image)
+
+        patches = self.history.end_stroke(self.loaded_image)
+        if self.journal is not None:
+            self.journal.add(name, {}, patches)
+        for rect in changed_rects:
+            self.mark_image_dirty(rect)
+        self.image_unsaved = True
+
+    def offset_image(self, offset_x, offset_y):
+        # Move the image by (offset_x, offset_y) pixels, wrapping around the edges
+        self.apply_image_operation('offset', lambda image: modules.image_ops.offset(image, offset_x, offset_y))
+
+    def offset_image_half(self):
+        # Move the image by half its size, which brings its seams to the middle where they can be seen and painted over
+        if self.image_loaded:
+            self.offset_image(self.loaded_image.get_width() // 2, self.loaded_image.get_height() // 2)
+
+    def blend_seams(self):
+        # Cross-fade the edges of the image into each other so it tiles without visible seams
+        if self.image_loaded:
+            width = modules.settings.seam_blend_width
+            self.apply_image_operation('seam_blend', lambda image: modules.image_ops.seam_blend(image, width), modules.image_ops.get_seam_rects(self.loaded_image, width))
+
+    def undo(self):
+        # Undo the most recent stroke, on whichever layer it was painted. Nothing happens while a stroke is being painted.
+        if self.image_loaded and not self.brush_down:
+            image, patches = self.history.undo()
+            for rect, data in patches:
+                self.mark_image_dirty(rect)
+            if patches:
+                self.image_unsaved = True
+                if self.journal is not None:
+                    self.journal.add('undo', {}, patches)
+
+    def redo(self):
+        # Paint the most recently undone stroke again
+        if self.image_loaded and not self.brush_down:
+            image, patches = self.history.redo()
+            for rect, data in patches:
+                self.mark_image_dirty(rect)
+            if patches:
+                self.image_unsaved = True
+                if self.journal is not None:
+                    self.journal.add('redo', {}, patches)
+
+    def can_change_layers(self):
+        # Layers can not be changed while a stroke is being painted. Tiles of a tileset are painted straight into the atlas, so they have no layers.
+        return self.image_loaded and self.layers is not None and not self.brush_down and self.atlas is None
+
+    def layers_changed(self):
+        # Called after the layers or their settings change. Everything is flattened and drawn again.
+        self.loaded_image = self.layers.get_active_surface()
+        self.mark_image_dirty(self.loaded_image.get_rect())
+        self.image_unsaved = True
+
+    def select_layer_below(self):
+        if self.can_change_layers():
+            self.layers.select_layer(self.layers.active_index - 1)
+            self.loaded_image = self.layers.get_active_surface()
+
+    def select_layer_above(self):
+        if self.can_change_layers():
+            self.layers.select_layer(self.layers.active_index + 1)
+            self.loaded_image = self.layers.get_active_surface()
+
+    def add_layer(self):
+        if self.atlas is not None:
+            print("Layers are not available for the tiles of a tileset.")
+        elif self.can_change_layers():
+            if not self.layers.supports_layers():
+                print("Layers are not available for images this large.")
+                return
+            # The journal replays changes onto the image file, which only works for images with a single layer. Layered images are saved as projects instead.
+            self.close_journal()
+            self.layers.add_layer()
+            self.layers_changed()
+
+    def remove_layer(self):
+        if self.can_change_layers() and len(self.layers.layers) > 1:
+            self.history.forget_image(self.layers.get_active_surface())
+            self.layers.remove_active_layer()
+            self.layers_changed()
+
+    def lower_layer(self):
+        if self.can_change_layers():
+            self.layers.move_active_layer(-1)
+            self.layers_changed()
+
+    def raise_layer(self):
+        if self.can_change_layers():
+            self.layers.move_active_layer(1)
+            self.layers_changed()
+
+    def toggle_layer_visibility(self):
+        if self.can_change_layers() and self.layers.supports_layers():
+            layer = self.layers.get_active_layer()
+            layer.visible = not layer.visible
+            self.layers_changed()
+
+    def increase_layer_opacity(self):
+        if self.can_change_layers() and self.layers.supports_layers():
+            layer = self.layers.get_active_layer()
+            layer.opacity = min(1, round(layer.opacity + 0.1, 2))
+            self.layers_changed()
+
+    def decrease_layer_opacity(self):
+        if self.can_change_layers() and self.layers.supports_layers():
+            layer = self.layers.get_active_layer()
+            layer.opacity = max(0, round(layer.opacity - 0.1, 2))
+            self.layers_changed()
+
+    def cycle_blend_mode(self):
+        if self.can_change_layers() and self.layers.supports_layers():
+            layer = self.layers.get_active_layer()
+            layer.blend_mode = modules.layers.blend_modes[(modules.layers.blend_modes.index(layer.blend_mode) + 1) % len(modules.layers.blend_modes)]
+            self.layers_changed()
+
+    def get_layer_text(self):
+        # Used by text objects to show the active layer
+        if self.layers is None:
+            return "No image loaded"
+        layer = self.layers.get_active_layer()
+        text = f"{self.layers.active_index + 1}/{len(self.layers.layers)}: {layer.name}"
+        if not layer.visible:
+            text += " (hidden)"
+        return text
+
+    def get_layer_opacity_text(self):
+        if self.layers is None:
+            return ""
+        return f"Opacity: {round(self.layers.get_active_layer().opacity * 100)}%"
+
+    def get_blend_mode_text(self):
+        if self.layers is None:
+            return ""
+        return f"Blend: {self.layers.get_active_layer().blend_mode}"
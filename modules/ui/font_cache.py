@@ -0,0 +1,35 @@
+## Author: Alexander Art
+
+from collections import OrderedDict
+
+import pygame
+
+import modules.profiler
+
+# Fonts keyed by size. Creating a font reads and parses the font file, so each size is only created once.
+fonts = {}
+
+# Rendered text surfaces keyed by (text, size, color, antialias), ordered from least to most recently used.
+rendered_text = OrderedDict()
+rendered_text_limit = 256
+
+def get_font(size):
+    if size not in fonts:
+        fonts[size] = pygame.font.Font(None, size)
+    return fonts[size]
+
+def render_text(text, size, color, antialias=True):
+    # Returns the text rendered with the default font. The text is only rendered again if it was not rendered recently.
+    key = (text, size, tuple(color), antialias)
+    if key in rendered_text:
+        # Mark the surface as the most recently used
+        rendered_text.move_to_end(key)
+        return rendered_text[key]
+
+    # Forget the least recently used surface if the cache is full
+    if len(rendered_text) >= rendered_text_limit:
+        rendered_text.popitem(last=False)
+
+    rendered_text[key] = get_font(size).render(text, antialias, color)
+    modules.profiler.count('surfaces')
+    return rendered_text[key]
@@ -2,6 +2,8 @@
 
 import pygame
 
+import modules.profiler
+import modules.ui.font_cache
 from modules.ui.ui_style import Style
 from modules.ui.button import Button
 
@@ -11,6 +13,9 @@ class Panel:
         # This panel's parent object. This gets set with parent.add_panel(self).
         # If the parent is a pygame surface instead of a panel, self.parent should remain None and rendering/input functions must be called explicitly.
         self.parent = None
+
+        # Global position, cached by get_global_pos()
+        self.cached_global_pos = None
         
         # Create rect object from rect argument.
         # Rect left (x) and top (y) values become the local x and y values for the panel.
@@ -36,6 +41,18 @@ class Panel:
         # If the panel is movable, this keeps track of when it is being moved.
         self.title_bar_held = False
 
+        # Panels without canvases keep an image of themselves and their children, which is only redrawn when something in it changes.
+        self.cached_surface = None
+        self.needs_redraw = True
+        # True if the cached image was redrawn during the last render
+        self.was_redrawn = False
+
+        # Index of which children are in which cells of a grid over the panel, used to find the child under the mouse.
+        # Built by get_hit_index() and rebuilt after children are added, removed, moved, resized, or change layer.
+        self.hit_index = None
+        # The child that the mouse was hovering over as of the last mouse_over()
+        self.hovered_child = None
+
         # Panels, canvases, buttons, and text may be added as child objects.
         self.panels = []
         self.canvases = [] # Needing several canvases is rare.
@@ -59,6 +76,8 @@ class Panel:
     @size.setter
     def size(self, value):
         self.rect.size = value
+        self.invalidate_parent_hit_index()
+        self.request_redraw()
 
     @property
     def width(self):
@@ -67,6 +86,8 @@ class Panel:
     @width.setter
     def width(self, value):
         self.rect.width = value
+        self.invalidate_parent_hit_index()
+        self.request_redraw()
 
     @property
     def height(self):
@@ -75,6 +96,8 @@ class Panel:
     @height.setter
     def height(self, value):
         self.rect.height = value
+        self.invalidate_parent_hit_index()
+        self.request_redraw()
         
     @property
     def local_x(self):
@@ -83,6 +106,11 @@ class Panel:
     @local_x.setter
     def local_x(self, value):
         self.rect.x = value
+        self.invalidate_global_pos()
+        self.invalidate_parent_hit_index()
+        # Moving a panel does not change its own image, but the parent has to draw it somewhere else
+        if self.parent is not None:
+            self.parent.request_redraw()
 
     @property
     def local_y(self):
@@ -91,16 +119,52 @@ class Panel:
     @local_y.setter
     def local_y(self, value):
         self.rect.y = value
+        self.invalidate_global_pos()
+        self.invalidate_parent_hit_index()
+        if self.parent is not None:
+            self.parent.request_redraw()
+
+    def request_redraw(self):
+        # Called when something drawn by this panel changes. The parent panel includes this panel in its own image, so it gets redrawn too.
+        self.needs_redraw = True
+        if self.parent is not None:
+            self.parent.request_redraw()
+
+    def is_retained(self):
+        # Canvases change nearly every frame, so panels that contain canvases are drawn from scratch every frame instead of keeping an image.
+        if self.canvases:
+            return False
+        for panel in self.panels:
+            if not panel.is_retained():
+                return False
+        return True
+
+    def invalidate_global_pos(self):
+        # Forget the cached global positions of this panel and all its descendants. Called when this panel or one of its ancestors moves.
+        self.cached_global_pos = None
+        for child in self.panels + self.canvases + self.buttons + self.sliders + self.text:
+            child.invalidate_global_pos()
+
+    def invalidate_hit_index(self):
+        self.hit_index = None
+
+    def invalidate_parent_hit_index(self):
+        # The parent panel finds the child under the mouse with an index of where its children are, which must be rebuilt when this element moves, resizes, or changes layer.
+        if self.parent is not None:
+            self.parent.invalidate_hit_index()
 
     def get_local_pos(self):
         return (self.local_x, self.local_y)
 
     def get_global_pos(self):
-        if self.parent is not None:
-            parent_pos = self.parent.get_global_pos() # Avoids redundant recursive calls
-            return (parent_pos[0] + self.local_x, parent_pos[1] + self.local_y)
-        else:
-            return (self.local_x, self.local_y)
+        # The global position is cached until this element or one of its ancestors moves.
+        if self.cached_global_pos is None:
+            if self.parent is not None:
+                parent_pos = self.parent.get_global_pos() # Avoids redundant recursive calls
+                self.cached_global_pos = (parent_pos[0] + self.local_x, parent_pos[1] + self.local_y)
+            else:
+                self.cached_global_pos = (self.local_x, self.local_y)
+        return self.cached_global_pos
 
     @property
     def global_x(self):
@@ -136,31 +200,46 @@ class Panel:
 
     def set_caption(self, caption):
         self.title = caption
+        self.request_redraw()
         return self
             
     def add_panel(self, panel):
         self.panels.append(panel)
         panel.parent = self
+        panel.invalidate_global_pos()
+        self.invalidate_hit_index()
+        self.request_redraw()
         return self
 
     def add_canvas(self, canvas):
         self.canvases.append(canvas)
         canvas.parent = self
+        canvas.invalidate_global_pos()
+        self.invalidate_hit_index()
+        self.request_redraw()
         return self
 
     def add_button(self, button):
         self.buttons.append(button)
         button.parent = self
+        button.invalidate_global_pos()
+        self.invalidate_hit_index()
+        self.request_redraw()
         return self
 
     def add_slider(self, slider):
         self.sliders.append(slider)
         slider.parent = self
+        slider.invalidate_global_pos()
+        self.invalidate_hit_index()
+        self.request_redraw()
         return self
 
     def add_text(self, text):
         self.text.append(text)
         text.parent = self
+        text.invalidate_global_pos()
+        self.request_redraw()
         return self
 
     def keep_on_screen(self):
@@ -173,6 +252,8 @@ class Panel:
     def toggle_visibility(self):
         if self.visible:
             self.parent.panels.remove(self)
+            self.parent.request_redraw()
+            self.parent.invalidate_hit_index()
             self.visible = False
             # Update every child element
             for panel in self.panels:
@@ -188,14 +269,50 @@ class Panel:
             self.parent.add_panel(self)
             self.visible = True
 
-    def render(self, surface):
+    def update(self):
+        # Runs every frame before rendering. Checks for changes that the children can not report by themselves (text given by functions).
+        for text in self.text:
+            text.update()
+        for panel in self.panels:
+            panel.update()
+
+    def render(self, surface, offset=(0, 0)):
+        # offset is the global position of the top left corner of the passed surface.
+
+        # The root panel checks the whole hierarchy for changes once per frame
+        if self.parent is None:
+            self.update()
+
+        self.was_redrawn = False
+        if not self.is_retained():
+            # Draw everything from scratch
+            self.draw(surface, offset)
+            self.was_redrawn = True
+            self.needs_redraw = False
+            return
+
+        bounding_rect = self.get_global_bounding_rect()
+        if self.needs_redraw or self.cached_surface is None or self.cached_surface.get_size() != bounding_rect.size:
+            # Something in the panel changed, so redraw its image
+            self.cached_surface = pygame.Surface(bounding_rect.size)
+            modules.profiler.count('surfaces')
+            self.draw(self.cached_surface, bounding_rect.topleft)
+            self.was_redrawn = True
+            self.needs_redraw = False
+
+        surface.blit(self.cached_surface, (bounding_rect.x - offset[0], bounding_rect.y - offset[1]))
+
+    def draw(self, surface, offset=(0, 0)):
+        # Draw the panel and all its children onto the passed surface.
+        # offset is the global position of the top left corner of the passed surface.
+
         # Render the panel rect onto the passed surface.
-        pygame.draw.rect(surface, self.style.panel_bg_color, self.get_global_bounding_rect())
+        pygame.draw.rect(surface, self.style.panel_bg_color, self.get_global_bounding_rect().move(-offset[0], -offset[1]))
         
         # If this panel is not fixed, draw the title bar and its caption onto the passed surface.
         if not self.fixed:
-            pygame.draw.rect(surface, self.style.panel_title_bar_color, self.get_global_title_bar_rect())
-            surface.blit(pygame.font.Font(None, self.style.panel_title_bar_text_size).render(self.title, True, self.style.panel_title_bar_text_color), (self.global_x + 3, self.global_y - self.style.panel_title_bar_height + 2))
+            pygame.draw.rect(surface, self.style.panel_title_bar_color, self.get_global_title_bar_rect().move(-offset[0], -offset[1]))
+            surface.blit(modules.ui.font_cache.render_text(self.title, self.style.panel_title_bar_text_size, self.style.panel_title_bar_text_color), (self.global_x + 3 - offset[0], self.global_y - self.style.panel_title_bar_height + 2 - offset[1]))
 
         # Note that there is an inconsistency in the order of how the children are rendered:
         # Child panels are rendered below child buttons, but child panels can cover child buttons from being pressed.
@@ -207,54 +324,67 @@ class Panel:
 
         # Render child panels
         for panel in self.panels:
-            panel.render(surface)
+            panel.render(surface, offset)
 
         # Render child buttons
         for button in self.buttons:
-            button.render(surface)
+            button.render(surface, offset)
 
         # Render child sliders
         for slider in self.sliders:
-            slider.render(surface)
+            slider.render(surface, offset)
             
         # Render child text
         for text in self.text:
-            text.render(surface)
+            text.render(surface, offset)
+
+    def get_hit_index(self):
+        # Build the index of which children are in which cells of a grid, in local coordinates so that moving the panel does not change it.
+        # Each cell lists (layer, child) pairs, where a lower layer is closer to the top.
+        # Layer order, from the top: panels, buttons, sliders, canvases, each from the end of its list.
+        if self.hit_index is None:
+            self.hit_index = {}
+            cell_size = self.style.panel_hit_index_cell_size
+            children = list(reversed(self.panels)) + list(reversed(self.buttons)) + list(reversed(self.sliders)) + list(reversed(self.canvases))
+            for layer, child in enumerate(children):
+                child_rect = child.get_local_bounding_rect()
+                for cell_y in range(child_rect.top // cell_size, (child_rect.bottom - 1) // cell_size + 1):
+                    for cell_x in range(child_rect.left // cell_size, (child_rect.right - 1) // cell_size + 1):
+                        self.hit_index.setdefault((cell_x, cell_y), []).append((layer, child))
+        return self.hit_index
+
+    def get_child_at(self, pos):
+        # Returns the top child whose bounding rect contains pos (a global position), or None.
+        global_pos = self.get_global_pos()
+        local_pos = (pos[0] - global_pos[0], pos[1] - global_pos[1])
+        cell_size = self.style.panel_hit_index_cell_size
+        top_layer = None
+        top_child = None
+        for layer, child in self.get_hit_index().get((local_pos[0] // cell_size, local_pos[1] // cell_size), ()):
+            if (top_layer is None or layer < top_layer) and child.get_local_bounding_rect().collidepoint(local_pos):
+                top_layer = layer
+                top_child = child
+        return top_child
 
     def mouse_over(self, hovered):
-        # Runs every frame. Set self.is_hovered and calculate which child elements are being hovered by the mouse.
+        # Runs every frame. Set self.is_hovered and calculate which child element is being hovered by the mouse.
         # hovered is True only if the mouse is over this panel and is not being blocked by a UI element on a higher layer.
         # If self.is_hovered is False, then all children will also have is_hovered set to False.
         
         self.is_hovered = hovered
 
         # Pass mouse hover to only the top UI element that the mouse is over
-        # Layer order, sequentially up the list of each: panels, buttons, sliders, canvases
-        element_found = False
-        for index, panel in enumerate(reversed(self.panels)):
-            if self.is_hovered and panel.get_global_bounding_rect().collidepoint(pygame.mouse.get_pos()) and not element_found:
-                panel.mouse_over(True)
-                element_found = True
-            else:
-                panel.mouse_over(False)
-        for index, button in enumerate(reversed(self.buttons)):
-            if self.is_hovered and button.get_global_bounding_rect().collidepoint(pygame.mouse.get_pos()) and not element_found:
-                button.mouse_over(True)
-                element_found = True
-            else:
-                button.mouse_over(False)
-        for index, slider in enumerate(reversed(self.sliders)):
-            if self.is_hovered and slider.get_global_bounding_rect().collidepoint(pygame.mouse.get_pos()) and not element_found:
-                slider.mouse_over(True)
-                element_found = True
-            else:
-                slider.mouse_over(False)
-        for index, canvas in enumerate(reversed(self.canvases)):
-            if self.is_hovered and canvas.get_global_bounding_rect().collidepoint(pygame.mouse.get_pos()) and not element_found:
-                canvas.mouse_over(True)
-                element_found = True
-            else:
-                canvas.mouse_over(False)
+        if self.is_hovered:
+            hovered_child = self.get_child_at(pygame.mouse.get_pos())
+        else:
+            hovered_child = None
+
+        # Only the previously hovered child and the newly hovered child need to be told. Every other child is already not hovered.
+        if self.hovered_child is not None and self.hovered_child is not hovered_child:
+            self.hovered_child.mouse_over(False)
+        if hovered_child is not None:
+            hovered_child.mouse_over(True)
+        self.hovered_child = hovered_child
 
     def mouse_moved(self, mouse_rel):
         # This function runs every frame the mouse moves.
@@ -287,6 +417,8 @@ class Panel:
         if self.is_hovered and self.parent is not None and not self.fixed:
             self.parent.panels.remove(self)
             self.parent.panels.append(self)
+            self.parent.request_redraw()
+            self.parent.invalidate_hit_index()
             
         if not self.fixed:
             # If it was not pressed, then detect when the title bar is pressed
@@ -9,16 +9,29 @@ class Slider:
         # If the parent is a pygame surface instead of a panel, self.parent should remain None and self.render() must be called explicitly.
         self.parent = None
 
+        # Global position, cached by get_global_pos()
+        self.cached_global_pos = None
+
         self.pos = pos
         self.min_value = min_value
         self.max_value = max_value
         self.color = color
 
-        self.percentage = 0
+        self.current_percentage = 0
 
         self.is_hovered = False
         self.is_held = False
 
+    @property
+    def percentage(self):
+        return self.current_percentage
+
+    @percentage.setter
+    def percentage(self, value):
+        if value != self.current_percentage:
+            self.current_percentage = value
+            self.request_parent_redraw()
+
     @property
     def size(self):
         return (12, self.height)
@@ -38,6 +51,9 @@ class Slider:
     @local_x.setter
     def local_x(self, value):
         self.pos = (value, self.pos[1])
+        self.invalidate_global_pos()
+        self.invalidate_parent_hit_index()
+        self.request_parent_redraw()
 
     @property
     def local_y(self):
@@ -46,16 +62,36 @@ class Slider:
     @local_y.setter
     def local_y(self, value):
         self.pos = (self.pos[0], value)
+        self.invalidate_global_pos()
+        self.invalidate_parent_hit_index()
+        self.request_parent_redraw()
+
+    def request_parent_redraw(self):
+        # The parent panel keeps an image of its children, which must be redrawn when this slider changes.
+        if self.parent is not None:
+            self.parent.request_redraw()
+
+    def invalidate_global_pos(self):
+        # Forget the cached global position. Called when this element or one of its ancestors moves.
+        self.cached_global_pos = None
+
+    def invalidate_parent_hit_index(self):
+        # The parent panel finds the child under the mouse with an index of where its children are, which must be rebuilt when this element moves, resizes, or changes layer.
+        if self.parent is not None:
+            self.parent.invalidate_hit_index()
 
     def get_local_pos(self):
         return (self.local_x, self.local_y)
 
     def get_global_pos(self):
-        if self.parent is not None:
-            parent_pos = self.parent.get_global_pos() # Avoids redundant recursive calls
-            return (parent_pos[0] + self.local_x, parent_pos[1] + self.local_y)
-        else:
-            return (self.local_x, self.local_y)
+        # The global position is cached until this element or one of its ancestors moves.
+        if self.cached_global_pos is None:
+            if self.parent is not None:
+                parent_pos = self.parent.get_global_pos() # Avoids redundant recursive calls
+                self.cached_global_pos = (parent_pos[0] + self.local_x, parent_pos[1] + self.local_y)
+            else:
+                self.cached_global_pos = (self.local_x, self.local_y)
+        return self.cached_global_pos
 
     @property
     def global_x(self):
@@ -74,13 +110,16 @@ class Slider:
     def get_value(self):
         return self.min_value + self.percentage * (self.max_value - self.min_value)
 
-    def render(self, surface):
+    def render(self, surface, offset=(0, 0)):
+        # offset is the global position of the top left corner of the passed surface.
+        x = self.global_x - offset[0]
+        y = self.global_y - offset[1]
         # Draw the filled in part
-        pygame.draw.rect(surface, self.color, (self.global_x + 3, self.global_y, 6, self.height))
+        pygame.draw.rect(surface, self.color, (x + 3, y, 6, self.height))
         # Draw the not filled in part
-        pygame.draw.rect(surface, (0, 0, 0), (self.global_x + 3, self.global_y, 6, (1 - self.percentage) * self.height))
+        pygame.draw.rect(surface, (0, 0, 0), (x + 3, y, 6, (1 - self.percentage) * self.height))
         # Draw the draggable part
-        pygame.draw.rect(surface, (255, 255, 255), (self.global_x, self.global_y + (1 - self.percentage) * (self.height - 6), self.width, 6))
+        pygame.draw.rect(surface, (255, 255, 255), (x, y + (1 - self.percentage) * (self.height - 6), self.width, 6))
 
     def mouse_over(self, hovered):
         # Runs every frame. Set self.is_hovered.
@@ -101,6 +140,8 @@ class Slider:
             if self.parent is not None:
                 self.parent.sliders.remove(self)
                 self.parent.sliders.append(self)
+                self.invalidate_parent_hit_index()
+                self.request_parent_redraw()
             
             self.is_held = True
 
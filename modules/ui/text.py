@@ -2,12 +2,17 @@
 
 import pygame
 
+import modules.ui.font_cache
+
 # Class for text UI elements
 class Text:
     def __init__(self, message, size, color, pos):
         # This text's parent object. This gets set with parent.add_text(self).
         # If the parent is a pygame surface instead of a panel, self.parent should remain None and self.render() must be called explicitly.
         self.parent = None
+
+        # Global position, cached by get_global_pos()
+        self.cached_global_pos = None
         
         # Text string
         self.message = message
@@ -16,21 +21,65 @@ class Text:
         self.size = size
 
         # Font color
-        self.color = color
+        self.current_color = color
 
         # Text position (relative to the surface or parent panel that the text is rendered on)
-        self.local_x = pos[0]
-        self.local_y = pos[1]
+        self.pos = pos
+
+        # The message as of the last update, used to detect when a message given by a function changes
+        self.current_message = None
+
+    @property
+    def color(self):
+        return self.current_color
+
+    @color.setter
+    def color(self, value):
+        if value != self.current_color:
+            self.current_color = value
+            self.request_parent_redraw()
+
+    @property
+    def local_x(self):
+        return self.pos[0]
+
+    @local_x.setter
+    def local_x(self, value):
+        self.pos = (value, self.pos[1])
+        self.invalidate_global_pos()
+        self.request_parent_redraw()
+
+    @property
+    def local_y(self):
+        return self.pos[1]
+
+    @local_y.setter
+    def local_y(self, value):
+        self.pos = (self.pos[0], value)
+        self.invalidate_global_pos()
+        self.request_parent_redraw()
+
+    def request_parent_redraw(self):
+        # The parent panel keeps an image of its children, which must be redrawn when this text changes.
+        if self.parent is not None:
+            self.parent.request_redraw()
+
+    def invalidate_global_pos(self):
+        # Forget the cached global position. Called when this element or one of its ancestors moves.
+        self.cached_global_pos = None
 
     def get_local_pos(self):
         return (self.local_x, self.local_y)
 
     def get_global_pos(self):
-        if self.parent is not None:
-            parent_pos = self.parent.get_global_pos() # Avoids redundant recursive calls
-            return (parent_pos[0] + self.local_x, parent_pos[1] + self.local_y)
-        else:
-            return (self.local_x, self.local_y)
+        # The global position is cached until this element or one of its ancestors moves.
+        if self.cached_global_pos is None:
+            if self.parent is not None:
+                parent_pos = self.parent.get_global_pos() # Avoids redundant recursive calls
+                self.cached_global_pos = (parent_pos[0] + self.local_x, parent_pos[1] + self.local_y)
+            else:
+                self.cached_global_pos = (self.local_x, self.local_y)
+        return self.cached_global_pos
 
     @property
     def global_x(self):
@@ -40,12 +89,23 @@ class Text:
     def global_y(self):
         return self.get_global_pos()[1]
 
-    def render(self, surface):
+    def get_message(self):
         # If the string is given by a function, then call the function.
         if callable(self.message):
-            message = self.message()
+            return self.message()
         else:
-            message = self.message
+            return self.message
+
+    def update(self):
+        # Runs every frame. A message given by a function can change at any time, so the parent panel has to be told when it does.
+        message = self.get_message()
+        if message != self.current_message:
+            self.current_message = message
+            self.request_parent_redraw()
+
+    def render(self, surface, offset=(0, 0)):
+        # offset is the global position of the top left corner of the passed surface.
+        message = self.get_message()
 
-        # Render the text
-        surface.blit(pygame.font.Font(None, self.size).render(message, True, self.color), self.get_global_pos())
+        # Render the text (only rendered again when the message, size, or color changes)
+        surface.blit(modules.ui.font_cache.render_text(message, self.size, self.color), (self.global_x - offset[0], self.global_y - offset[1]))
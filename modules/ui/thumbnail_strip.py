@@ -0,0 +1,178 @@
+## Author: Alexander Art
+
+import pygame
+
+import modules.profiler
+
+# Class for a scrollable strip of thumbnails of the tiles of a tileset (see modules/atlas.py). Clicking a thumbnail loads the tile into the canvas.
+# Thumbnails are only made for the tiles that can be seen (which also starts decoding them), and are forgotten once they are scrolled out of view.
+# Like a canvas, the strip changes often, so it is added to its panel with add_canvas() and drawn every frame.
+class ThumbnailStrip:
+    def __init__(self, rect, canvas, thumbnail_size=72, spacing=8):
+        # This strip's parent object. This gets set with parent.add_canvas(self).
+        self.parent = None
+
+        # Global position, cached by get_global_pos()
+        self.cached_global_pos = None
+
+        self.rect = pygame.Rect(rect) # Relative to parent
+
+        # The canvas whose tileset is shown, and which loads the tile when a thumbnail is clicked
+        self.canvas = canvas
+
+        # Largest width and height of a thumbnail, and the space between thumbnails
+        self.thumbnail_size = thumbnail_size
+        self.spacing = spacing
+
+        # How far (in pixels) the strip is scrolled to the right
+        self.scroll = 0
+
+        # True if the mouse is hovering over the strip and the strip is not being covered by something else on a higher layer
+        self.is_hovered = False
+
+        # The atlas that the thumbnails are of, and the thumbnails of the tiles that can be seen, as {tile index: (tile version, surface)}
+        self.atlas = None
+        self.thumbnails = {}
+
+    @property
+    def local_x(self):
+        return self.rect.x
+
+    @local_x.setter
+    def local_x(self, value):
+        self.rect.x = value
+        self.invalidate_global_pos()
+        self.invalidate_parent_hit_index()
+
+    @property
+    def local_y(self):
+        return self.rect.y
+
+    @local_y.setter
+    def local_y(self, value):
+        self.rect.y = value
+        self.invalidate_global_pos()
+        self.invalidate_parent_hit_index()
+
+    def invalidate_global_pos(self):
+        # Forget the cached global position. Called when this element or one of its ancestors moves.
+        self.cached_global_pos = None
+
+    def invalidate_parent_hit_index(self):
+        # The parent panel finds the child under the mouse with an index of where its children are, which must be rebuilt when this element moves, resizes, or changes layer.
+        if self.parent is not None:
+            self.parent.invalidate_hit_index()
+
+    def get_global_pos(self):
+        # The global position is cached until this element or one of its ancestors moves.
+        if self.cached_global_pos is None:
+            if self.parent is not None:
+                parent_pos = self.parent.get_global_pos() # Avoids redundant recursive calls
+                self.cached_global_pos = (parent_pos[0] + self.rect.x, parent_pos[1] + self.rect.y)
+            else:
+                self.cached_global_pos = self.rect.topleft
+        return self.cached_global_pos
+
+    def get_local_bounding_rect(self):
+        return self.rect
+
+    def get_global_bounding_rect(self):
+        return pygame.Rect(self.get_global_pos(), self.rect.size)
+
+    def get_cell_width(self):
+        return self.thumbnail_size + self.spacing
+
+    def get_max_scroll(self):
+        if self.atlas is None:
+            return 0
+        return max(0, self.atlas.tile_count * self.get_cell_width() + self.spacing - self.rect.width)
+
+    def scroll_by(self, steps):
+        # Scroll by a number of thumbnails. Positive steps scroll to the left, like the mouse wheel scrolling up.
+        self.scroll = max(0, min(self.get_max_scroll(), self.scroll - steps * self.get_cell_width()))
+
+    def get_visible_tiles(self):
+        # Returns the range of tile indices that can be seen
+        first_index = max(0, (self.scroll - self.spacing) // self.get_cell_width())
+        last_index = min(self.atlas.tile_count, (self.scroll + self.rect.width) // self.get_cell_width() + 1)
+        return range(first_index, last_index)
+
+    def get_tile_at(self, pos):
+        # Returns the index of the tile whose thumbnail is at pos (a global position), or None
+        global_pos = self.get_global_pos()
+        cell_x = pos[0] - global_pos[0] + self.scroll - self.spacing
+        if self.atlas is None or cell_x < 0 or cell_x % self.get_cell_width() >= self.thumbnail_size:
+            return None
+        index = cell_x // self.get_cell_width()
+        if index >= self.atlas.tile_count:
+            return None
+        return index
+
+    def get_thumbnail(self, index):
+        # Returns the thumbnail of a tile, scaling it down from the atlas again if the tile changed since the thumbnail was made
+        version = self.atlas.versions[index]
+        if index in self.thumbnails and self.thumbnails[index][0] == version:
+            return self.thumbnails[index][1]
+        tile = self.atlas.get_tile_surface(index)
+        scale = min(self.thumbnail_size / tile.get_width(), self.thumbnail_size / tile.get_height())
+        size = (max(1, round(tile.get_width() * scale)), max(1, round(tile.get_height() * scale)))
+        # Small tiles are usually pixel art, which is kept sharp when it is scaled up
+        if scale >= 1:
+            thumbnail = pygame.transform.scale(tile, size)
+        else:
+            thumbnail = pygame.transform.smoothscale(tile, size)
+        modules.profiler.count('surfaces')
+        self.thumbnails[index] = (version, thumbnail)
+        return thumbnail
+
+    def render(self, surface):
+        # A different tileset starts scrolled to the beginning
+        if self.canvas.atlas is not self.atlas:
+            self.atlas = self.canvas.atlas
+            self.thumbnails = {}
+            self.scroll = 0
+
+        strip_rect = self.get_global_bounding_rect()
+        pygame.draw.rect(surface, (31, 31, 31), strip_rect)
+        if self.atlas is None:
+            return
+
+        surface.set_clip(strip_rect)
+        visible_thumbnails = {}
+        for index in self.get_visible_tiles():
+            # Start decoding the tile if it is not loaded yet
+            self.atlas.request_tile(index)
+            cell_rect = pygame.Rect(strip_rect.x + self.spacing + index * self.get_cell_width() - self.scroll, strip_rect.y + (strip_rect.height - self.thumbnail_size) // 2, self.thumbnail_size, self.thumbnail_size)
+            if self.atlas.loaded[index]:
+                thumbnail = self.get_thumbnail(index)
+                visible_thumbnails[index] = self.thumbnails[index]
+                surface.blit(thumbnail, thumbnail.get_rect(center=cell_rect.center))
+            elif self.atlas.failed[index]:
+                pygame.draw.line(surface, (191, 0, 0), cell_rect.topleft, cell_rect.bottomright, 3)
+                pygame.draw.line(surface, (191, 0, 0), cell_rect.topright, cell_rect.bottomleft, 3)
+            else:
+                # Not decoded yet
+                pygame.draw.rect(surface, (63, 63, 63), cell_rect)
+            if index == self.canvas.atlas_index:
+                pygame.draw.rect(surface, (255, 255, 255), cell_rect.inflate(4, 4), 2)
+        surface.set_clip(None)
+        # Forget the thumbnails that were scrolled out of view
+        self.thumbnails = visible_thumbnails
+
+    def mouse_over(self, hovered):
+        # Runs every frame. Set self.is_hovered.
+        # hovered is True only if the mouse is over this strip and is not being blocked by a UI element on a higher layer.
+        self.is_hovered = hovered
+
+    def mouse_moved(self, mouse_rel):
+        pass
+
+    def left_mouse_down(self):
+        # Load the clicked tile into the canvas
+        if self.is_hovered:
+            index = self.get_tile_at(pygame.mouse.get_pos())
+            if index is not None:
+                self.canvas.select_atlas_tile(index)
+
+    def left_mouse_up(self):
+        pass
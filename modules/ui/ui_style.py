@@ -8,6 +8,7 @@ class Style:
                  panel_title_bar_text_color=(0, 0, 0),
                  panel_title_bar_text_size=24,
                  panel_title_bar_height=20,
+                 panel_hit_index_cell_size=64,
                  button_default_bg_color=(63, 0, 0),
                  button_hovered_bg_color=(255, 127, 63),
                  button_default_text_color=(255, 255, 255),
@@ -19,6 +20,7 @@ class Style:
         self.panel_title_bar_text_color = panel_title_bar_text_color
         self.panel_title_bar_text_size = panel_title_bar_text_size
         self.panel_title_bar_height = panel_title_bar_height
+        self.panel_hit_index_cell_size = panel_hit_index_cell_size
         self.button_default_bg_color = button_default_bg_color
         self.button_hovered_bg_color = button_hovered_bg_color
         self.button_default_text_color = button_default_text_color
@@ -1,15 +1,104 @@
 ## Author: Alexander Art
 
+import numpy
+import pygame
+
+# Colors are blended in squared space (new = sqrt(previous^2 * (1 - alpha) + color^2 * alpha)).
+# Instead of calculating squares and square roots for every pixel, the result for every alpha level and pair of channel values is precomputed.
+# blend_table[new value, alpha, previous value] is the blended channel value. It is built the first time it is needed (16 MiB).
+# The new value comes first so that the table for blending a single color is one contiguous block.
+blend_table = None
+
+def get_blend_table():
+    global blend_table
+    if blend_table is None:
+        values_squared = numpy.arange(256, dtype=numpy.float64) ** 2
+        blend_table = numpy.empty((256, 256, 256), dtype=numpy.uint8)
+        alpha_levels = numpy.arange(256, dtype=numpy.float64)[:, numpy.newaxis]
+        previous_parts = values_squared[numpy.newaxis, :] * (1 - alpha_levels / 255) # [alpha, previous value]
+        # Build the table for one new value at a time to avoid a huge temporary array
+        for value in range(256):
+            blend_table[value] = numpy.sqrt(previous_parts + values_squared[value] * alpha_levels / 255)
+    return blend_table
+
+# Convert alpha values (a number or an array) to the nearest alpha levels of the blend table.
+def get_alpha_levels(alpha):
+    return numpy.clip(numpy.rint(alpha), 0, 255).astype(numpy.uint8)
+
+# Blend a color onto a rect of an image (the rect must be inside the image). The alpha channel of the image is kept.
+# alpha is the opacity of the color (0-255) for the whole rect, or an array of opacities for each pixel of the rect (indexed [x, y] like pygame.surfarray).
+# If alpha is None, the alpha of the color is used.
+def blend_color(image_source, rect, color, alpha=None):
+    rect = pygame.Rect(rect)
+    table = get_blend_table()
+    if alpha is None:
+        alpha = color[3]
+    alpha_levels = get_alpha_levels(alpha)
+
+    pixels = pygame.surfarray.pixels3d(image_source)[rect.left:rect.right, rect.top:rect.bottom]
+    for channel in range(3):
+        color_table = table[int(color[channel])]
+        if alpha_levels.ndim == 0:
+            # Same opacity everywhere, so the table reduces to a single lookup from previous to blended value
+            pixels[:, :, channel] = color_table[alpha_levels][pixels[:, :, channel]]
+        else:
+            pixels[:, :, channel] = color_table[alpha_levels, pixels[:, :, channel]]
+    del pixels # Unlock the image
+
+# Blend an array of colors (indexed [x, y, channel], the size of the rect) onto a rect of an image (the rect must be inside the image). The alpha channel of the image is kept.
+# alpha is the opacity of the colors (0-255) for the whole rect, or an array of opacities for each pixel of the rect.
+def blend_pixels(image_source, rect, colors, alpha):
+    rect = pygame.Rect(rect)
+    table = get_blend_table()
+    alpha_levels = get_alpha_levels(alpha)
+
+    pixels = pygame.surfarray.pixels3d(image_source)[rect.left:rect.right, rect.top:rect.bottom]
+    for channel in range(3):
+        pixels[:, :, channel] = table[colors[:, :, channel], alpha_levels, pixels[:, :, channel]]
+    del pixels # Unlock the image
+
 # Overlay a pixel on an image with a new color. Works with transparency.
+# A single pixel is blended with get_at() and set_at() and three lookups in the blend table, which is much faster than locking the image for blend_color().
 def overlay_pixel(image_source, pos, color):
-    # Get previous color to overlay
+    table = get_blend_table()
+    alpha_level = min(255, max(0, round(color[3]))) # The same rounding as get_alpha_levels()
     previous_color = image_source.get_at(pos)
+    image_source.set_at(pos, (table[int(color[0]), alpha_level, previous_color[0]], table[int(color[1]), alpha_level, previous_color[1]], table[int(color[2]), alpha_level, previous_color[2]], previous_color[3]))
 
-    # Color blending (I don't know how I should go about blending the transparency)
-    new_red = (previous_color[0] ** 2 * (1 - color[3] / 255) + color[0] ** 2 * color[3] / 255) ** (1 / 2)
-    new_green = (previous_color[1] ** 2 * (1 - color[3] / 255) + color[1] ** 2 * color[3] / 255) ** (1 / 2)
-    new_blue = (previous_color[2] ** 2 * (1 - color[3] / 255) + color[2] ** 2 * color[3] / 255) ** (1 / 2)
-    new_color = (new_red, new_green, new_blue, previous_color[3])
+# Split a rect that may stick out of an image (of the given size) into the pieces that wrap around to the other sides of the image, the same way the image tiles.
+# Returns a list of (piece, offset) pairs. Each piece is a rect inside the image, and offset is where the piece starts relative to the top left corner of the original rect.
+def split_wrapped_rect(rect, size):
+    pieces = []
+    offset_y = 0
+    while offset_y < rect.height:
+        piece_y = (rect.y + offset_y) % size[1]
+        piece_height = min(rect.height - offset_y, size[1] - piece_y)
+        offset_x = 0
+        while offset_x < rect.width:
+            piece_x = (rect.x + offset_x) % size[0]
+            piece_width = min(rect.width - offset_x, size[0] - piece_x)
+            pieces.append((pygame.Rect(piece_x, piece_y, piece_width, piece_height), (offset_x, offset_y)))
+            offset_x += piece_width
+        offset_y += piece_height
+    return pieces
 
-    # Set the pixel
-    image_source.set_at(pos, new_color)
+# Merge rects that mostly overlap each other, so the same pixels do not get redrawn several times.
+# Rects that are far apart are kept separate to avoid redrawing the space between them.
+# Painted rects come in stroke order, so each rect is only compared with the few rects that were merged last.
+def merge_rects(rects, lookback=8):
+    merged_rects = []
+    for rect in rects:
+        rect = pygame.Rect(rect)
+        merged = True
+        while merged:
+            merged = False
+            for index in range(len(merged_rects) - 1, max(-1, len(merged_rects) - 1 - lookback), -1):
+                other_rect = merged_rects[index]
+                union_rect = rect.union(other_rect)
+                if union_rect.width * union_rect.height <= rect.width * rect.height + other_rect.width * other_rect.height:
+                    rect = union_rect
+                    del merged_rects[index]
+                    merged = True
+                    break
+        merged_rects.append(rect)
+    return merged_rects
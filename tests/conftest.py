@@ -0,0 +1,34 @@
+## Author: Alexander Art
+
+import os
+import sys
+
+# The tests run without opening a window
+os.environ['SDL_VIDEODRIVER'] = 'dummy'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy
+import pygame
+import pytest
+
+@pytest.fixture(scope='session', autouse=True)
+def display():
+    # convert_alpha() and the canvas need a display mode to be set
+    pygame.init()
+    display = pygame.display.set_mode((1280, 720))
+    yield display
+    pygame.quit()
+
+@pytest.fixture
+def random_image():
+    # Returns an image of the given size with random colors, including partly transparent pixels
+    def make_image(size, seed=0):
+        random = numpy.random.default_rng(seed)
+        image = pygame.Surface(size, pygame.SRCALPHA)
+        color_pixels = pygame.surfarray.pixels3d(image)
+        alpha_pixels = pygame.surfarray.pixels_alpha(image)
+        color_pixels[:] = random.integers(0, 256, (size[0], size[1], 3), dtype=numpy.uint8)
+        alpha_pixels[:] = random.integers(0, 256, size, dtype=numpy.uint8)
+        del color_pixels, alpha_pixels # Unlock the image
+        return image
+    return make_image
@@ -0,0 +1,66 @@
+## Author: Alexander Art
+
+from collections import deque
+
+import numpy
+import pygame
+
+import modules.flood_fill
+import modules.stamp
+
+def get_filled(image, pos, tolerance=0):
+    # Fill a copy of the image at pos and return which pixels changed, indexed [x, y]
+    filled_image = image.copy()
+    region = modules.flood_fill.find_region(filled_image, pos, tolerance)
+    modules.stamp.fill_region(filled_image, region, (1, 2, 3, 4))
+    return pygame.surfarray.array2d(filled_image) != pygame.surfarray.array2d(image)
+
+def wrapped_flood(colors, pos):
+    # Fill one pixel at a time, wrapping around the edges, for comparing with the span based fill
+    width, height = colors.shape
+    filled = numpy.zeros(colors.shape, dtype=bool)
+    filled[pos] = True
+    queue = deque([pos])
+    while queue:
+        x, y = queue.popleft()
+        for neighbor in ((x + 1) % width, y), ((x - 1) % width, y), (x, (y + 1) % height), (x, (y - 1) % height):
+            if not filled[neighbor] and colors[neighbor] == colors[pos]:
+                filled[neighbor] = True
+                queue.append(neighbor)
+    return filled
+
+def test_fill_continues_across_the_edges():
+    image = pygame.Surface((20, 16), pygame.SRCALPHA)
+    image.fill((255, 255, 255, 255))
+    # Two walls split the image into a middle part and the parts at the left and right edges
+    image.fill((0, 0, 0, 255), (5, 0, 1, 16))
+    image.fill((0, 0, 0, 255), (15, 0, 1, 16))
+    filled = get_filled(image, (2, 3))
+    assert filled[:5].all() and filled[16:].all()
+    assert not filled[5:16].any()
+
+    # The same across the top and bottom edges
+    image.fill((255, 255, 255, 255))
+    image.fill((0, 0, 0, 255), (0, 3, 20, 1))
+    image.fill((0, 0, 0, 255), (0, 10, 20, 1))
+    filled = get_filled(image, (7, 1))
+    assert filled[:, :3].all() and filled[:, 11:].all()
+    assert not filled[:, 3:11].any()
+
+def test_fill_matches_pixel_by_pixel_fill():
+    random = numpy.random.default_rng(2)
+    image = pygame.Surface((48, 40), pygame.SRCALPHA)
+    palette = [(200, 30, 30, 255), (30, 200, 30, 255)]
+    for x in range(48):
+        for y in range(40):
+            image.set_at((x, y), palette[int(random.random() < 0.4)])
+    colors = pygame.surfarray.array2d(image)
+    for pos in [(0, 0), (47, 39), (20, 13), (3, 38)]:
+        assert (get_filled(image, pos) == wrapped_flood(colors, pos)).all()
+
+def test_fill_tolerance():
+    image = pygame.Surface((8, 8), pygame.SRCALPHA)
+    image.fill((100, 100, 100, 255))
+    image.fill((110, 100, 100, 255), (0, 0, 4, 8))
+    assert get_filled(image, (6, 0), 10).all()
+    assert get_filled(image, (6, 0), 9).sum() == 32
@@ -0,0 +1,33 @@
+## Author: Alexander Art
+
+import os
+
+import pygame
+import pytest
+
+import modules.image_io
+
+@pytest.mark.parametrize('size', [(1, 1), (37, 23), (64, 64)])
+def test_png_encode_round_trip(tmp_path, random_image, size):
+    image = random_image(size)
+    pixels = pygame.image.tobytes(image, 'RGBA')
+    filepath = str(tmp_path / 'image.png')
+    with open(filepath, 'wb') as file:
+        file.write(modules.image_io.encode_png(pixels, size))
+    loaded = pygame.image.load(filepath)
+    assert loaded.get_size() == size
+    assert pygame.image.tobytes(loaded, 'RGBA') == pixels
+
+def test_save_and_open_task(tmp_path, random_image):
+    image = random_image((40, 30))
+    filepath = str(tmp_path / 'image.png')
+    task = modules.image_io.start_save(image, filepath)
+    task.wait()
+    assert task.error is None
+    assert not os.path.exists(filepath + '.tmp')
+
+    task = modules.image_io.start_open(filepath)
+    task.wait()
+    assert task.error is None
+    opened = modules.image_io.finish_open(task)
+    assert pygame.image.tobytes(opened, 'RGBA') == pygame.image.tobytes(image, 'RGBA')
@@ -0,0 +1,61 @@
+## Author: Alexander Art
+
+import pygame
+
+import modules.history
+import modules.journal
+
+def paint_change(journal, image, index):
+    # Paint a pixel and record the tile it is in
+    image.fill((index * 10, 0, 0, 255), (index, 0, 1, 1))
+    tile_rect = pygame.Rect(0, 0, 16, 16)
+    journal.add('stroke', {}, [(tile_rect, modules.history.save_tile(image, tile_rect))])
+
+def test_replay_recovers_changes(tmp_path):
+    image_filepath = str(tmp_path / 'image.png')
+    pygame.image.save(pygame.Surface((16, 16), pygame.SRCALPHA), image_filepath)
+
+    image = pygame.image.load(image_filepath)
+    journal = modules.journal.Journal(image_filepath)
+    assert journal.open(image) == 0
+    for index in range(5):
+        paint_change(journal, image, index)
+    journal.flush()
+    # The journal is not closed, as if the program crashed
+
+    recovered_image = pygame.image.load(image_filepath)
+    recovered_journal = modules.journal.Journal(image_filepath)
+    assert recovered_journal.open(recovered_image) == 5
+    assert pygame.image.tobytes(recovered_image, 'RGBA') == pygame.image.tobytes(image, 'RGBA')
+    recovered_journal.close(False)
+
+def test_replay_count_after_checkpoint_and_save(tmp_path):
+    image_filepath = str(tmp_path / 'image.png')
+    image = pygame.Surface((16, 16), pygame.SRCALPHA)
+    pygame.image.save(image, image_filepath)
+
+    journal = modules.journal.Journal(image_filepath)
+    journal.open(image)
+    for index in range(5):
+        paint_change(journal, image, index)
+    journal.flush()
+    journal.start_checkpoint()
+    journal.wait_for_checkpoint()
+    for index in range(5, 7):
+        paint_change(journal, image, index)
+    journal.flush()
+
+    # Save a copy of the image with the first 3 changes in it. The other 4 were made while it was being saved.
+    saved_image = image.copy()
+    saved_image.fill((0, 0, 0, 0), (3, 0, 4, 1))
+    saved_filepath = str(tmp_path / 'saved.png')
+    pygame.image.save(saved_image, saved_filepath)
+    journal.rebase(saved_filepath, image.get_size(), 3)
+    journal.close(True)
+
+    recovered_image = pygame.image.load(saved_filepath)
+    recovered_journal = modules.journal.Journal(saved_filepath)
+    assert recovered_journal.open(recovered_image) == 4
+    assert recovered_journal.change_count == 7
+    assert pygame.image.tobytes(recovered_image, 'RGBA') == pygame.image.tobytes(image, 'RGBA')
+    recovered_journal.close(False)
@@ -0,0 +1,90 @@
+## Author: Alexander Art
+
+import time
+
+import pygame
+
+import modules.layers
+import modules.settings
+import modules.ui.canvas
+import tile_art_helper
+
+def open_canvas(display, monkeypatch, tmp_path):
+    # Open an image in the canvas of a new UI, with the mouse over the canvas
+    image = pygame.Surface((100, 80), pygame.SRCALPHA)
+    image.fill((20, 120, 20, 255))
+    image_filepath = str(tmp_path / 'image.png')
+    pygame.image.save(image, image_filepath)
+    monkeypatch.setattr(modules.settings, 'journal_enabled', False)
+    monkeypatch.setattr(modules.ui.canvas.filedialog, 'askopenfilename', lambda **options: image_filepath)
+    mouse_pos = [(301, 301)]
+    monkeypatch.setattr(pygame.mouse, 'get_pos', lambda: mouse_pos[0])
+
+    ui = tile_art_helper.create_ui(display)
+    canvas = ui.canvas
+    canvas.open_file()
+    while canvas.image_task is not None:
+        time.sleep(0.01)
+        ui.main_panel.render(display)
+    canvas.is_hovered = True
+    ui.brush.set_brush_circle()
+    ui.brush.size = 9
+    return ui, canvas, mouse_pos
+
+def paint_stroke(ui, canvas, display, color):
+    ui.brush.color = color
+    canvas.left_mouse_down()
+    canvas.mouse_moved((20, 10))
+    canvas.left_mouse_up()
+    ui.main_panel.render(display)
+
+def get_pixels(surface):
+    return pygame.image.tobytes(surface, 'RGBA')
+
+def test_undo_after_remove_layer(display, monkeypatch, tmp_path):
+    ui, canvas, mouse_pos = open_canvas(display, monkeypatch, tmp_path)
+    bottom_surface = canvas.layers.layers[0].surface
+    before_stroke = get_pixels(bottom_surface)
+    paint_stroke(ui, canvas, display, (255, 0, 0, 255))
+    after_stroke = get_pixels(bottom_surface)
+    assert after_stroke != before_stroke
+
+    canvas.add_layer()
+    mouse_pos[0] = (351, 321)
+    paint_stroke(ui, canvas, display, (0, 0, 255, 255))
+    canvas.remove_layer()
+    ui.main_panel.render(display)
+    assert len(canvas.layers.layers) == 1
+
+    # The stroke on the removed layer is gone from the history, so undo goes to the stroke on the bottom layer
+    assert len(canvas.history.undo_stack) == 1
+    assert canvas.history.get_memory_used() == canvas.history.get_stroke_memory(canvas.history.undo_stack[0][1])
+    canvas.undo()
+    assert get_pixels(bottom_surface) == before_stroke
+    canvas.redo()
+    assert get_pixels(bottom_surface) == after_stroke
+    assert not canvas.history.can_redo()
+
+def test_project_round_trip(tmp_path):
+    layer_stack = modules.layers.LayerStack(pygame.Surface((16, 16), pygame.SRCALPHA))
+    layer_stack.layers[0].surface.fill((10, 20, 30, 255))
+    layer_stack.add_layer()
+    layer_stack.get_active_surface().fill((200, 0, 0, 128), (4, 4, 8, 8))
+    layer_stack.get_active_layer().opacity = 0.5
+    layer_stack.get_active_layer().blend_mode = 'multiply'
+
+    image_filepath = str(tmp_path / 'image.png')
+    task = modules.layers.start_save_project(layer_stack, image_filepath)
+    task.wait()
+    assert task.error is None
+
+    task = modules.layers.start_open_project(modules.layers.get_project_filepath(image_filepath))
+    task.wait()
+    assert task.error is None
+    opened = modules.layers.finish_open_project(task)
+    assert len(opened.layers) == 2 and opened.layer_count == 2
+    assert opened.active_index == 1
+    assert opened.get_active_layer().opacity == 0.5 and opened.get_active_layer().blend_mode == 'multiply'
+    for layer, opened_layer in zip(layer_stack.layers, opened.layers):
+        assert get_pixels(opened_layer.surface) == get_pixels(layer.surface)
+    assert get_pixels(opened.flatten()) == get_pixels(layer_stack.flatten())
@@ -0,0 +1,35 @@
+## Author: Alexander Art
+
+import pygame
+import pytest
+
+from modules.scaled_image_cache import ScaledImageCache, scale_region
+
+def get_pixels(surface):
+    return pygame.image.tobytes(surface, 'RGBA')
+
+@pytest.mark.parametrize('zoom', [0.3, 0.77, 1, 2.5, 7])
+def test_patched_rendition_equals_fresh_scale(random_image, zoom):
+    image = random_image((97, 61))
+    scaled_size = (round(97 * zoom), round(61 * zoom))
+    cache = ScaledImageCache()
+    cache.get(image, zoom, scaled_size)
+
+    # Paint over a few rects (one of them at the edge of the image) and only patch the cache
+    rects = [pygame.Rect(3, 5, 10, 7), pygame.Rect(40, 20, 1, 1), pygame.Rect(90, 55, 7, 6)]
+    for index, rect in enumerate(rects):
+        image.fill((255, index * 100, 0, 128), rect)
+    cache.patch(image, rects)
+    patched = cache.get(image, zoom, scaled_size)
+
+    fresh = ScaledImageCache().get(image, zoom, scaled_size)
+    assert get_pixels(patched) == get_pixels(fresh)
+
+def test_scale_region_matches_full_scale(random_image):
+    image = random_image((50, 40))
+    scaled_size = (173, 91)
+    full = pygame.transform.scale(image, scaled_size)
+    region = pygame.Rect(17, 9, 60, 45)
+    part, pos = scale_region(image, scaled_size, region)
+    assert pos == region.topleft
+    assert get_pixels(part) == get_pixels(full.subsurface(region))
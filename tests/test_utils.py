@@ -0,0 +1,24 @@
+## Author: Alexander Art
+
+import numpy
+import pygame
+
+import modules.utils
+
+def test_overlay_pixel_matches_blend_color(random_image):
+    image = random_image((32, 32)).convert_alpha()
+    expected = image.copy()
+    random = numpy.random.default_rng(1)
+    for i in range(500):
+        pos = (int(random.integers(32)), int(random.integers(32)))
+        color = tuple(int(channel) for channel in random.integers(0, 256, 4))
+        modules.utils.overlay_pixel(image, pos, color)
+        modules.utils.blend_color(expected, (pos, (1, 1)), color)
+    assert pygame.image.tobytes(image, 'RGBA') == pygame.image.tobytes(expected, 'RGBA')
+
+def test_overlay_pixel_keeps_alpha():
+    image = pygame.Surface((2, 2), pygame.SRCALPHA)
+    image.fill((0, 0, 0, 77))
+    modules.utils.overlay_pixel(image, (1, 0), (255, 255, 255, 255))
+    assert image.get_at((1, 0)) == (255, 255, 255, 77)
+    assert image.get_at((0, 0)) == (0, 0, 0, 77)
@@ -2,34 +2,26 @@
 ## Author: Alexander Art
 
 import math
+import sys
+from types import SimpleNamespace
 
 import pygame
 
+import modules.batch
+import modules.profiler
 import modules.settings
 from modules.brush import Brush
+from modules.frame_scheduler import FrameScheduler
 from modules.ui.ui_style import Style
 from modules.ui.panel import Panel
 from modules.ui.canvas import Canvas
 from modules.ui.button import Button
 from modules.ui.text import Text
 from modules.ui.slider import Slider
+from modules.ui.thumbnail_strip import ThumbnailStrip
 
-def main():
-    print("INSTRUCTIONS:")
-    print("Open an image file")
-    print("Left click to paint")
-    print("Middle click to use a color picker at the mouse position")
-    print("Right click and drag to pan")
-    print("Scroll to zoom")
-    print("Use the on-screen controls for everything else")
-    
-
-    # Initialize pygame
-    pygame.init()
-    window_caption = "Tile Art Helper"
-    pygame.display.set_caption(window_caption)
-    display = pygame.display.set_mode((1280, 720), pygame.RESIZABLE)
-
+def create_ui(display):
+    # Create the brush, the canvas, and every UI element, sized to fit the display.
 
     # Create root (main) panel
     main_panel = Panel(((0, 0), display.get_size()), True, Style(panel_bg_color=(0, 0, 0)))
@@ -68,6 +60,16 @@ def main():
     coords_text = Text(canvas.get_coords_text, 24, (255, 255, 255), (8, 8))
     bottom_panel.add_text(coords_text)
 
+    # Bottom panel text that shows when an image is being opened or saved
+    image_task_text = Text(canvas.get_image_task_text, 24, (255, 255, 0), (320, 8))
+    bottom_panel.add_text(image_task_text)
+
+    # Bottom panel seam analyzer button and score
+    seam_analyzer_button = Button((display.get_width() - 400, 2, 100, 26), canvas.toggle_seam_analyzer, "Seams", Style(button_text_size=24, button_text_padding=(24, 6)))
+    bottom_panel.add_button(seam_analyzer_button)
+    seam_score_text = Text(canvas.get_seam_score_text, 24, (255, 255, 255), (display.get_width() - 580, 8))
+    bottom_panel.add_text(seam_score_text)
+
     # Bottom panel zoom buttons and text
     zoom_text = Text(canvas.get_zoom_text, 24, (255, 255, 255), (display.get_width() - 160, 8))
     bottom_panel.add_text(zoom_text)
@@ -78,42 +80,130 @@ def main():
 
 
     # Create tools panel and make it a child of the main panel
-    tools_panel = Panel((display.get_width() - 220, 100, 200, 400), False).set_caption("Brush tools")
+    tools_panel = Panel((display.get_width() - 220, 100, 200, 540), False).set_caption("Brush tools")
     main_panel.add_panel(tools_panel)
 
     # Tools panel brush options
-    pixel_button = Button((20, 20, 160, 40), brush.set_brush_pixel, "Pixel")
+    pixel_button = Button((20, 20, 75, 40), brush.set_brush_pixel, "Pixel", Style(button_text_size=24, button_text_padding=(16, 12)))
     tools_panel.add_button(pixel_button)
-    brush_button = Button((20, 80, 160, 40), brush.set_brush_brush, "Brush")
+    brush_button = Button((105, 20, 75, 40), brush.set_brush_brush, "Brush", Style(button_text_size=24, button_text_padding=(13, 12)))
     tools_panel.add_button(brush_button)
-    circle_button = Button((20, 140, 160, 40), brush.set_brush_circle, "Circle")
+    circle_button = Button((20, 80, 75, 40), brush.set_brush_circle, "Circle", Style(button_text_size=24, button_text_padding=(10, 12)))
     tools_panel.add_button(circle_button)
+    bucket_button = Button((105, 80, 75, 40), brush.set_brush_bucket, "Bucket", Style(button_text_size=24, button_text_padding=(8, 12)))
+    tools_panel.add_button(bucket_button)
+
+    # Tools panel shape options (dragged out from one point to another)
+    line_button = Button((20, 140, 75, 40), brush.set_brush_line, "Line", Style(button_text_size=24, button_text_padding=(20, 12)))
+    tools_panel.add_button(line_button)
+    rectangle_button = Button((105, 140, 75, 40), brush.set_brush_rectangle, "Rect", Style(button_text_size=24, button_text_padding=(18, 12)))
+    tools_panel.add_button(rectangle_button)
+    ellipse_button = Button((20, 200, 75, 40), brush.set_brush_ellipse, "Ellipse", Style(button_text_size=24, button_text_padding=(9, 12)))
+    tools_panel.add_button(ellipse_button)
 
     # Tools panel brush size settings and text
-    brush_size_title_text = Text("Size", 32, (255, 255, 255), (72, 200))
+    brush_size_title_text = Text("Size", 32, (255, 255, 255), (72, 260))
     tools_panel.add_text(brush_size_title_text)
-    brush_size_text = Text(brush.get_brush_size_text, 32, (255, 255, 255), (90, 230))
+    brush_size_text = Text(brush.get_brush_size_text, 32, (255, 255, 255), (90, 290))
     tools_panel.add_text(brush_size_text)
-    increase_brush_size_button = Button((140, 220, 40, 40), brush.increase_brush_size, "+", Style(button_text_size=48, button_text_padding=(10, 1)))
+    increase_brush_size_button = Button((140, 280, 40, 40), brush.increase_brush_size, "+", Style(button_text_size=48, button_text_padding=(10, 1)))
     tools_panel.add_button(increase_brush_size_button)
-    decrease_brush_size_button = Button((20, 220, 40, 40), brush.decrease_brush_size, "-", Style(button_text_size=48, button_text_padding=(14, 2)))
+    decrease_brush_size_button = Button((20, 280, 40, 40), brush.decrease_brush_size, "-", Style(button_text_size=48, button_text_padding=(14, 2)))
     tools_panel.add_button(decrease_brush_size_button)
 
     # Color selector settings and text
-    brush_color_text = Text("Color", 32, brush.color, (70, 280))
+    brush_color_text = Text("Color", 32, brush.color, (70, 340))
     tools_panel.add_text(brush_color_text)
-    brush_rgb_text = Text("R             G             B", 24, (255, 255, 255), (32, 300))
+    brush_rgb_text = Text("R             G             B", 24, (255, 255, 255), (32, 360))
     tools_panel.add_text(brush_rgb_text)
-    red_slider = Slider((32, 320), 0, 255, (255, 0, 0))
+    red_slider = Slider((32, 380), 0, 255, (255, 0, 0))
     tools_panel.add_slider(red_slider)
     red_slider.percentage = brush.color[0] / 255 # Set default red value
-    green_slider = Slider((96, 320), 0, 255, (0, 255, 0))
+    green_slider = Slider((96, 380), 0, 255, (0, 255, 0))
     tools_panel.add_slider(green_slider)
     green_slider.percentage = brush.color[1] / 255 # Set default green value
-    blue_slider = Slider((160, 320), 0, 255, (0, 0, 255))
+    blue_slider = Slider((160, 380), 0, 255, (0, 0, 255))
     tools_panel.add_slider(blue_slider)
     blue_slider.percentage = brush.color[2] / 255 # Set default blue value
 
+    # Bucket fill tolerance settings and text
+    tolerance_title_text = Text("Tolerance", 32, (255, 255, 255), (44, 460))
+    tools_panel.add_text(tolerance_title_text)
+    tolerance_text = Text(brush.get_tolerance_text, 32, (255, 255, 255), (86, 490))
+    tools_panel.add_text(tolerance_text)
+    increase_tolerance_button = Button((140, 480, 40, 40), brush.increase_tolerance, "+", Style(button_text_size=48, button_text_padding=(10, 1)))
+    tools_panel.add_button(increase_tolerance_button)
+    decrease_tolerance_button = Button((20, 480, 40, 40), brush.decrease_tolerance, "-", Style(button_text_size=48, button_text_padding=(14, 2)))
+    tools_panel.add_button(decrease_tolerance_button)
+
+
+    # Create layers panel and make it a child of the main panel
+    layers_panel = Panel((20, 100, 200, 340), False).set_caption("Layers")
+    main_panel.add_panel(layers_panel)
+
+    # Layers panel active layer text and selection
+    layer_text = Text(canvas.get_layer_text, 24, (255, 255, 255), (10, 12))
+    layers_panel.add_text(layer_text)
+    select_layer_below_button = Button((20, 40, 75, 34), canvas.select_layer_below, "Below", Style(button_text_size=24, button_text_padding=(12, 9)))
+    layers_panel.add_button(select_layer_below_button)
+    select_layer_above_button = Button((105, 40, 75, 34), canvas.select_layer_above, "Above", Style(button_text_size=24, button_text_padding=(12, 9)))
+    layers_panel.add_button(select_layer_above_button)
+
+    # Layers panel options for adding, removing, and reordering layers
+    add_layer_button = Button((20, 84, 75, 34), canvas.add_layer, "Add", Style(button_text_size=24, button_text_padding=(21, 9)))
+    layers_panel.add_button(add_layer_button)
+    remove_layer_button = Button((105, 84, 75, 34), canvas.remove_layer, "Delete", Style(button_text_size=24, button_text_padding=(9, 9)))
+    layers_panel.add_button(remove_layer_button)
+    lower_layer_button = Button((20, 128, 75, 34), canvas.lower_layer, "Lower", Style(button_text_size=24, button_text_padding=(13, 9)))
+    layers_panel.add_button(lower_layer_button)
+    raise_layer_button = Button((105, 128, 75, 34), canvas.raise_layer, "Raise", Style(button_text_size=24, button_text_padding=(15, 9)))
+    layers_panel.add_button(raise_layer_button)
+
+    # Layers panel settings of the active layer
+    toggle_layer_visibility_button = Button((20, 172, 160, 34), canvas.toggle_layer_visibility, "Show / hide", Style(button_text_size=24, button_text_padding=(34, 9)))
+    layers_panel.add_button(toggle_layer_visibility_button)
+    layer_opacity_text = Text(canvas.get_layer_opacity_text, 24, (255, 255, 255), (52, 224))
+    layers_panel.add_text(layer_opacity_text)
+    increase_layer_opacity_button = Button((150, 216, 30, 30), canvas.increase_layer_opacity, "+", Style(button_text_padding=(8, 3)))
+    layers_panel.add_button(increase_layer_opacity_button)
+    decrease_layer_opacity_button = Button((20, 216, 30, 30), canvas.decrease_layer_opacity, "-", Style(button_text_padding=(11, 4)))
+    layers_panel.add_button(decrease_layer_opacity_button)
+    cycle_blend_mode_button = Button((20, 258, 160, 34), canvas.cycle_blend_mode, "Blend mode", Style(button_text_size=24, button_text_padding=(32, 9)))
+    layers_panel.add_button(cycle_blend_mode_button)
+    blend_mode_text = Text(canvas.get_blend_mode_text, 24, (255, 255, 255), (20, 304))
+    layers_panel.add_text(blend_mode_text)
+
+    # The layers panel starts closed
+    layers_panel.toggle_visibility()
+
+    # Layers panel toggle visibility button
+    toggle_layers_button = Button((display.get_width() - 690, 2, 100, 26), layers_panel.toggle_visibility, "Layers", Style(button_text_size=24, button_text_padding=(20, 6)))
+    bottom_panel.add_button(toggle_layers_button)
+
+
+    # Create tileset panel and make it a child of the main panel
+    tileset_panel = Panel((20, display.get_height() - 170, 760, 130), False).set_caption("Tileset")
+    main_panel.add_panel(tileset_panel)
+
+    # Tileset panel open options and text
+    open_tileset_folder_button = Button((4, 4, 130, 26), canvas.open_tileset_folder, "Open folder", Style(button_text_size=24, button_text_padding=(16, 6)))
+    tileset_panel.add_button(open_tileset_folder_button)
+    open_spritesheet_button = Button((140, 4, 130, 26), canvas.open_spritesheet, "Open sheet", Style(button_text_size=24, button_text_padding=(18, 6)))
+    tileset_panel.add_button(open_spritesheet_button)
+    atlas_text = Text(canvas.get_atlas_text, 24, (255, 255, 255), (282, 10))
+    tileset_panel.add_text(atlas_text)
+
+    # Tileset panel thumbnails of the tiles (scroll with the mouse wheel)
+    thumbnail_strip = ThumbnailStrip((4, 34, 752, 92), canvas)
+    tileset_panel.add_canvas(thumbnail_strip)
+
+    # The tileset panel starts closed
+    tileset_panel.toggle_visibility()
+
+    # Tileset panel toggle visibility button
+    toggle_tileset_button = Button((display.get_width() - 800, 2, 100, 26), tileset_panel.toggle_visibility, "Tiles", Style(button_text_size=24, button_text_padding=(28, 6)))
+    bottom_panel.add_button(toggle_tileset_button)
+
 
     # Tools panel toggle visibility button
     toggle_brush_tools_button = Button((display.get_width() - 164, 4, 160, 40), tools_panel.toggle_visibility, "Brush tools")
@@ -121,17 +211,97 @@ def main():
 
 
     # Toggle tiling button
-    toggle_tiling_button = Button((display.get_width() - 328, 4, 160, 40), modules.settings.toggle_tiling, "Toggle tiling")
+    toggle_tiling_button = Button((display.get_width() - 328, 4, 76, 40), modules.settings.toggle_tiling, "Tiling", Style(button_text_size=24, button_text_padding=(17, 12)))
     top_panel.add_button(toggle_tiling_button)
 
+    # Tiling pattern button (see modules/tile_patterns.py)
+    tiling_pattern_button = Button((display.get_width() - 248, 4, 80, 40), modules.settings.cycle_tiling_pattern, "Pattern", Style(button_text_size=24, button_text_padding=(11, 12)))
+    top_panel.add_button(tiling_pattern_button)
+    tiling_pattern_text = Text(modules.settings.get_tiling_pattern_text, 20, (255, 255, 255), (display.get_width() - 324, 45))
+    top_panel.add_text(tiling_pattern_text)
+
+    # Seamless tile buttons
+    offset_half_button = Button((display.get_width() - 492, 4, 160, 40), canvas.offset_image_half, "Offset half")
+    top_panel.add_button(offset_half_button)
+    blend_seams_button = Button((display.get_width() - 656, 4, 160, 40), canvas.blend_seams, "Blend seams")
+    top_panel.add_button(blend_seams_button)
+
+
+    # Return the UI elements that the frame loop (or anything else) needs to reach
+    return SimpleNamespace(main_panel=main_panel, brush=brush, canvas=canvas, top_panel=top_panel, bottom_panel=bottom_panel, coords_text=coords_text, image_task_text=image_task_text, zoom_text=zoom_text, increment_zoom_button=increment_zoom_button, decrement_zoom_button=decrement_zoom_button, tools_panel=tools_panel, brush_size_text=brush_size_text, tolerance_text=tolerance_text, brush_color_text=brush_color_text, red_slider=red_slider, green_slider=green_slider, blue_slider=blue_slider, toggle_brush_tools_button=toggle_brush_tools_button, toggle_tiling_button=toggle_tiling_button, tiling_pattern_button=tiling_pattern_button, tiling_pattern_text=tiling_pattern_text, offset_half_button=offset_half_button, blend_seams_button=blend_seams_button, seam_analyzer_button=seam_analyzer_button, seam_score_text=seam_score_text, layers_panel=layers_panel, toggle_layers_button=toggle_layers_button, tileset_panel=tileset_panel, thumbnail_strip=thumbnail_strip, toggle_tileset_button=toggle_tileset_button)
+
+def main():
+    print("INSTRUCTIONS:")
+    print("Open an image file")
+    print("Left click to paint")
+    print("Middle click to use a color picker at the mouse position")
+    print("Right click and drag to pan")
+    print("Scroll to zoom")
+    print("Use the on-screen controls for everything else")
+    
+
+    # Initialize pygame
+    pygame.init()
+    window_caption = "Tile Art Helper"
+    pygame.display.set_caption(window_caption)
+    display = pygame.display.set_mode((1280, 720), pygame.RESIZABLE)
+
+
+    # Create the brush, the canvas, and every UI element
+    ui = create_ui(display)
+    main_panel = ui.main_panel
+    brush = ui.brush
+    canvas = ui.canvas
+    top_panel = ui.top_panel
+    bottom_panel = ui.bottom_panel
+    zoom_text = ui.zoom_text
+    increment_zoom_button = ui.increment_zoom_button
+    decrement_zoom_button = ui.decrement_zoom_button
+    tools_panel = ui.tools_panel
+    brush_color_text = ui.brush_color_text
+    red_slider = ui.red_slider
+    green_slider = ui.green_slider
+    blue_slider = ui.blue_slider
+    toggle_brush_tools_button = ui.toggle_brush_tools_button
+    toggle_tiling_button = ui.toggle_tiling_button
+    tiling_pattern_button = ui.tiling_pattern_button
+    tiling_pattern_text = ui.tiling_pattern_text
+    offset_half_button = ui.offset_half_button
+    blend_seams_button = ui.blend_seams_button
+    seam_analyzer_button = ui.seam_analyzer_button
+    seam_score_text = ui.seam_score_text
+    layers_panel = ui.layers_panel
+    toggle_layers_button = ui.toggle_layers_button
+    tileset_panel = ui.tileset_panel
+    thumbnail_strip = ui.thumbnail_strip
+    toggle_tileset_button = ui.toggle_tileset_button
+
 
     # Frame loop (repeats every frame the program is open)
 
+    # UI panel positions and sizes from the previous frame, used to tell when the whole display needs to be updated
+    previous_panel_rects = None
+    # True when the whole display must be updated on the next render (for example after the window was uncovered)
+    full_display_update = True
+    # Where the profiling HUD was drawn on the previous render, so that it gets cleared when it shrinks
+    previous_hud_rect = None
+
+    # Decides when to render and when to sleep
+    scheduler = FrameScheduler()
+    # True while something is going on that needs frames to keep coming even without new events
+    busy = True
+
     running = True
     while running:
-        for event in pygame.event.get():
+        events = scheduler.get_events(busy)
+        # Start measuring the frame after the wait for events, so that idle time is not counted
+        modules.profiler.begin_frame()
+        modules.profiler.start_timer('events')
+        for event in events:
             if event.type == pygame.QUIT:
                 running = False
+            if event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED, pygame.WINDOWRESTORED):
+                full_display_update = True
             if event.type == pygame.VIDEORESIZE:
                 # When the window is resized, resize and move every UI element that is based on the display size.
                 main_panel.size = display.get_size()
@@ -146,8 +316,21 @@ def main():
                 increment_zoom_button.local_x = display.get_width() - 60
                 decrement_zoom_button.local_x = display.get_width() - 190
                 toggle_brush_tools_button.local_x = display.get_width() - 164
+                toggle_tiling_button.local_x = display.get_width() - 328
+                tiling_pattern_button.local_x = display.get_width() - 248
+                tiling_pattern_text.local_x = display.get_width() - 324
+                offset_half_button.local_x = display.get_width() - 492
+                blend_seams_button.local_x = display.get_width() - 656
+                seam_analyzer_button.local_x = display.get_width() - 400
+                seam_score_text.local_x = display.get_width() - 580
+                toggle_layers_button.local_x = display.get_width() - 690
+                toggle_tileset_button.local_x = display.get_width() - 800
 
                 tools_panel.keep_on_screen()
+                if layers_panel.visible:
+                    layers_panel.keep_on_screen()
+                if tileset_panel.visible:
+                    tileset_panel.keep_on_screen()
             if event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_ESCAPE:
                     running = False
@@ -158,6 +341,30 @@ def main():
                         canvas.save_as()
                     else:
                         canvas.save_image()
+                if event.key == pygame.K_z and event.mod & pygame.KMOD_CTRL:
+                    if event.mod & pygame.KMOD_SHIFT:
+                        canvas.redo()
+                    else:
+                        canvas.undo()
+                if event.key == pygame.K_y and event.mod & pygame.KMOD_CTRL:
+                    canvas.redo()
+                if event.mod & pygame.KMOD_ALT:
+                    # Alt + arrow keys move the image by a pixel, wrapping around the edges
+                    if event.key == pygame.K_LEFT:
+                        canvas.offset_image(-1, 0)
+                    if event.key == pygame.K_RIGHT:
+                        canvas.offset_image(1, 0)
+                    if event.key == pygame.K_UP:
+                        canvas.offset_image(0, -1)
+                    if event.key == pygame.K_DOWN:
+                        canvas.offset_image(0, 1)
+                if event.key == pygame.K_F3:
+                    # Show or hide the profiling HUD
+                    modules.profiler.toggle_hud()
+                    full_display_update = True
+                if event.key == pygame.K_F4:
+                    # Start or stop recording a trace of every frame (Shift+F4 records json instead of csv)
+                    modules.profiler.toggle_trace('json' if event.mod & pygame.KMOD_SHIFT else 'csv')
             if event.type == pygame.MOUSEMOTION:
                 main_panel.mouse_moved(event.rel)
             if event.type == pygame.MOUSEBUTTONDOWN:
@@ -165,15 +372,19 @@ def main():
                     main_panel.left_mouse_down()
                 if event.button == 2:
                     if canvas.image_loaded:
-                        # Pick the color at the mouse position (alpha not yet supported)
-                        new_color = canvas.loaded_image.get_at((int((event.pos[0] - canvas.scroll[0]) % math.floor(canvas.loaded_image.get_width() * canvas.zoom) / canvas.zoom), int((event.pos[1] - canvas.scroll[1]) % math.floor(canvas.loaded_image.get_height() * canvas.zoom) / canvas.zoom)))
+                        # Pick the color of the flattened layers at the mouse position (alpha not yet supported)
+                        view_image = canvas.get_view_image()
+                        new_color = view_image.get_at((int((event.pos[0] - canvas.scroll[0]) % math.floor(view_image.get_width() * canvas.zoom) / canvas.zoom), int((event.pos[1] - canvas.scroll[1]) % math.floor(view_image.get_height() * canvas.zoom) / canvas.zoom)))
                         red_slider.percentage = new_color[0] / 255
                         green_slider.percentage = new_color[1] / 255
                         blue_slider.percentage = new_color[2] / 255
             if event.type == pygame.MOUSEBUTTONUP:
                 if event.button == 1:
                     main_panel.left_mouse_up()
-            if event.type == pygame.MOUSEWHEEL:
+            if event.type == pygame.MOUSEWHEEL and thumbnail_strip.is_hovered:
+                # Scroll the thumbnails of the tileset instead of zooming
+                thumbnail_strip.scroll_by(event.y)
+            elif event.type == pygame.MOUSEWHEEL:
                 # Zooming
                 # If the mouse wheel is scrolled, manually update the canvas's zoom.
                 
@@ -198,8 +409,11 @@ def main():
                 canvas.scroll[0] += (previous_scaled_mouse_pos[0] - new_scaled_mouse_pos[0]) * canvas.zoom
                 canvas.scroll[1] += (previous_scaled_mouse_pos[1] - new_scaled_mouse_pos[1]) * canvas.zoom
 
+        modules.profiler.stop_timer('events')
+
         # Calculate which UI element(s) the mouse is hovering over (if any)
-        main_panel.mouse_over(main_panel.get_global_bounding_rect().collidepoint(pygame.mouse.get_pos()))
+        with modules.profiler.measure('mouse_over'):
+            main_panel.mouse_over(main_panel.get_global_bounding_rect().collidepoint(pygame.mouse.get_pos()))
 
                         
         # Panning
@@ -227,19 +441,61 @@ def main():
         
 
         # Rendering
-
-        # Clear display
-        display.fill((0, 0, 0))
-
-        # Render main panel and all its children
-        main_panel.render(display)
-
-        # Update pygame display and tick the pygame clock
-        pygame.display.update()
-        pygame.time.Clock().tick(60)
+        # When rendering is slow, some frames are skipped so that input keeps being handled. Nothing is lost, since the canvas paints everything collected since the last render.
+        rendered = scheduler.should_render(events)
+        if rendered:
+            scheduler.begin_render()
+
+            # Clear display
+            display.fill((0, 0, 0))
+
+            # Render main panel and all its children
+            with modules.profiler.measure('render'):
+                main_panel.render(display)
+
+            # Draw the profiling HUD below the top panel, showing the previous frames
+            hud_rects = [previous_hud_rect] if previous_hud_rect is not None else []
+            previous_hud_rect = None
+            if modules.profiler.hud_enabled:
+                previous_hud_rect = modules.profiler.render_hud(display, (8, top_panel.height + 8))
+                if previous_hud_rect is not None:
+                    hud_rects.append(previous_hud_rect)
+
+            # Update pygame display
+            # Only the parts of the display that may have changed are updated: the painted parts of the canvas and the UI panels that were redrawn.
+            # If the canvas changed as a whole or a panel was moved, opened, or closed, the whole display is updated.
+            canvas_screen_rects = canvas.get_dirty_screen_rects()
+            panel_rects = [panel.get_global_bounding_rect() for panel in main_panel.panels]
+            with modules.profiler.measure('display_update'):
+                if full_display_update or canvas_screen_rects is None or panel_rects != previous_panel_rects:
+                    pygame.display.update()
+                else:
+                    pygame.display.update(canvas_screen_rects + [panel.get_global_bounding_rect() for panel in main_panel.panels if panel.was_redrawn] + hud_rects)
+            previous_panel_rects = panel_rects
+            full_display_update = False
+
+            scheduler.end_render()
+
+        modules.profiler.end_frame(rendered, canvas.zoom)
+
+        # Keep frames coming while there is input, painting, panning, an image being opened or saved, or tiles being decoded. Otherwise the next frame waits for an event.
+        busy = len(events) > 0 or canvas.brush_down or pygame.mouse.get_pressed()[2] or canvas.image_task is not None or (canvas.atlas is not None and canvas.atlas.is_busy())
+
+        # Tick the pygame clock
+        scheduler.tick()
 
     # Loop exited
+    # Let an image that is being saved finish writing, so the file is not cut off. A save that failed marks the image as unsaved again.
+    if canvas.image_task is not None:
+        canvas.image_task.wait()
+        canvas.update_image_task()
+    # The journal is kept if there are unsaved changes, so they are recovered the next time the image is opened
+    canvas.close_journal()
+    modules.profiler.stop_trace()
     pygame.quit()    
 
 if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'batch':
+        # Command line batch mode, without a window
+        sys.exit(modules.batch.main(sys.argv[2:]))
     main()